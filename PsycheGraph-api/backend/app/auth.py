@@ -2,9 +2,12 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
 import secrets
 import string
+import uuid
 
 def generate_license_key(length=8):
     alphabet = string.ascii_uppercase + string.digits
@@ -23,6 +26,76 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+
+# -------------------------------------------------------------------
+# Password hashing pool — bcrypt runs off the event loop
+# -------------------------------------------------------------------
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+
+class PasswordHashingBusy(Exception):
+    """Raised when the hashing pool is saturated — mapped to 503 in main.py."""
+
+
+class PasswordHashingPool:
+    """
+    Dedicated executor for bcrypt. At most `workers` hashes run at once and
+    at most `max_queue` more may wait; beyond that callers are rejected
+    immediately instead of piling up behind a login storm.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+        self._in_flight = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        # Only touched from the event loop thread, so no lock is needed
+        if self._in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHashingBusy()
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.workers),
+            "rejected": self.rejected,
+        }
+
+
+hashing_pool = PasswordHashingPool()
+
+
+async def verify_password_async(plain_password, hashed_password):
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+
+async def hash_password_async(password):
+    return await hashing_pool.run(get_password_hash, password)
+
+def build_claims(principal) -> dict:
+    """Authorization claims for access tokens — enough to authorize without loading the User row."""
+    role_str = principal.role.value if hasattr(principal.role, "value") else str(principal.role)
+    return {
+        "sub": principal.email,
+        "role": role_str,
+        "uid": principal.id,
+        "org": principal.organization_id,
+        "dpid": principal.doctor_profile_id,
+        "dids": list(principal.assigned_doctor_user_ids),
+        "cv": principal.claims_version,
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -39,6 +112,6 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire, "type": "refresh", "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
\ No newline at end of file
@@ -0,0 +1,55 @@
+from typing import Awaitable, Callable
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger("background")
+
+# job name → {"runs", "failures", "skipped", "last_run", "last_seconds", "last_error"}
+job_status: dict = {}
+
+
+async def _run_once(engine, name: str, lock_key: int, job: Callable[[], Awaitable]) -> None:
+    status = job_status[name]
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:key);"), {"key": lock_key})).scalar()
+        if not locked:
+            # Another worker owns this run
+            status["skipped"] += 1
+            return
+        started = time.monotonic()
+        try:
+            await job()
+            status["runs"] += 1
+            status["last_error"] = None
+        except Exception as e:
+            status["failures"] += 1
+            status["last_error"] = str(e)
+            logger.error(f"Background job {name} failed: {e}")
+        finally:
+            status["last_run"] = time.time()
+            status["last_seconds"] = round(time.monotonic() - started, 3)
+            await conn.execute(text("SELECT pg_advisory_unlock(:key);"), {"key": lock_key})
+
+
+async def run_periodically(engine, name: str, interval_seconds: float, lock_key: int, job: Callable[[], Awaitable]):
+    """
+    Runs `job` every `interval_seconds` for the lifetime of the app. Every
+    worker schedules it, but a pg advisory try-lock lets only one of them
+    run a given tick; the rest skip it. Errors are logged and retried on
+    the next tick rather than killing the loop.
+    """
+    job_status[name] = {"runs": 0, "failures": 0, "skipped": 0, "last_run": None, "last_seconds": None, "last_error": None}
+    while True:
+        try:
+            await _run_once(engine, name, lock_key, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job_status[name]["failures"] += 1
+            job_status[name]["last_error"] = str(e)
+            logger.error(f"Background job {name} could not start: {e}")
+        await asyncio.sleep(interval_seconds)
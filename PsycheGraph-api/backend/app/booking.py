@@ -0,0 +1,180 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Integer, String, Text, cast, column, insert, literal, select, update, values
+from sqlalchemy.orm import aliased
+
+from . import models
+
+A = models.Availability
+APT = models.Appointment
+
+
+# -------------------------------------------------------------------
+# Atomic booking
+#
+# A slot is claimed and its appointment inserted by one statement:
+#
+#   WITH claimed AS (UPDATE availabilities SET is_booked = true
+#                    WHERE <slot> AND is_booked = false RETURNING …)
+#   INSERT INTO appointments (…) SELECT … FROM claimed RETURNING …
+#
+# Concurrent bookers of one slot queue on its row lock; once the winner
+# commits, the others' UPDATE re-checks is_booked, matches nothing and
+# inserts nothing — an empty result rather than a late constraint error.
+# For "any slot in a window" the candidate is chosen with FOR UPDATE
+# SKIP LOCKED, so racers are handed different slots instead of queueing
+# on the same one.
+# -------------------------------------------------------------------
+
+_APPOINTMENT_COLUMNS = [
+    "patient_id", "doctor_id", "organization_id", "availability_id", "appointment_date",
+    "start_time", "end_time", "notes", "status", "patient_name", "patient_age",
+    "doctor_name", "booked_by_role", "created_by_id",
+]
+
+
+def slot_by_id(availability_id: int):
+    return A.id == availability_id
+
+
+def first_open_slot(doctor_id: int, window_start: datetime, window_end: datetime):
+    """The earliest open slot of the doctor in [window_start, window_end) nobody else is claiming right now."""
+    open_slot = aliased(A)
+    candidate = (
+        select(open_slot.id)
+        .where(
+            open_slot.doctor_id == doctor_id,
+            open_slot.is_booked == False,
+            open_slot.start_time >= window_start,
+            open_slot.start_time < window_end
+        )
+        .order_by(open_slot.start_time, open_slot.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return A.id == candidate
+
+
+def booking_statement(slot_filter, patient, notes: Optional[str], booked_by):
+    claimed = (
+        update(A)
+        .where(slot_filter, A.is_booked == False)
+        .values(is_booked=True)
+        .returning(A.id, A.doctor_id, A.organization_id, A.start_time, A.end_time)
+        .cte("claimed")
+    )
+    doctor = aliased(models.User)
+    source = (
+        select(
+            literal(patient.id, Integer),
+            claimed.c.doctor_id,
+            claimed.c.organization_id,
+            claimed.c.id,
+            claimed.c.start_time,
+            claimed.c.start_time,
+            claimed.c.end_time,
+            literal(notes, Text),
+            literal(models.AppointmentStatus.SCHEDULED, APT.__table__.c.status.type),
+            literal(patient.full_name, String),
+            literal(patient.age, Integer),
+            doctor.full_name,
+            literal(booked_by.role.value, String),
+            literal(booked_by.id, Integer),
+        )
+        .select_from(claimed)
+        .outerjoin(doctor, doctor.id == claimed.c.doctor_id)
+    )
+    # add_cte puts the data-modifying WITH at the top level, where Postgres requires it
+    return (
+        insert(APT)
+        .from_select(_APPOINTMENT_COLUMNS, source)
+        .add_cte(claimed)
+        .returning(APT.id, APT.doctor_id, APT.organization_id, APT.availability_id, APT.start_time, APT.end_time)
+    )
+
+
+async def book_slot(db, slot_filter, patient, notes: Optional[str], booked_by):
+    """Claims the slot and inserts its appointment; None when no open slot matched (taken, or never existed)."""
+    result = await db.execute(booking_statement(slot_filter, patient, notes, booked_by))
+    return result.first()
+
+
+# -------------------------------------------------------------------
+# Bulk booking
+#
+# Many (slot, patient) pairs in one statement: the pairs travel as a
+# VALUES list, the slots are locked in id order (so two overlapping
+# bulk bookings queue instead of deadlocking), the open ones are
+# claimed, and one multi-row INSERT creates their appointments. Pairs
+# whose slot was taken meanwhile are simply absent from the result.
+# -------------------------------------------------------------------
+
+# (availability_id, patient_id, patient_name, patient_age, notes)
+BulkRow = Tuple[int, int, Optional[str], Optional[int], Optional[str]]
+
+
+def bulk_booking_statement(rows: List[BulkRow], booked_by):
+    requested = values(
+        column("availability_id", Integer),
+        column("patient_id", Integer),
+        column("patient_name", String),
+        column("patient_age", Integer),
+        column("notes", Text),
+        name="requested"
+    ).data(rows)
+    slot = aliased(A)
+    locked = (
+        select(slot.id)
+        .where(slot.id.in_([row[0] for row in rows]))
+        .order_by(slot.id)
+        .with_for_update()
+    )
+    claimed = (
+        update(A)
+        .where(A.id.in_(locked.scalar_subquery()), A.is_booked == False)
+        .values(is_booked=True)
+        .returning(A.id, A.doctor_id, A.organization_id, A.start_time, A.end_time)
+        .cte("claimed")
+    )
+    doctor = aliased(models.User)
+    source = (
+        select(
+            requested.c.patient_id,
+            claimed.c.doctor_id,
+            claimed.c.organization_id,
+            claimed.c.id,
+            claimed.c.start_time,
+            claimed.c.start_time,
+            claimed.c.end_time,
+            requested.c.notes,
+            literal(models.AppointmentStatus.SCHEDULED, APT.__table__.c.status.type),
+            requested.c.patient_name,
+            # An all-NULL VALUES column comes out as text; pin it back to the column type
+            cast(requested.c.patient_age, Integer),
+            doctor.full_name,
+            literal(booked_by.role.value, String),
+            literal(booked_by.id, Integer),
+        )
+        .select_from(claimed)
+        .join(requested, requested.c.availability_id == claimed.c.id)
+        .outerjoin(doctor, doctor.id == claimed.c.doctor_id)
+    )
+    return (
+        insert(APT)
+        .from_select(_APPOINTMENT_COLUMNS, source)
+        .add_cte(claimed)
+        .returning(
+            APT.id, APT.patient_id, APT.doctor_id, APT.organization_id, APT.availability_id,
+            APT.start_time, APT.end_time
+        )
+    )
+
+
+async def book_slots(db, rows: List[BulkRow], booked_by) -> list:
+    """Claims every open slot in `rows` and inserts its appointment; one result row per booking made."""
+    if not rows:
+        return []
+    result = await db.execute(bulk_booking_statement(rows, booked_by))
+    return result.all()
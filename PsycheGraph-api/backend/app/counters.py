@@ -0,0 +1,280 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional
+import logging
+import os
+
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from .parallel import run_parallel
+from .models import Appointment, Availability, Patient, Session, StatsCounter, User
+
+logger = logging.getLogger("counters")
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# pg advisory lock id — one worker reconciles per tick
+STATS_RECONCILE_LOCK_KEY = 7_340_023
+STATS_RECONCILE_SECONDS = int(os.getenv("STATS_RECONCILE_SECONDS", 600))
+# Per-day appointment counters are kept this many days back
+DAY_COUNTER_RETENTION_DAYS = int(os.getenv("DAY_COUNTER_RETENTION_DAYS", 7))
+
+
+# -------------------------------------------------------------------
+# Dashboard counters
+#
+# stats_counters holds one row per (scope_type, scope_id, metric).
+# Write paths add deltas in their own transaction via bump(), so a
+# rolled-back request never moves a counter; /stats reads the rows it
+# needs by primary key. reconcile() recomputes everything periodically
+# to correct drift (cascading deletes, slots expiring, manual SQL).
+#
+#   global/0   organizations, users, patients
+#   org/<id>   doctors, patients, appointments, active_slots,
+#              appointments_on:<YYYY-MM-DD>
+#   user/<id>  doctors:      patients, appointments, sessions
+#              receptionists: patients_created
+# -------------------------------------------------------------------
+
+GLOBAL, ORG, USER = "global", "org", "user"
+
+
+def day_metric(day: date) -> str:
+    return f"appointments_on:{day.isoformat()}"
+
+
+def today_ist() -> date:
+    return datetime.now(IST).date()
+
+
+def now_ist_naive() -> datetime:
+    """Current IST wall-clock time in the naive form slots are stored in."""
+    return datetime.now(IST).replace(tzinfo=None)
+
+
+def is_future(start_time: datetime) -> bool:
+    return start_time.replace(tzinfo=None) >= now_ist_naive()
+
+
+class Deltas:
+    """Collects counter changes for one transaction; flush with bump()."""
+
+    def __init__(self):
+        self._values = defaultdict(int)
+
+    def add(self, scope_type: str, scope_id: Optional[int], metric: str, delta: int = 1) -> "Deltas":
+        if scope_id is not None and delta:
+            self._values[(scope_type, scope_id, metric)] += delta
+        return self
+
+    def items(self):
+        return [(k, v) for k, v in sorted(self._values.items()) if v]
+
+
+async def bump(db: AsyncSession, deltas: Deltas) -> None:
+    """
+    Applies deltas as one multi-row upsert in the caller's transaction.
+    Keys are sorted so concurrent requests lock counter rows in the same
+    order and can't deadlock each other.
+    """
+    items = deltas.items()
+    if not items:
+        return
+    stmt = insert(StatsCounter).values([
+        {"scope_type": s, "scope_id": i, "metric": m, "value": v} for (s, i, m), v in items
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StatsCounter.scope_type, StatsCounter.scope_id, StatsCounter.metric],
+        set_={"value": StatsCounter.value + stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+    )
+    await db.execute(stmt)
+
+
+def reassign_patient(deltas: Deltas, old_doctor_id: Optional[int], new_doctor_id: Optional[int]) -> Deltas:
+    if old_doctor_id != new_doctor_id:
+        deltas.add(USER, old_doctor_id, "patients", -1)
+        deltas.add(USER, new_doctor_id, "patients", +1)
+    return deltas
+
+
+def appointment_removed(deltas: Deltas, organization_id: int, doctor_id: int, start_time: datetime, status) -> Deltas:
+    deltas.add(ORG, organization_id, "appointments", -1)
+    deltas.add(USER, doctor_id, "appointments", -1)
+    if getattr(status, "value", status) != "CANCELLED":
+        deltas.add(ORG, organization_id, day_metric(start_time.date()), -1)
+    return deltas
+
+
+async def patient_removed(db: AsyncSession, patient, deltas: Deltas) -> Deltas:
+    """
+    Deltas for deleting a patient, including the appointments and sessions
+    the ORM cascade deletes with it. Must run before the delete is flushed.
+    """
+    deltas.add(GLOBAL, 0, "patients", -1)
+    deltas.add(ORG, patient.organization_id, "patients", -1)
+    deltas.add(USER, patient.doctor_id, "patients", -1)
+    deltas.add(USER, patient.created_by_id, "patients_created", -1)
+
+    appointments = await db.execute(
+        select(Appointment.organization_id, Appointment.doctor_id, Appointment.start_time, Appointment.status)
+        .where(Appointment.patient_id == patient.id)
+    )
+    for row in appointments:
+        appointment_removed(deltas, row.organization_id, row.doctor_id, row.start_time, row.status)
+
+    sessions = await db.execute(
+        select(Session.doctor_id, func.count()).where(Session.patient_id == patient.id).group_by(Session.doctor_id)
+    )
+    for doctor_id, n in sessions:
+        deltas.add(USER, doctor_id, "sessions", -n)
+    return deltas
+
+
+async def user_removed(db: AsyncSession, user, deltas: Deltas) -> Deltas:
+    """
+    Deltas for deleting a staff user, including a doctor's future open
+    slots (cascade-deleted with them), and drops the user's own counters.
+    """
+    deltas.add(GLOBAL, 0, "users", -1)
+    if getattr(user.role, "value", user.role) == "DOCTOR":
+        deltas.add(ORG, user.organization_id, "doctors", -1)
+        open_slots = (await db.execute(
+            select(func.count(Availability.id)).where(
+                Availability.doctor_id == user.id,
+                Availability.is_booked == False,
+                Availability.start_time >= now_ist_naive(),
+            )
+        )).scalar()
+        deltas.add(ORG, user.organization_id, "active_slots", -open_slots)
+    await db.execute(
+        StatsCounter.__table__.delete().where(StatsCounter.scope_type == USER, StatsCounter.scope_id == user.id)
+    )
+    return deltas
+
+
+async def organization_removed(db: AsyncSession, organization_id: int, deltas: Deltas) -> Deltas:
+    """
+    Deltas for deleting an organization with its cascaded users and patients,
+    and drops the organization's own counter rows. Per-user counters of the
+    deleted staff are left for reconcile() to zero.
+    """
+    users = (await db.execute(select(func.count(User.id)).where(User.organization_id == organization_id))).scalar()
+    patients = (await db.execute(
+        select(func.count(Patient.id)).where(Patient.organization_id == organization_id)
+    )).scalar()
+    deltas.add(GLOBAL, 0, "organizations", -1)
+    deltas.add(GLOBAL, 0, "users", -users)
+    deltas.add(GLOBAL, 0, "patients", -patients)
+    await db.execute(
+        StatsCounter.__table__.delete().where(StatsCounter.scope_type == ORG, StatsCounter.scope_id == organization_id)
+    )
+    return deltas
+
+
+async def read(db: AsyncSession, keys: Iterable[tuple]) -> dict:
+    """(scope_type, scope_id, metric) → value for the requested keys; missing keys read as 0."""
+    keys = list(keys)
+    result = await db.execute(
+        select(StatsCounter.scope_type, StatsCounter.scope_id, StatsCounter.metric, StatsCounter.value)
+        .where(tuple_(StatsCounter.scope_type, StatsCounter.scope_id, StatsCounter.metric).in_(keys))
+    )
+    values = {(r.scope_type, r.scope_id, r.metric): r.value for r in result}
+    return {k: values.get(k, 0) for k in keys}
+
+
+# -------------------------------------------------------------------
+# Reconciliation — recompute from the source tables
+# -------------------------------------------------------------------
+
+# Each query yields (scope_type, scope_id, metric, value) for the
+# counter family (scope_type, metric pattern) it owns. Slot and
+# appointment times are naive IST wall-clock values, so "now" and
+# "today" come in as parameters rather than from the database clock.
+RECONCILE_QUERIES = [
+    (GLOBAL, "organizations", "SELECT 'global', 0, 'organizations', count(*) FROM organizations"),
+    (GLOBAL, "users", "SELECT 'global', 0, 'users', count(*) FROM users"),
+    (GLOBAL, "patients", "SELECT 'global', 0, 'patients', count(*) FROM patients"),
+    (ORG, "doctors", "SELECT 'org', organization_id, 'doctors', count(*) FROM users "
+     "WHERE role = 'DOCTOR' AND organization_id IS NOT NULL GROUP BY organization_id"),
+    (ORG, "patients", "SELECT 'org', organization_id, 'patients', count(*) FROM patients GROUP BY organization_id"),
+    (ORG, "appointments",
+     "SELECT 'org', organization_id, 'appointments', count(*) FROM appointments GROUP BY organization_id"),
+    (ORG, "active_slots", "SELECT 'org', organization_id, 'active_slots', count(*) FROM availabilities "
+     "WHERE is_booked = false AND start_time >= :now AND organization_id IS NOT NULL GROUP BY organization_id"),
+    (ORG, "appointments_on:%",
+     "SELECT 'org', organization_id, 'appointments_on:' || to_char(start_time AT TIME ZONE 'UTC', 'YYYY-MM-DD'), count(*) "
+     "FROM appointments WHERE start_time >= :since AND status <> 'CANCELLED' "
+     "GROUP BY organization_id, to_char(start_time AT TIME ZONE 'UTC', 'YYYY-MM-DD')"),
+    (USER, "patients",
+     "SELECT 'user', doctor_id, 'patients', count(*) FROM patients WHERE doctor_id IS NOT NULL GROUP BY doctor_id"),
+    (USER, "appointments", "SELECT 'user', doctor_id, 'appointments', count(*) FROM appointments GROUP BY doctor_id"),
+    (USER, "sessions", "SELECT 'user', doctor_id, 'sessions', count(*) FROM sessions GROUP BY doctor_id"),
+    (USER, "patients_created", "SELECT 'user', created_by_id, 'patients_created', count(*) FROM patients "
+     "WHERE created_by_id IS NOT NULL GROUP BY created_by_id"),
+]
+
+# The recount and the counter rows it corrects are read by one statement,
+# i.e. from one snapshot. Bumps commit together with the rows they count,
+# so (recount - counter) in that snapshot is exactly the drift, whatever
+# commits before or after it.
+_DRIFT_SQL = """
+WITH fresh (scope_type, scope_id, metric, value) AS ({counts}),
+snapshot AS (
+    SELECT scope_type, scope_id, metric, value FROM stats_counters
+    WHERE scope_type = :scope_type AND metric LIKE :metric AND metric >= :floor
+)
+SELECT scope_type, scope_id, metric, coalesce(fresh.value, 0) - coalesce(snapshot.value, 0) AS drift
+FROM fresh FULL OUTER JOIN snapshot USING (scope_type, scope_id, metric)
+WHERE coalesce(fresh.value, 0) <> coalesce(snapshot.value, 0)
+"""
+
+
+def reconcile_params() -> dict:
+    since = today_ist() - timedelta(days=DAY_COUNTER_RETENTION_DAYS)
+    return {"now": now_ist_naive(), "since": datetime.combine(since, datetime.min.time())}
+
+
+def drift_statements(params: dict) -> list:
+    """One (statement, params) per counter family, yielding (scope_type, scope_id, metric, drift)."""
+    # Day counters older than the recount window are deleted, not corrected
+    day_floor = day_metric(params["since"].date())
+    return [
+        (
+            text(_DRIFT_SQL.format(counts=sql)),
+            {**params, "scope_type": scope_type, "metric": metric,
+             "floor": day_floor if metric == "appointments_on:%" else ""},
+        )
+        for scope_type, metric, sql in RECONCILE_QUERIES
+    ]
+
+
+async def reconcile(engine, session_factory) -> None:
+    """
+    Recomputes every counter without locking stats_counters: the counts
+    run alongside live traffic, and only the measured drift is added to
+    each row afterwards — the same relative upsert bump() uses, so bumps
+    committed in the meantime are kept, not overwritten.
+    """
+    params = reconcile_params()
+    results = await run_parallel(session_factory, drift_statements(params))
+    deltas = Deltas()
+    for result in results:
+        for scope_type, scope_id, metric, drift in result:
+            deltas.add(scope_type, scope_id, metric, drift)
+    drifted = len(deltas.items())
+
+    cutoff = day_metric(params["since"].date())
+    async with engine.begin() as conn:
+        await bump(conn, deltas)
+        await conn.execute(
+            StatsCounter.__table__.delete().where(
+                StatsCounter.scope_type == ORG,
+                StatsCounter.metric.like("appointments_on:%"),
+                StatsCounter.metric < cutoff,
+            )
+        )
+    if drifted:
+        logger.info(f"Stats reconcile corrected {drifted} counter(s).")
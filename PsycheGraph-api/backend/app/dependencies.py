@@ -5,25 +5,41 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .database import get_db
 from .models import User, UserRole, Receptionist
 from .auth import SECRET_KEY, ALGORITHM
+from .principal import Principal, principal_cache, claim_versions
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
 security = HTTPBearer()
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
-    credentials_exception = HTTPException(
+
+def _credentials_exception(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
+        detail=detail,
         headers={"WWW-Authenticate": "Bearer"},
     )
-    token = credentials.credentials
+
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+
+async def load_principal(email: str, db: AsyncSession) -> Principal:
+    # Cache hit → no DB round trips at all, unless this worker has since
+    # seen a newer claims_version for the user (admin change)
+    principal = principal_cache.get(email)
+    if principal is not None:
+        known_version = claim_versions.get(principal.id)
+        if known_version is None or known_version == principal.claims_version:
+            return principal
+
+    generation = principal_cache.generation
 
     # Eagerly load both profiles + receptionist's doctors in one query
     # Missing selectinload(Receptionist.doctors) was causing hidden lazy loads on every request
@@ -38,15 +54,64 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user = result.scalars().first()
 
     if user is None:
-        raise credentials_exception
-    return user
+        raise _credentials_exception()
+
+    principal = Principal.from_user(user)
+    principal_cache.put(email, principal, generation)
+    return principal
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)) -> Principal:
+    payload = _decode_token(credentials.credentials)
+    return await load_principal(payload["sub"], db)
+
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_db)) -> Principal:
+    """
+    Authorizes from the signed access-token claims alone. The only possible
+    query is the claims_version check, a cached single-column PK lookup.
+    Tokens minted before claims were added fall back to get_current_user.
+    """
+    payload = _decode_token(credentials.credentials)
+    if payload.get("type") != "access" or "uid" not in payload or "cv" not in payload:
+        return await load_principal(payload["sub"], db)
+
+    await check_claims_version(payload["uid"], payload["cv"], db)
+    return Principal.from_claims(payload)
+
+
+async def check_claims_version(user_id: int, token_version: int, db: AsyncSession) -> None:
+    """Raises 401 if the user is gone or an admin changed them after the token was minted."""
+    version = claim_versions.get(user_id)
+    if version is None:
+        result = await db.execute(select(User.claims_version).where(User.id == user_id))
+        version = result.scalar()
+        if version is None:
+            raise _credentials_exception()
+        claim_versions.set(user_id, version)
+
+    if token_version != version:
+        raise _credentials_exception("Token is out of date, please refresh")
+
 
 def require_role(allowed_roles: list[UserRole]):
-    def role_checker(user: User = Depends(get_current_user)):
+    def role_checker(user: Principal = Depends(get_current_user)):
+        if user.role not in allowed_roles:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Operation not permitted for this role"
+            )
+        return user
+    return role_checker
+
+
+def require_role_claims(allowed_roles: list[UserRole]):
+    """Same as require_role, but authorizes from token claims (see get_current_claims)."""
+    def role_checker(user: Principal = Depends(get_current_claims)):
         if user.role not in allowed_roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Operation not permitted for this role"
             )
         return user
-    return role_checker
\ No newline at end of file
+    return role_checker
@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import time
+
+from sqlalchemy.future import select
+
+from . import models
+
+FREE_TIME_INDEX_TTL_SECONDS = int(os.getenv("FREE_TIME_INDEX_TTL_SECONDS", 30))
+FREE_TIME_INDEX_MAX_DAYS = int(os.getenv("FREE_TIME_INDEX_MAX_DAYS", 50000))
+# Widest window one free-time search may cover
+FREE_TIME_SEARCH_MAX_DAYS = int(os.getenv("FREE_TIME_SEARCH_MAX_DAYS", 31))
+
+MINUTES_PER_DAY = 24 * 60
+
+
+# -------------------------------------------------------------------
+# Free-time index
+#
+# Per (doctor, day): the day's slots keyed by start minute, and a
+# 1440-bit integer whose bit m is set when minute m is covered by an
+# unbooked slot. "Is Dr. X free for L minutes from T" is then one mask
+# test instead of a range scan. Days are loaded lazily (one query for
+# every missing doctor/day of a lookup), kept up to date by the
+# appointment handlers after each commit, and expire after a short TTL
+# so changes made by other workers show up within it.
+#
+# Times are naive IST wall-clock values, like every stored slot.
+# -------------------------------------------------------------------
+
+def _minute(value: datetime, round_up: bool = False) -> int:
+    minute = value.hour * 60 + value.minute
+    if round_up and (value.second or value.microsecond):
+        minute += 1
+    return minute
+
+
+def _run_mask(start: int, length: int) -> int:
+    return ((1 << length) - 1) << start
+
+
+@dataclass
+class DayIndex:
+    expires_at: float
+    # start minute -> (slot id, end minute, is_booked)
+    slots: Dict[int, Tuple[int, int, bool]] = field(default_factory=dict)
+    free: int = 0
+
+    def rebuild(self) -> None:
+        free = 0
+        for start, (_, end, booked) in self.slots.items():
+            if not booked and end > start:
+                free |= _run_mask(start, end - start)
+        self.free = free
+
+    def is_free(self, start: int, length: int) -> bool:
+        if start < 0 or start + length > MINUTES_PER_DAY:
+            return False
+        mask = _run_mask(start, length)
+        return self.free & mask == mask
+
+    def slot_ids(self, start: int, length: int) -> List[int]:
+        """Unbooked slots starting inside [start, start + length), in order."""
+        return [
+            slot_id for s, (slot_id, _, booked) in sorted(self.slots.items())
+            if start <= s < start + length and not booked
+        ]
+
+
+@dataclass(frozen=True)
+class FreeWindow:
+    doctor_id: int
+    start_time: datetime
+    end_time: datetime
+    availability_ids: Tuple[int, ...]
+
+
+class FreeTimeIndex:
+    """Bounded LRU of DayIndex entries keyed on (doctor_id, day)."""
+
+    def __init__(self, max_days: int = FREE_TIME_INDEX_MAX_DAYS, ttl: float = FREE_TIME_INDEX_TTL_SECONDS):
+        self.max_days = max_days
+        self.ttl = ttl
+        self._days: "OrderedDict[Tuple[int, date], DayIndex]" = OrderedDict()
+        # Bumped on every change — a load that started before one must not store its result
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    # ── Loading ──────────────────────────────────────────────────────
+
+    def _cached(self, key, now: float) -> Optional[DayIndex]:
+        entry = self._days.get(key)
+        if entry is None or entry.expires_at <= now:
+            return None
+        self._days.move_to_end(key)
+        return entry
+
+    async def days(self, db, doctor_ids: Iterable[int], days: List[date]) -> Dict[Tuple[int, date], DayIndex]:
+        """
+        DayIndex for every (doctor, day) pair, loading all missing ones with a
+        single query. `db` must be a primary session: a lagging replica's view
+        would be cached and served to everyone for the whole TTL.
+        """
+        now = time.monotonic()
+        found, missing = {}, set()
+        for doctor_id in doctor_ids:
+            for day in days:
+                entry = self._cached((doctor_id, day), now)
+                if entry is None:
+                    missing.add((doctor_id, day))
+                else:
+                    found[(doctor_id, day)] = entry
+        self.hits += len(found)
+        self.misses += len(missing)
+        if not missing:
+            return found
+
+        generation = self._generation
+        missing_doctors = sorted({d for d, _ in missing})
+        first, last = min(day for _, day in missing), max(day for _, day in missing)
+        result = await db.execute(
+            select(
+                models.Availability.id, models.Availability.doctor_id, models.Availability.start_time,
+                models.Availability.end_time, models.Availability.is_booked
+            ).where(
+                models.Availability.doctor_id.in_(missing_doctors),
+                models.Availability.start_time >= datetime.combine(first, datetime.min.time()),
+                models.Availability.start_time < datetime.combine(last + timedelta(days=1), datetime.min.time())
+            )
+        )
+        self.loads += 1
+        loaded = {key: DayIndex(expires_at=now + self.ttl) for key in missing}
+        for slot_id, doctor_id, start, end, booked in result.all():
+            start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+            entry = loaded.get((doctor_id, start.date()))
+            if entry is None:
+                continue
+            # Slots running past midnight are cut at the end of their day
+            end_minute = MINUTES_PER_DAY if end.date() > start.date() else _minute(end)
+            entry.slots[_minute(start, round_up=True)] = (slot_id, end_minute, booked)
+        for entry in loaded.values():
+            entry.rebuild()
+
+        if generation == self._generation and self.max_days > 0 and self.ttl > 0:
+            for key, entry in loaded.items():
+                self._days[key] = entry
+                self._days.move_to_end(key)
+            while len(self._days) > self.max_days:
+                self._days.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    # ── Updates (call after the change has committed) ────────────────
+
+    def slot_saved(self, doctor_id: int, slot_id: int, start: datetime, end: datetime, is_booked: bool) -> None:
+        """A slot was created, booked or freed."""
+        self._generation += 1
+        start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+        entry = self._days.get((doctor_id, start.date()))
+        if entry is None:
+            return
+        end_minute = MINUTES_PER_DAY if end.date() > start.date() else _minute(end)
+        entry.slots[_minute(start, round_up=True)] = (slot_id, end_minute, is_booked)
+        entry.rebuild()
+
+    def slot_removed(self, doctor_id: int, start: datetime) -> None:
+        self._generation += 1
+        start = start.replace(tzinfo=None)
+        entry = self._days.get((doctor_id, start.date()))
+        if entry is None:
+            return
+        entry.slots.pop(_minute(start, round_up=True), None)
+        entry.rebuild()
+
+    def invalidate_doctors(self, doctor_ids: Iterable[int]) -> None:
+        """Drops every cached day of these doctors — for changes too wide to apply slot by slot."""
+        doctor_ids = set(doctor_ids)
+        self._generation += 1
+        for key in [k for k in self._days if k[0] in doctor_ids]:
+            del self._days[key]
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._days.clear()
+
+    def stats(self) -> dict:
+        return {"days": len(self._days), "hits": self.hits, "misses": self.misses, "loads": self.loads}
+
+    # ── Queries ──────────────────────────────────────────────────────
+
+    async def first_free(self, db, doctor_id: int, start: datetime, end: datetime,
+                         length: int, limit: int) -> List[FreeWindow]:
+        """The first `limit` windows of `length` free minutes starting at a slot start in [start, end)."""
+        days = [start.date() + timedelta(days=n) for n in range((end.date() - start.date()).days + 1)]
+        index = await self.days(db, [doctor_id], days)
+        windows = []
+        for day in days:
+            entry = index[(doctor_id, day)]
+            midnight = datetime.combine(day, datetime.min.time())
+            for minute in sorted(entry.slots):
+                at = midnight + timedelta(minutes=minute)
+                if at < start or at >= end or not entry.is_free(minute, length):
+                    continue
+                windows.append(FreeWindow(
+                    doctor_id, at, at + timedelta(minutes=length), tuple(entry.slot_ids(minute, length))
+                ))
+                if len(windows) >= limit:
+                    return windows
+        return windows
+
+    async def free_at(self, db, doctor_ids: List[int], at: datetime, length: int) -> List[FreeWindow]:
+        """Doctors free for `length` minutes from `at`, with the slots covering that time."""
+        day, minute = at.date(), _minute(at)
+        index = await self.days(db, doctor_ids, [day])
+        windows = []
+        for doctor_id in doctor_ids:
+            entry = index[(doctor_id, day)]
+            if not entry.is_free(minute, length):
+                continue
+            # Include the slot already under way at `at`, not only those starting in the window
+            covering = [
+                slot_id for s, (slot_id, e, booked) in sorted(entry.slots.items())
+                if not booked and s < minute + length and e > minute
+            ]
+            windows.append(FreeWindow(doctor_id, at, at + timedelta(minutes=length), tuple(covering)))
+        return windows
+
+
+free_time_index = FreeTimeIndex()
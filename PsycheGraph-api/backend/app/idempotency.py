@@ -0,0 +1,205 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+import hashlib
+import logging
+import os
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import and_, delete, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .database import AsyncSessionLocal
+from .models import IdempotencyKey
+
+logger = logging.getLogger("idempotency")
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+# A claim with no stored response after this long belongs to a request
+# that died mid-flight without committing; the next retry may take it over
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 60))
+# pg advisory lock id — one worker purges expired keys per tick
+IDEMPOTENCY_CLEANUP_LOCK_KEY = 7_340_027
+IDEMPOTENCY_CLEANUP_SECONDS = int(os.getenv("IDEMPOTENCY_CLEANUP_SECONDS", 3600))
+MAX_KEY_LENGTH = 255
+
+
+# -------------------------------------------------------------------
+# Idempotency keys
+#
+# A client that sends "Idempotency-Key: <key>" with a write gets the
+# same response for every retry of it. The first request claims
+# (user, key) in idempotency_keys, runs, and stores its response; a
+# retry finds the stored response and gets it back as-is — the handler,
+# and with it the slot update, calendar event and emails, does not run
+# again. Keys are per user and expire after IDEMPOTENCY_TTL_HOURS.
+#
+# Only successful responses are stored. A request that raises releases
+# its claim, so the client can retry it for real. Claims live in their
+# own short transactions; the response is written by the handler itself
+# through save(), in the same transaction as its write, so a request
+# whose write committed always leaves its response behind and is never
+# run a second time.
+# -------------------------------------------------------------------
+
+class Idempotency:
+    def __init__(self, user_id: int, key: Optional[str], fingerprint: str):
+        self.user_id = user_id
+        self.key = key
+        self.fingerprint = fingerprint
+        self.response_model = None
+        self.status_code = 200
+        self.saved = False
+
+    async def run(self, handler: Callable[[], Awaitable], response_model, status_code: int = 200):
+        """Runs `handler` once per key; retries get the stored response."""
+        if self.key is None:
+            return await handler()
+
+        replay = await self._claim()
+        if replay is not None:
+            return replay
+        self.response_model, self.status_code = response_model, status_code
+        try:
+            result = await handler()
+        except BaseException:
+            await self._release()
+            raise
+        if not self.saved:
+            # The handler returned without writing anything to record it with
+            await self._store(status_code, self._body(result))
+        return result
+
+    async def save(self, db, result) -> None:
+        """Records the response in the handler's transaction — call it just before the handler's commit."""
+        if self.key is None:
+            return
+        await db.execute(self._store_statement(self.status_code, self._body(result)))
+        self.saved = True
+
+    def _body(self, result):
+        return self.response_model.model_validate(result).model_dump(mode="json")
+
+    def _store_statement(self, status_code: int, body):
+        return (
+            IdempotencyKey.__table__.update()
+            .where(IdempotencyKey.user_id == self.user_id, IdempotencyKey.key == self.key)
+            .values(status_code=status_code, response=body)
+        )
+
+    async def _claim(self) -> Optional[JSONResponse]:
+        now = func.now()
+        table = IdempotencyKey.__table__
+        claim = (
+            pg_insert(IdempotencyKey)
+            .values(
+                user_id=self.user_id,
+                key=self.key,
+                fingerprint=self.fingerprint,
+                expires_at=now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+            )
+            .on_conflict_do_update(
+                index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+                set_={
+                    "fingerprint": self.fingerprint,
+                    "status_code": None,
+                    "response": None,
+                    "created_at": now,
+                    "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+                },
+                # Take over only expired keys and abandoned claims
+                where=or_(
+                    table.c.expires_at < now,
+                    and_(
+                        table.c.status_code.is_(None),
+                        table.c.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+                    ),
+                ),
+            )
+            .returning(IdempotencyKey.key)
+        )
+        async with AsyncSessionLocal() as session:
+            claimed = (await session.execute(claim)).scalar()
+            await session.commit()
+            if claimed is not None:
+                return None
+            row = (await session.execute(
+                select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+                .where(IdempotencyKey.user_id == self.user_id, IdempotencyKey.key == self.key)
+            )).first()
+
+        if row is not None and row.fingerprint != self.fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if row is None or row.status_code is None:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        return JSONResponse(content=row.response, status_code=row.status_code, headers={REPLAYED_HEADER: "true"})
+
+    async def _store(self, status_code: int, body) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(self._store_statement(status_code, body))
+                await session.commit()
+        except Exception as e:
+            # Nothing was written; a retry will find an abandoned claim and run again
+            logger.error(f"Could not store idempotent response for user {self.user_id}: {e}")
+
+    async def _release(self) -> None:
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    delete(IdempotencyKey).where(
+                        IdempotencyKey.user_id == self.user_id,
+                        IdempotencyKey.key == self.key,
+                        IdempotencyKey.status_code.is_(None),
+                    )
+                )
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Could not release idempotency claim for user {self.user_id}: {e}")
+
+
+@dataclass(frozen=True)
+class IdempotencyRequest:
+    """The request's Idempotency-Key and fingerprint, before they are tied to a user."""
+    key: Optional[str]
+    fingerprint: str
+
+    def for_user(self, user_id: int) -> Idempotency:
+        """Binds the key to the user the route itself authenticated — keys are per user."""
+        return Idempotency(user_id, self.key, self.fingerprint)
+
+
+async def idempotency(request: Request) -> IdempotencyRequest:
+    """Dependency for idempotent writes; a no-op when the request carries no Idempotency-Key."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None:
+        return IdempotencyRequest(None, "")
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.url.path}?{request.url.query}\0".encode())
+    digest.update(await request.body())
+    return IdempotencyRequest(key, digest.hexdigest())
+
+
+async def purge_expired_keys(engine) -> int:
+    """Periodic job: deletes expired keys in batches."""
+    purged = 0
+    while True:
+        async with engine.begin() as conn:
+            result = await conn.execute(text(
+                "DELETE FROM idempotency_keys WHERE (user_id, key) IN ("
+                "  SELECT user_id, key FROM idempotency_keys WHERE expires_at < now() LIMIT 5000"
+                ");"
+            ))
+        purged += result.rowcount
+        if result.rowcount < 5000:
+            break
+    if purged:
+        logger.info(f"Purged {purged} expired idempotency key(s).")
+    return purged
@@ -1,17 +1,33 @@
 import os
+import asyncio
 import logging
 import sys
 import traceback
 import time
+import hashlib
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from sqlalchemy import text
-
-from .database import engine, Base
-from .routers import auth, admin, patients, sessions, appointments, stats, working_hours
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+from .database import engine, read_engine, AsyncSessionLocal, Base, sticky_primary, token_subject, PRIMARY_PIN_COOKIE
+from .auth import PasswordHashingBusy
+from .revocation import revocation_filter
+from .online_migrations import run_online_migrations, BatchedUpdate
+from .pagination import NEXT_CURSOR_HEADER
+from .search import SEARCH_CONFIG
+from .background import run_periodically
+from . import counters
+from .counters import STATS_RECONCILE_SECONDS, STATS_RECONCILE_LOCK_KEY
+from .rollups import refresh_rollups, ROLLUP_REFRESH_SECONDS, ROLLUP_REFRESH_LOCK_KEY
+from .partitions import maintain_partitions, PARTITION_MAINTENANCE_SECONDS, PARTITION_MAINTENANCE_LOCK_KEY
+from .reaper import reap_expired_slots, SLOT_REAPER_INTERVAL_SECONDS, SLOT_REAPER_LOCK_KEY
+from .idempotency import purge_expired_keys, IDEMPOTENCY_CLEANUP_SECONDS, IDEMPOTENCY_CLEANUP_LOCK_KEY, REPLAYED_HEADER
+from .routers import auth, admin, patients, sessions, appointments, stats, working_hours, internal
 
 # Load .env from the backend directory explicitly
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -65,27 +81,6 @@ MIGRATIONS = [
         ");"),
     ("add_rec_doctor_ids",        "ALTER TABLE receptionists ADD COLUMN IF NOT EXISTS doctor_ids INTEGER[];"),
     ("drop_receptionist_doctors", "DROP TABLE IF EXISTS receptionist_doctors;"),
-    ("idx_org_email",             "CREATE INDEX IF NOT EXISTS idx_org_email ON organizations(email);"),
-    ("idx_org_is_approved",       "CREATE INDEX IF NOT EXISTS idx_org_is_approved ON organizations(is_approved);"),
-    ("idx_org_is_active",         "CREATE INDEX IF NOT EXISTS idx_org_is_active ON organizations(is_active);"),
-    ("idx_patient_created_by",    "CREATE INDEX IF NOT EXISTS idx_patient_created_by ON patients(created_by_id);"),
-    ("idx_patient_is_active",     "CREATE INDEX IF NOT EXISTS idx_patient_is_active ON patients(is_active);"),
-    ("idx_apt_start_time",        "CREATE INDEX IF NOT EXISTS idx_apt_start_time ON appointments(start_time);"),
-    ("idx_apt_availability",      "CREATE INDEX IF NOT EXISTS idx_apt_availability ON appointments(availability_id);"),
-    ("idx_apt_created_by",        "CREATE INDEX IF NOT EXISTS idx_apt_created_by ON appointments(created_by_id);"),
-    ("idx_apt_doctor_status",     "CREATE INDEX IF NOT EXISTS idx_apt_doctor_status ON appointments(doctor_id, status);"),
-    ("idx_apt_org_status",        "CREATE INDEX IF NOT EXISTS idx_apt_org_status ON appointments(organization_id, status);"),
-    ("idx_apt_patient_status",    "CREATE INDEX IF NOT EXISTS idx_apt_patient_status ON appointments(patient_id, status);"),
-    ("idx_apt_date_status",       "CREATE INDEX IF NOT EXISTS idx_apt_date_status ON appointments(appointment_date, status);"),
-    ("idx_avail_org_booked",      "CREATE INDEX IF NOT EXISTS idx_avail_org_booked ON availabilities(organization_id, is_booked);"),
-    ("idx_avail_doctor_booked",   "CREATE INDEX IF NOT EXISTS idx_avail_doctor_booked ON availabilities(doctor_id, is_booked);"),
-    ("idx_session_date",          "CREATE INDEX IF NOT EXISTS idx_session_date ON sessions(session_date);"),
-    ("idx_session_appointment",   "CREATE INDEX IF NOT EXISTS idx_session_appointment ON sessions(appointment_id);"),
-    ("idx_session_created_by",    "CREATE INDEX IF NOT EXISTS idx_session_created_by ON sessions(created_by_id);"),
-    ("idx_doctor_user_id",        "CREATE INDEX IF NOT EXISTS idx_doctor_user_id ON doctors(user_id);"),
-    ("idx_receptionist_user_id",  "CREATE INDEX IF NOT EXISTS idx_receptionist_user_id ON receptionists(user_id);"),
-    ("idx_receptionist_doctor_ids_gin",
-        "CREATE INDEX IF NOT EXISTS idx_receptionist_doctor_ids ON receptionists USING GIN (doctor_ids);"),
     ("add_user_phone_number",   "ALTER TABLE users ADD COLUMN IF NOT EXISTS phone_number VARCHAR;"),
     ("add_org_logo_url",        "ALTER TABLE organizations ADD COLUMN IF NOT EXISTS logo_url VARCHAR;"),
     ("add_org_address",         "ALTER TABLE organizations ADD COLUMN IF NOT EXISTS address VARCHAR;"),
@@ -100,12 +95,78 @@ MIGRATIONS = [
         "break_start VARCHAR, "
         "break_end VARCHAR"
         ");"),
-    ("idx_org_schedules_org_id", "CREATE INDEX IF NOT EXISTS idx_org_schedules_org_id ON organization_schedules(organization_id);"),
-    ("uq_org_schedule_day",      "CREATE UNIQUE INDEX IF NOT EXISTS uq_org_schedule_day ON organization_schedules(organization_id, day);"),
     ("make_patient_doctor_id_nullable", "ALTER TABLE patients ALTER COLUMN doctor_id DROP NOT NULL;"),
     ("drop_user_shift_timing",         "ALTER TABLE users DROP COLUMN IF EXISTS shift_timing;"),
     ("drop_receptionist_shift_timing", "ALTER TABLE receptionists DROP COLUMN IF EXISTS shift_timing;"),
     ("alter_org_logo_url_to_text", "ALTER TABLE organizations ALTER COLUMN logo_url TYPE TEXT;"),
+    ("add_user_claims_version",    "ALTER TABLE users ADD COLUMN IF NOT EXISTS claims_version INTEGER NOT NULL DEFAULT 1;"),
+    ("add_session_search_vector",  "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;"),
+    ("create_extension_pg_trgm",   "CREATE EXTENSION IF NOT EXISTS pg_trgm;"),
+    ("add_doctor_slot_duration",   "ALTER TABLE doctors ADD COLUMN IF NOT EXISTS slot_duration_minutes INTEGER;"),
+    # Queue every existing appointment day for the first rollup refresh (see app/rollups.py)
+    ("seed_appointment_rollups",
+     "INSERT INTO appointment_rollup_dirty (organization_id, day) "
+     "SELECT DISTINCT organization_id, (appointment_date AT TIME ZONE 'UTC')::date FROM appointments "
+     "ON CONFLICT DO NOTHING;"),
+]
+
+# Index builds that run after startup with CREATE INDEX CONCURRENTLY (see
+# online_migrations.py). They never block writes, so new indexes on large
+# tables belong here rather than in MIGRATIONS.
+ONLINE_MIGRATIONS = [
+    ("idx_org_email",             "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_org_email ON organizations(email);"),
+    ("idx_org_is_approved",       "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_org_is_approved ON organizations(is_approved);"),
+    ("idx_org_is_active",         "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_org_is_active ON organizations(is_active);"),
+    ("idx_patient_created_by",    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_created_by ON patients(created_by_id);"),
+    ("idx_patient_is_active",     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_is_active ON patients(is_active);"),
+    ("idx_apt_start_time",        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_start_time ON appointments(start_time);"),
+    ("idx_apt_availability",      "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_availability ON appointments(availability_id);"),
+    ("idx_apt_created_by",        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_created_by ON appointments(created_by_id);"),
+    ("idx_apt_doctor_status",     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_doctor_status ON appointments(doctor_id, status);"),
+    ("idx_apt_org_status",        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_org_status ON appointments(organization_id, status);"),
+    ("idx_apt_patient_status",    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_patient_status ON appointments(patient_id, status);"),
+    ("idx_apt_date_status",       "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_date_status ON appointments(appointment_date, status);"),
+    ("idx_avail_org_booked",      "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_org_booked ON availabilities(organization_id, is_booked);"),
+    ("idx_avail_doctor_booked",   "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_doctor_booked ON availabilities(doctor_id, is_booked);"),
+    ("idx_session_date",          "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_date ON sessions(session_date);"),
+    ("idx_session_appointment",   "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_appointment ON sessions(appointment_id);"),
+    ("idx_session_created_by",    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_created_by ON sessions(created_by_id);"),
+    ("idx_doctor_user_id",        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_doctor_user_id ON doctors(user_id);"),
+    ("idx_receptionist_user_id",  "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_receptionist_user_id ON receptionists(user_id);"),
+    ("idx_receptionist_doctor_ids_gin",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_receptionist_doctor_ids ON receptionists USING GIN (doctor_ids);"),
+    ("idx_org_schedules_org_id", "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_org_schedules_org_id ON organization_schedules(organization_id);"),
+    ("uq_org_schedule_day",      "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_org_schedule_day ON organization_schedules(organization_id, day);"),
+    # Keyset pagination: (scope column, sort key, id) for the scoped list endpoints
+    ("idx_apt_org_start_id",      "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_org_start_id ON appointments(organization_id, start_time, id);"),
+    ("idx_apt_doctor_start_id",   "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_doctor_start_id ON appointments(doctor_id, start_time, id);"),
+    ("idx_avail_org_start_id",    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_org_start_id ON availabilities(organization_id, start_time, id);"),
+    ("idx_session_doctor_date_id","CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_doctor_date_id ON sessions(doctor_id, session_date, id);"),
+    ("idx_patient_org_id",        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_org_id ON patients(organization_id, id);"),
+    # Session full-text search (see search.py) — backfill existing rows, then index
+    ("backfill_session_search_vector", BatchedUpdate(
+        "UPDATE sessions SET search_vector = "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(summary, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(transcript, '')), 'B') "
+        "WHERE id IN (SELECT id FROM sessions WHERE search_vector IS NULL LIMIT 500);")),
+    ("idx_session_search_vector", "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_session_search_vector ON sessions USING GIN (search_vector);"),
+    # Patient lookup (see search.patient_match) — needs create_extension_pg_trgm
+    ("idx_patient_name_trgm",     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_name_trgm ON patients USING GIN (full_name gin_trgm_ops);"),
+    ("idx_patient_email_trgm",    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_email_trgm ON patients USING GIN (email gin_trgm_ops);"),
+    ("idx_patient_phone_digits_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_patient_phone_digits_trgm ON patients "
+        "USING GIN ((regexp_replace(phone, '\\D', '', 'g')) gin_trgm_ops);"),
+    ("idx_apt_patient_start",     "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_apt_patient_start ON appointments(patient_id, start_time);"),
+    # Open slots only (get_availability's default) — booked slots never enter these
+    ("idx_avail_open_org_start",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_open_org_start "
+        "ON availabilities(organization_id, start_time, id) WHERE is_booked = false;"),
+    ("idx_avail_open_doctor_start",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_open_doctor_start "
+        "ON availabilities(doctor_id, start_time, id) WHERE is_booked = false;"),
+    ("idx_avail_open_start",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_avail_open_start "
+        "ON availabilities(start_time, id) WHERE is_booked = false;"),
 ]
 
 
@@ -126,11 +187,11 @@ async def run_migrations(conn):
 
     if not pending:
         logger.info(f"All {len(MIGRATIONS)} migrations already applied — skipping.")
-        return
+        return []
 
     logger.info(f"Applying {len(pending)} pending migration(s)...")
 
-    succeeded = []
+    succeeded, failed = [], []
     for migration_id, sql in pending:
         # Each migration gets its own savepoint so one failure never aborts the rest
         await conn.execute(text(f"SAVEPOINT mig_{migration_id};"))
@@ -141,6 +202,7 @@ async def run_migrations(conn):
             logger.info(f"  ✓ {migration_id}")
         except Exception as e:
             await conn.execute(text(f"ROLLBACK TO SAVEPOINT mig_{migration_id};"))
+            failed.append(migration_id)
             logger.warning(f"  ✗ {migration_id} skipped: {e}")
 
     # Record all succeeded migrations in one bulk insert
@@ -153,17 +215,114 @@ async def run_migrations(conn):
         )
         logger.info(f"Migrations complete: {len(succeeded)} applied.")
 
+    return failed
+
+
+# ── Schema fingerprint ─────────────────────────────────────────────────────
+# Hash of the model DDL plus the migration list. Stored in schema_state once
+# a boot has applied everything, so later boots (and the other workers) can
+# skip create_all and the migration scan with a single SELECT.
+
+SCHEMA_LOCK_KEY = 7_340_021  # pg advisory lock id, shared by every worker
+
+
+def schema_fingerprint() -> str:
+    dialect = postgresql.dialect()
+    digest = hashlib.sha256()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=dialect)).encode())
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            digest.update(str(CreateIndex(index).compile(dialect=dialect)).encode())
+    for migration_id, sql in MIGRATIONS:
+        digest.update(f"{migration_id}\0{sql}\0".encode())
+    return digest.hexdigest()
+
+
+async def stored_fingerprint(conn):
+    exists = (await conn.execute(text("SELECT to_regclass('schema_state') IS NOT NULL;"))).scalar()
+    if not exists:
+        return None
+    return (await conn.execute(text("SELECT fingerprint FROM schema_state WHERE id = 1;"))).scalar()
+
+
+async def ensure_schema():
+    fingerprint = schema_fingerprint()
+
+    # Fast path — schema already matches the code
+    async with engine.connect() as conn:
+        if await stored_fingerprint(conn) == fingerprint:
+            logger.info("Schema fingerprint matches — skipping create_all and migrations.")
+            return
+
+    # Slow path — one worker applies DDL, the rest wait on the lock and re-check
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key);"), {"key": SCHEMA_LOCK_KEY})
+        if await stored_fingerprint(conn) == fingerprint:
+            logger.info("Schema was brought up to date by another worker.")
+            return
+
+        await conn.run_sync(Base.metadata.create_all)
+        failed = await run_migrations(conn)
+
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_state ("
+            "  id INTEGER PRIMARY KEY,"
+            "  fingerprint VARCHAR NOT NULL,"
+            "  updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()"
+            ");"
+        ))
+        if failed:
+            # Leave the fingerprint stale so the next boot retries them
+            logger.warning(f"{len(failed)} migration(s) failed — schema fingerprint not recorded.")
+            return
+        await conn.execute(
+            text(
+                "INSERT INTO schema_state (id, fingerprint) VALUES (1, :fp) "
+                "ON CONFLICT (id) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, updated_at = now();"
+            ),
+            {"fp": fingerprint}
+        )
+        logger.info("Schema updated and fingerprint recorded.")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await ensure_schema()
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        await run_migrations(conn)
+        await revocation_filter.rebuild(conn)
 
     logger.info("Database ready.")
+    tasks = [
+        asyncio.create_task(run_online_migrations(engine, ONLINE_MIGRATIONS)),
+        asyncio.create_task(run_periodically(
+            engine, "stats_reconcile", STATS_RECONCILE_SECONDS, STATS_RECONCILE_LOCK_KEY,
+            lambda: counters.reconcile(engine, AsyncSessionLocal),
+        )),
+        asyncio.create_task(run_periodically(
+            engine, "appointment_rollups", ROLLUP_REFRESH_SECONDS, ROLLUP_REFRESH_LOCK_KEY,
+            lambda: refresh_rollups(engine),
+        )),
+        asyncio.create_task(run_periodically(
+            engine, "partition_maintenance", PARTITION_MAINTENANCE_SECONDS, PARTITION_MAINTENANCE_LOCK_KEY,
+            lambda: maintain_partitions(engine),
+        )),
+        asyncio.create_task(run_periodically(
+            engine, "slot_reaper", SLOT_REAPER_INTERVAL_SECONDS, SLOT_REAPER_LOCK_KEY,
+            lambda: reap_expired_slots(engine),
+        )),
+        asyncio.create_task(run_periodically(
+            engine, "idempotency_cleanup", IDEMPOTENCY_CLEANUP_SECONDS, IDEMPOTENCY_CLEANUP_LOCK_KEY,
+            lambda: purge_expired_keys(engine),
+        )),
+    ]
     yield
 
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
     await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan, title="PsycheGraph API")
@@ -201,6 +360,32 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 
+@app.exception_handler(PasswordHashingBusy)
+async def hashing_busy_handler(request: Request, exc: PasswordHashingBusy):
+    logger.warning(f"Password hashing pool saturated: {request.method} {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"message": "Server is busy, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+
+# ── Read-your-writes pinning (see database.get_read_db) ────────────────────
+
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    response = await call_next(request)
+    if read_engine is not None and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        subject = token_subject(request)
+        if subject:
+            until = sticky_primary.pin(subject)
+            response.set_cookie(
+                PRIMARY_PIN_COOKIE, f"{until:.3f}",
+                max_age=int(sticky_primary.window) + 1, httponly=True, samesite="lax",
+            )
+    return response
+
+
 # ── CORS ───────────────────────────────────────────────────────────────────
 
 origins = [
@@ -215,6 +400,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, REPLAYED_HEADER],
 )
 
 
@@ -231,6 +417,7 @@ app.include_router(sessions.router)
 app.include_router(appointments.router)
 app.include_router(stats.router)
 app.include_router(working_hours.router)
+app.include_router(internal.router)
 
 
 @app.get("/")
@@ -1,9 +1,9 @@
 from sqlalchemy import (
-    Column, Integer, String, Boolean, ForeignKey, DateTime, Text, Enum,
+    Column, Integer, BigInteger, String, Boolean, ForeignKey, Date, DateTime, Text, Enum,
     UniqueConstraint, Index
 )
-from sqlalchemy.dialects.postgresql import ARRAY
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from datetime import datetime, timezone
 import enum 
@@ -84,6 +84,8 @@ class User(Base):
     created_by_id   = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at      = Column(DateTime(timezone=True), server_default=func.now())
     is_active       = Column(Boolean, default=True, nullable=False)
+    # Bumped on admin changes — access tokens carrying an older "cv" claim are rejected
+    claims_version  = Column(Integer, default=1, server_default="1", nullable=False)
 
     # Shared profile fields
     full_name    = Column(String, nullable=True)
@@ -153,6 +155,49 @@ class User(Base):
         return None
 
 
+# -------------------------------------------------------------------
+# RevokedToken  (refresh-token jti deny list — see app/revocation.py)
+# -------------------------------------------------------------------
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti        = Column(String, primary_key=True)
+    user_id    = Column(Integer, nullable=True, index=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    revoked_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+
+# -------------------------------------------------------------------
+# StatsCounter  (dashboard counters — see app/counters.py)
+# -------------------------------------------------------------------
+
+class StatsCounter(Base):
+    __tablename__ = "stats_counters"
+
+    scope_type = Column(String, primary_key=True)        # "global" | "org" | "user"
+    scope_id   = Column(Integer, primary_key=True)       # 0 for global
+    metric     = Column(String, primary_key=True)
+    value      = Column(BigInteger, default=0, server_default="0", nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+# -------------------------------------------------------------------
+# IdempotencyKey  (stored responses for retried writes — see app/idempotency.py)
+# -------------------------------------------------------------------
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    user_id     = Column(Integer, primary_key=True)
+    key         = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)        # sha256 of method, path and body
+    status_code = Column(Integer, nullable=True)            # NULL while the first request is running
+    response    = Column(JSONB, nullable=True)
+    created_at  = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    expires_at  = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
 # -------------------------------------------------------------------
 # Doctor  (profile table — one row per DOCTOR user)
 # -------------------------------------------------------------------
@@ -163,6 +208,8 @@ class Doctor(Base):
     id             = Column(Integer, primary_key=True, index=True)
     user_id        = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False, index=True)
     full_name      = Column(String, nullable=False, index=True)
+    # Length of virtual slots (see virtual_slots.py); NULL uses DEFAULT_SLOT_MINUTES
+    slot_duration_minutes = Column(Integer, nullable=True)
     created_by_id  = Column(Integer, ForeignKey("users.id"), nullable=True)
     created_at     = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -296,6 +343,45 @@ class Availability(Base):
     )
 
 
+# -------------------------------------------------------------------
+# DoctorTimeBlock  (blocked time for virtual slots — see app/virtual_slots.py)
+# -------------------------------------------------------------------
+
+class DoctorTimeBlock(Base):
+    """Time a doctor is unavailable inside working hours (leave, meetings) — no virtual slots are offered in it."""
+    __tablename__ = "doctor_time_blocks"
+
+    id              = Column(Integer, primary_key=True, index=True)
+    doctor_id       = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    organization_id = Column(Integer, ForeignKey("organizations.id", ondelete="CASCADE"), nullable=False, index=True)
+    start_time      = Column(DateTime(timezone=True), nullable=False)
+    end_time        = Column(DateTime(timezone=True), nullable=False)
+    reason          = Column(String, nullable=True)
+    created_by_id   = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at      = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_time_block_doctor_start', 'doctor_id', 'start_time'),
+    )
+
+
+# -------------------------------------------------------------------
+# AvailabilityArchive  (expired unbooked slots moved out by app/reaper.py)
+# -------------------------------------------------------------------
+
+class AvailabilityArchive(Base):
+    __tablename__ = "availabilities_archive"
+
+    id              = Column(Integer, primary_key=True)   # original availabilities.id
+    doctor_id       = Column(Integer, nullable=False, index=True)
+    organization_id = Column(Integer, nullable=True, index=True)
+    start_time      = Column(DateTime(timezone=True), nullable=False, index=True)
+    end_time        = Column(DateTime(timezone=True), nullable=False)
+    created_by_id   = Column(Integer, nullable=True)
+    created_at      = Column(DateTime(timezone=True), nullable=True)
+    archived_at     = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 # -------------------------------------------------------------------
 # Appointment
 # -------------------------------------------------------------------
@@ -346,6 +432,30 @@ class Appointment(Base):
     )
 
 
+# -------------------------------------------------------------------
+# AppointmentRollup  (per-day appointment counts — see app/rollups.py)
+# -------------------------------------------------------------------
+
+class AppointmentRollup(Base):
+    __tablename__ = "appointment_rollups"
+
+    organization_id = Column(Integer, primary_key=True)
+    day             = Column(Date, primary_key=True)       # IST calendar day of appointment_date
+    doctor_id       = Column(Integer, primary_key=True)
+    status          = Column(String, primary_key=True)
+    booked_by_role  = Column(String, primary_key=True)     # "" when not recorded
+    count           = Column(Integer, nullable=False)
+
+
+class AppointmentRollupDirty(Base):
+    """(organization, day) pairs whose rollup rows must be recomputed."""
+    __tablename__ = "appointment_rollup_dirty"
+
+    organization_id = Column(Integer, primary_key=True)
+    day             = Column(Date, primary_key=True)
+    marked_at       = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
 # -------------------------------------------------------------------
 # Session
 # -------------------------------------------------------------------
@@ -367,6 +477,8 @@ class Session(Base):
     created_at     = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at     = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
                              onupdate=lambda: datetime.now(timezone.utc))
+    # Full-text index over summary + transcript, maintained by search.refresh_session_search_vector
+    search_vector  = deferred(Column(TSVECTOR, nullable=True))
 
     # Relationships
     patient         = relationship("Patient",     back_populates="sessions")
@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+import asyncio
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import text
+
+from .partitions import partitioned_index_plan
+
+logger = logging.getLogger("migrations")
+
+# pg advisory lock id — only one worker builds online indexes at a time
+ONLINE_MIGRATION_LOCK_KEY = 7_340_022
+ONLINE_MIGRATION_MAX_ATTEMPTS = int(os.getenv("ONLINE_MIGRATION_MAX_ATTEMPTS", 3))
+ONLINE_MIGRATION_PROGRESS_SECONDS = float(os.getenv("ONLINE_MIGRATION_PROGRESS_SECONDS", 10))
+
+_INDEX_NAME = re.compile(r"INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.IGNORECASE)
+
+# migration_id → {"state": pending|building|done|failed, "attempts", "progress", "error"}
+online_migration_status: dict = {}
+
+
+@dataclass(frozen=True)
+class BatchedUpdate:
+    """
+    Backfill run as repeated short autocommit statements until one touches
+    no rows. `sql` must limit itself to a batch (e.g. WHERE id IN (SELECT …
+    LIMIT n)) so each statement holds row locks only briefly.
+    """
+    sql: str
+    pause_seconds: float = 0.05
+
+
+def index_name(sql: str) -> str:
+    match = _INDEX_NAME.search(sql)
+    if not match:
+        raise ValueError(f"Online migration is not a CREATE INDEX CONCURRENTLY: {sql}")
+    return match.group(1)
+
+
+async def _index_validity(conn, name: str):
+    """True/False for an existing index's indisvalid, None if it doesn't exist."""
+    return (await conn.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND pg_catalog.pg_table_is_visible(c.oid);"
+        ),
+        {"name": name}
+    )).scalar()
+
+
+async def _watch_progress(engine, migration_id: str, pid: int):
+    """Polls pg_stat_progress_create_index for the building backend until cancelled."""
+    status = online_migration_status[migration_id]
+    while True:
+        await asyncio.sleep(ONLINE_MIGRATION_PROGRESS_SECONDS)
+        try:
+            async with engine.connect() as conn:
+                row = (await conn.execute(
+                    text(
+                        "SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total "
+                        "FROM pg_stat_progress_create_index WHERE pid = :pid;"
+                    ),
+                    {"pid": pid}
+                )).first()
+        except Exception as e:
+            logger.warning(f"  progress check for {migration_id} failed: {e}")
+            continue
+        if row is None:
+            continue
+        status["progress"] = {
+            "phase": row.phase,
+            "blocks_done": row.blocks_done,
+            "blocks_total": row.blocks_total,
+            "tuples_done": row.tuples_done,
+            "tuples_total": row.tuples_total,
+        }
+        pct = f"{100 * row.blocks_done / row.blocks_total:.0f}%" if row.blocks_total else "-"
+        logger.info(f"  … {migration_id}: {row.phase} ({pct} of blocks)")
+
+
+async def _backfill(conn, migration_id: str, job: BatchedUpdate) -> bool:
+    status = online_migration_status[migration_id]
+    status.update(state="building", attempts=1, progress={"rows": 0})
+    started = time.monotonic()
+    try:
+        while True:
+            result = await conn.execute(text(job.sql))
+            if not result.rowcount:
+                break
+            status["progress"]["rows"] += result.rowcount
+            await asyncio.sleep(job.pause_seconds)
+    except Exception as e:
+        status.update(state="failed", error=str(e))
+        logger.warning(f"  ✗ {migration_id} failed after {status['progress']['rows']} rows: {e}")
+        return False
+    status.update(state="done", error=None, seconds=round(time.monotonic() - started, 1))
+    logger.info(f"  ✓ {migration_id} ({status['progress']['rows']} rows, {status['seconds']}s)")
+    return True
+
+
+async def _build_partitioned(conn, migration_id: str, name: str, plan: list) -> bool:
+    """Runs a partitions.partitioned_index_plan: parent index ON ONLY, concurrent child builds, attach."""
+    status = online_migration_status[migration_id]
+    status["state"] = "building"
+    started = time.monotonic()
+    if await _index_validity(conn, name):
+        # Already built across all partitions (e.g. by partition_tables.py)
+        status.update(state="done", error=None, seconds=0.0)
+        return True
+    try:
+        for child, statement in plan:
+            if child and await _index_validity(conn, child) is False:
+                logger.warning(f"  {child} is invalid — dropping before rebuild")
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {child};"))
+            await conn.execute(text(statement))
+    except Exception as e:
+        status.update(state="failed", error=str(e))
+        logger.warning(f"  ✗ {migration_id} failed on a partition: {e}")
+        return False
+    if not await _index_validity(conn, name):
+        status.update(state="failed", error="parent index not valid after attaching partitions")
+        return False
+    status.update(state="done", error=None, seconds=round(time.monotonic() - started, 1))
+    logger.info(f"  ✓ {migration_id} across {sum(1 for child, _ in plan if child)} partition(s) ({status['seconds']}s)")
+    return True
+
+
+async def _build(engine, conn, migration_id: str, sql) -> bool:
+    if isinstance(sql, BatchedUpdate):
+        return await _backfill(conn, migration_id, sql)
+
+    name = index_name(sql)
+    status = online_migration_status[migration_id]
+
+    plan = await partitioned_index_plan(conn, sql)
+    if plan is not None:
+        status["attempts"] = 1
+        return await _build_partitioned(conn, migration_id, name, plan)
+
+    for attempt in range(1, ONLINE_MIGRATION_MAX_ATTEMPTS + 1):
+        status["attempts"] = attempt
+
+        # A cancelled or failed concurrent build leaves an INVALID index behind,
+        # which IF NOT EXISTS would happily accept — drop it and build again.
+        if await _index_validity(conn, name) is False:
+            logger.warning(f"  {name} is invalid — dropping before rebuild")
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name};"))
+
+        status["state"] = "building"
+        pid = (await conn.execute(text("SELECT pg_backend_pid();"))).scalar()
+        watcher = asyncio.create_task(_watch_progress(engine, migration_id, pid))
+        started = time.monotonic()
+        try:
+            await conn.execute(text(sql))
+        except Exception as e:
+            status["error"] = str(e)
+            logger.warning(f"  ✗ {migration_id} attempt {attempt} failed: {e}")
+            await asyncio.sleep(2 ** attempt)
+            continue
+        finally:
+            watcher.cancel()
+
+        if await _index_validity(conn, name):
+            status.update(state="done", error=None, seconds=round(time.monotonic() - started, 1))
+            logger.info(f"  ✓ {migration_id} ({status['seconds']}s)")
+            return True
+        status["error"] = "index built but marked invalid"
+
+    status["state"] = "failed"
+    return False
+
+
+async def run_online_migrations(engine, migrations):
+    """
+    Builds CREATE INDEX CONCURRENTLY migrations (and BatchedUpdate backfills)
+    after startup, outside any transaction, so reads and writes keep flowing
+    while they run. Applied ids go to migrations_log like ordinary
+    migrations; failures are retried on the next boot.
+    """
+    try:
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+
+            if not (await conn.execute(text("SELECT to_regclass('migrations_log') IS NOT NULL;"))).scalar():
+                return
+            result = await conn.execute(text("SELECT migration_id FROM migrations_log;"))
+            applied = {row[0] for row in result.fetchall()}
+            pending = [(mid, sql) for mid, sql in migrations if mid not in applied]
+            if not pending:
+                return
+
+            locked = (await conn.execute(
+                text("SELECT pg_try_advisory_lock(:key);"), {"key": ONLINE_MIGRATION_LOCK_KEY}
+            )).scalar()
+            if not locked:
+                logger.info("Online migrations are running in another worker.")
+                return
+
+            try:
+                # Re-read now that we hold the lock — another worker may have just finished
+                result = await conn.execute(text("SELECT migration_id FROM migrations_log;"))
+                applied = {row[0] for row in result.fetchall()}
+                pending = [(mid, sql) for mid, sql in migrations if mid not in applied]
+
+                logger.info(f"Building {len(pending)} online index migration(s)...")
+                for migration_id, _ in pending:
+                    online_migration_status[migration_id] = {"state": "pending", "attempts": 0}
+
+                for migration_id, sql in pending:
+                    if await _build(engine, conn, migration_id, sql):
+                        await conn.execute(
+                            text("INSERT INTO migrations_log (migration_id) VALUES (:id) ON CONFLICT DO NOTHING;"),
+                            {"id": migration_id}
+                        )
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key);"), {"key": ONLINE_MIGRATION_LOCK_KEY})
+    except asyncio.CancelledError:
+        logger.info("Online migrations interrupted by shutdown — will resume on next start.")
+        raise
+    except Exception as e:
+        logger.error(f"Online migrations aborted: {e}")
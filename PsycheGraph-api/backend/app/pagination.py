@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+import base64
+import json
+import os
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 200))
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+# -------------------------------------------------------------------
+# Keyset pagination
+#
+# A cursor is the (sort_key, id) of the last row on the previous page,
+# base64-encoded so clients treat it as opaque. The next page is
+# "WHERE (sort_key, id) > cursor ORDER BY sort_key, id LIMIT n", which
+# the (…, sort_key, id) indexes answer without scanning skipped rows.
+# -------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class PageParams:
+    cursor: Optional[tuple]
+    limit: int
+    skip: int = 0
+
+
+def encode_cursor(sort_value, row_id: int) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"dt": sort_value.isoformat()}
+    raw = json.dumps([sort_value, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value["dt"])
+        return sort_value, int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_params(
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, description=f"Page size, capped at {MAX_PAGE_SIZE}"),
+    skip: int = Query(0, ge=0, deprecated=True, description="Offset paging, kept for old clients — use cursor"),
+) -> PageParams:
+    return PageParams(
+        cursor=decode_cursor(cursor) if cursor else None,
+        limit=min(limit, MAX_PAGE_SIZE),
+        skip=0 if cursor else skip,
+    )
+
+
+def paginate(query, params: PageParams, sort_col, id_col):
+    """Adds keyset filter, stable ordering and limit+1 (for next-page detection) to `query`."""
+    if params.cursor is not None:
+        sort_value, row_id = params.cursor
+        if sort_col is id_col:
+            query = query.where(id_col > row_id)
+        else:
+            # The plain bound is implied by the row comparison, but unlike it the
+            # planner can use it for index range starts and partition pruning
+            query = query.where(sort_col >= sort_value, tuple_(sort_col, id_col) > tuple_(sort_value, row_id))
+    if sort_col is id_col:
+        query = query.order_by(id_col)
+    else:
+        query = query.order_by(sort_col, id_col)
+    if params.skip:
+        query = query.offset(params.skip)
+    return query.limit(params.limit + 1)
+
+
+def finish_page(rows: list, params: PageParams, response: Response, sort_attr: str, id_attr: str = "id") -> list:
+    """Trims the extra row and sets X-Next-Cursor when there is another page."""
+    if len(rows) <= params.limit:
+        return rows
+    rows = rows[:params.limit]
+    last = rows[-1]
+    response.headers[NEXT_CURSOR_HEADER] = encode_cursor(getattr(last, sort_attr), getattr(last, id_attr))
+    return rows
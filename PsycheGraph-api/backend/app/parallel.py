@@ -0,0 +1,60 @@
+from typing import Sequence
+import asyncio
+import os
+
+from fastapi import Request
+
+from .database import DB_POOL_SIZE, read_session_factory
+
+# Connections one call may hold at once
+PARALLEL_QUERY_LIMIT = int(os.getenv("PARALLEL_QUERY_LIMIT", 4))
+# Connections all fan-outs in this process may hold at once — keeps a burst
+# of dashboard loads from draining the pool that ordinary requests need
+PARALLEL_QUERY_GLOBAL_LIMIT = int(os.getenv("PARALLEL_QUERY_GLOBAL_LIMIT", max(1, DB_POOL_SIZE // 2)))
+
+_global_slots = asyncio.Semaphore(PARALLEL_QUERY_GLOBAL_LIMIT)
+
+
+# -------------------------------------------------------------------
+# Parallel reads
+#
+# An AsyncSession runs one statement at a time on one connection, so
+# asyncio.gather over db.execute() calls on the same session is
+# serialized at best and an "operation in progress" error at worst.
+# run_parallel gives each statement its own short-lived session (own
+# pooled connection) and awaits them together: latency becomes the
+# slowest query rather than the sum.
+# -------------------------------------------------------------------
+
+async def run_parallel(session_factory, statements: Sequence, limit: int = PARALLEL_QUERY_LIMIT) -> list:
+    """
+    Executes independent read statements concurrently and returns their
+    buffered Results in the same order. Each item is a statement or a
+    (statement, params) pair. ORM entities come back detached with their
+    columns loaded; lazy relationships must be eager-loaded in the query.
+    """
+    local_slots = asyncio.Semaphore(max(1, limit))
+
+    async def run(item):
+        stmt, params = item if isinstance(item, tuple) else (item, None)
+        async with local_slots, _global_slots:
+            async with session_factory() as session:
+                return await session.execute(stmt, params)
+
+    if len(statements) == 1:
+        return [await run(statements[0])]
+    return list(await asyncio.gather(*(run(item) for item in statements)))
+
+
+class ParallelReader:
+    """Request-scoped handle: run_parallel on the replica, or the primary after the caller's own write."""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+
+    async def __call__(self, *statements, limit: int = PARALLEL_QUERY_LIMIT) -> list:
+        return await run_parallel(self.session_factory, statements, limit=limit)
+
+
+def get_parallel_reader(request: Request) -> ParallelReader:
+    return ParallelReader(read_session_factory(request))
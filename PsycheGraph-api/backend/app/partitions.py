@@ -0,0 +1,250 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+import logging
+import os
+import re
+
+from sqlalchemy import text
+
+from . import counters, rollups
+
+logger = logging.getLogger("partitions")
+
+# Tables that partition_tables.py can convert, and their range key
+PARTITIONED_TABLES = {
+    "availabilities": "start_time",
+    "appointments":   "appointment_date",
+}
+
+# pg advisory lock id — one worker runs partition maintenance per tick
+PARTITION_MAINTENANCE_LOCK_KEY = 7_340_025
+PARTITION_MAINTENANCE_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_SECONDS", 6 * 3600))
+# Monthly partitions kept ready beyond the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+# Months of history to keep; 0 keeps everything. Appointments are dropped
+# before availabilities, whose rows they reference.
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", 0))
+# How long dropping a partition waits for its table lock before giving up until the next run
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})_(\d{2})$")
+_CONCURRENT_INDEX = re.compile(
+    r"CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s+ON\s+(\w+)(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+# -------------------------------------------------------------------
+# Monthly range partitions
+#
+# Opt-in: partition_tables.py converts availabilities / appointments
+# into tables partitioned by month on their start time. Partitions are
+# named <table>_pYYYY_MM plus a <table>_default catch-all. Bounds use
+# the stored form of times (naive IST values read as UTC), so a month
+# here is an IST calendar month, like the rest of the app.
+# -------------------------------------------------------------------
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def _bound(month: date) -> str:
+    return f"'{month:%Y-%m-%d} 00:00:00+00'"
+
+
+def partition_ddl(table: str, month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} PARTITION OF {table} "
+        f"FOR VALUES FROM ({_bound(month)}) TO ({_bound(add_months(month, 1))});"
+    )
+
+
+async def partitioned_tables(conn) -> set:
+    """Names of tables that are currently range-partitioned parents."""
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_class c WHERE c.relkind = 'p' "
+        "AND pg_catalog.pg_table_is_visible(c.oid);"
+    ))
+    return {row[0] for row in result}
+
+
+async def list_partitions(conn, table: str) -> list:
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname;"
+        ),
+        {"table": table}
+    )
+    return [row[0] for row in result]
+
+
+def _partition_month(name: str) -> Optional[date]:
+    match = _PARTITION_SUFFIX.search(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+async def _create_month(conn, table: str, key: str, month: date) -> None:
+    """
+    Creates one month's partition inside the caller's transaction. Rows that
+    already landed in the default partition for that month are moved into
+    it first — Postgres refuses to attach a range the default still holds.
+    """
+    default = f"{table}_default"
+    name = partition_name(table, month)
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    stranded = (await conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {key} >= {lower} AND {key} < {upper});"
+    ))).scalar()
+    if not stranded:
+        await conn.execute(text(partition_ddl(table, month)))
+        return
+    # Foreign keys into the moved rows are DEFERRABLE; check them at commit,
+    # once the new partition is attached
+    await conn.execute(text("SET CONSTRAINTS ALL DEFERRED;"))
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);"))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE {key} >= {lower} AND {key} < {upper} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved;"
+    ))
+    await conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper});"
+    ))
+    logger.info(f"Moved {table} rows for {month:%Y-%m} out of {default}.")
+
+
+async def ensure_partitions(engine, table: str, months_ahead: int = PARTITION_MONTHS_AHEAD) -> int:
+    """Creates missing partitions for this month, the next `months_ahead`, and any month stranded in the default."""
+    key = PARTITIONED_TABLES[table]
+    this_month = month_start(datetime.now(timezone(timedelta(hours=5, minutes=30))).date())
+    wanted = {add_months(this_month, n) for n in range(months_ahead + 1)}
+
+    async with engine.connect() as conn:
+        existing = {_partition_month(p) for p in await list_partitions(conn, table)}
+        stranded = await conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', {key} AT TIME ZONE 'UTC')::date FROM {table}_default;"
+        ))
+        wanted |= {row[0] for row in stranded}
+
+    created = 0
+    for month in sorted(wanted - existing):
+        try:
+            # One transaction per month, so a failure leaves the others in place
+            async with engine.begin() as conn:
+                await _create_month(conn, table, key, month)
+            created += 1
+        except Exception as e:
+            logger.error(f"Could not create {partition_name(table, month)}: {e}")
+    return created
+
+
+async def _appointment_partition_dropped(conn, name: str) -> None:
+    """
+    Bookkeeping for a detached appointments partition, in the caller's
+    transaction: sessions stop pointing at its rows (their foreign key did
+    not survive partitioning), counters drop its appointments, and its
+    days are marked for a rollup refresh.
+    """
+    await conn.execute(text(
+        f"UPDATE sessions SET appointment_id = NULL WHERE appointment_id IN (SELECT id FROM {name});"
+    ))
+    result = await conn.execute(text(
+        f"SELECT organization_id, doctor_id, (start_time AT TIME ZONE 'UTC')::date AS day, "
+        f"status::text = 'CANCELLED' AS cancelled, count(*) AS n "
+        f"FROM {name} GROUP BY 1, 2, 3, 4;"
+    ))
+    # Per-day counters older than this are not kept, so there is nothing to lower
+    day_cutoff = counters.today_ist() - timedelta(days=counters.DAY_COUNTER_RETENTION_DAYS)
+    deltas, days = counters.Deltas(), set()
+    for row in result:
+        deltas.add(counters.ORG, row.organization_id, "appointments", -row.n)
+        deltas.add(counters.USER, row.doctor_id, "appointments", -row.n)
+        if not row.cancelled and row.day >= day_cutoff:
+            deltas.add(counters.ORG, row.organization_id, counters.day_metric(row.day), -row.n)
+        days.add((row.organization_id, row.day))
+    await rollups.mark_dirty(conn, days)
+    await counters.bump(conn, deltas)
+
+
+async def drop_expired_partitions(engine, table: str, retention_months: int) -> int:
+    """
+    Detaches and drops partitions older than the retention window, one
+    transaction each. DETACH … CONCURRENTLY is not an option — Postgres
+    rejects it while the table has a default partition — so the plain
+    DETACH runs under a lock_timeout and a busy table just waits for the
+    next run. Expired slots are all in the past, so dropping availabilities
+    partitions changes no counters.
+    """
+    cutoff = add_months(month_start(date.today()), -retention_months)
+    async with engine.connect() as conn:
+        names = await list_partitions(conn, table)
+
+    dropped = 0
+    for name in names:
+        month = _partition_month(name)
+        if month is None or month >= cutoff:
+            continue
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}';"))
+                await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name};"))
+                if table == "appointments":
+                    await _appointment_partition_dropped(conn, name)
+                await conn.execute(text(f"DROP TABLE {name};"))
+            dropped += 1
+            logger.info(f"Dropped expired partition {name}.")
+        except Exception as e:
+            logger.error(f"Could not drop {name}: {e}")
+    return dropped
+
+
+async def maintain_partitions(engine) -> None:
+    """Periodic job: keeps future partitions ready and applies retention. A no-op until tables are converted."""
+    async with engine.connect() as conn:
+        partitioned = await partitioned_tables(conn)
+    for table in PARTITIONED_TABLES:
+        if table in partitioned:
+            await ensure_partitions(engine, table)
+    if PARTITION_RETENTION_MONTHS > 0:
+        for table in ("appointments", "availabilities"):
+            if table in partitioned:
+                await drop_expired_partitions(engine, table, PARTITION_RETENTION_MONTHS)
+
+
+# -------------------------------------------------------------------
+# Online index builds on partitioned tables
+#
+# CREATE INDEX CONCURRENTLY is rejected on a partitioned parent. The
+# equivalent is an (initially invalid) index ON ONLY the parent, a
+# concurrent build per partition, and ATTACH PARTITION for each —
+# the parent index turns valid once every partition is attached.
+# -------------------------------------------------------------------
+
+async def partitioned_index_plan(conn, sql: str) -> Optional[list]:
+    """
+    (child index name or None, statement) pairs replacing a CREATE INDEX
+    CONCURRENTLY when its table is partitioned; None otherwise. Child names
+    are returned so the caller can check each concurrent build is valid.
+    """
+    match = _CONCURRENT_INDEX.match(sql.strip().rstrip(";"))
+    if not match:
+        return None
+    unique, name, table, rest = match.group(1) or "", match.group(2), match.group(3), match.group(4)
+    if table not in await partitioned_tables(conn):
+        return None
+
+    plan = [(None, f"CREATE {unique}INDEX IF NOT EXISTS {name} ON ONLY {table}{rest};")]
+    for partition in await list_partitions(conn, table):
+        child = f"{name}__{partition[len(table) + 1:]}"[:63]
+        plan.append((child, f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition}{rest};"))
+        plan.append((None, f"ALTER INDEX {name} ATTACH PARTITION {child};"))
+    return plan
@@ -0,0 +1,236 @@
+from collections import deque
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import bisect
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("db-pool")
+
+# Adaptive sizing (off unless DB_POOL_ADAPTIVE=1): max_overflow moves between
+# the configured value and DB_POOL_MAX_OVERFLOW_CEILING based on checkout waits.
+DB_POOL_ADAPTIVE = os.getenv("DB_POOL_ADAPTIVE", "0") == "1"
+DB_POOL_MAX_OVERFLOW_CEILING = int(os.getenv("DB_POOL_MAX_OVERFLOW_CEILING", 60))
+DB_POOL_TARGET_WAIT_MS = float(os.getenv("DB_POOL_TARGET_WAIT_MS", 50))
+DB_POOL_ADAPT_INTERVAL_SECONDS = float(os.getenv("DB_POOL_ADAPT_INTERVAL_SECONDS", 30))
+DB_POOL_ADAPT_STEP = int(os.getenv("DB_POOL_ADAPT_STEP", 5))
+
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last slot is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self) -> dict:
+        cumulative, running = {}, 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "max_ms": round(self.max, 3),
+            "buckets_ms": cumulative,
+        }
+
+
+class PoolMetrics:
+    """Checkout latency, pre-ping cost/failures and connection ages for one pool."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool = None
+        self.checkout_latency = Histogram()
+        self.pre_ping_latency = Histogram()
+        self.pre_ping_failures = 0
+        self.checkout_timeouts = 0
+        self.invalidations = 0
+        self.connects = 0
+        self.closes = 0
+        self._born: dict = {}                   # id(dbapi_connection) → monotonic connect time
+        self._recent_waits = deque(maxlen=512)  # feeds the adaptive controller
+        self._lock = threading.Lock()
+        self.adaptive = None
+
+    def record_checkout(self, elapsed_ms: float):
+        with self._lock:
+            self.checkout_latency.observe(elapsed_ms)
+            self._recent_waits.append(elapsed_ms)
+        if self.adaptive:
+            self.adaptive.maybe_adjust()
+
+    def recent_p95(self) -> float:
+        with self._lock:
+            waits = sorted(self._recent_waits)
+        if not waits:
+            return 0.0
+        return waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+
+    def reset_recent(self):
+        with self._lock:
+            self._recent_waits.clear()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - born for born in self._born.values()]
+            data = {
+                "checkout_latency": self.checkout_latency.snapshot(),
+                "pre_ping_latency": self.pre_ping_latency.snapshot(),
+                "pre_ping_failures": self.pre_ping_failures,
+                "checkout_timeouts": self.checkout_timeouts,
+                "invalidations": self.invalidations,
+                "connects": self.connects,
+                "closes": self.closes,
+            }
+        data["connection_age_seconds"] = {
+            "count": len(ages),
+            "max": round(max(ages), 1) if ages else 0,
+            "mean": round(sum(ages) / len(ages), 1) if ages else 0,
+        }
+        if self.pool is not None:
+            data["gauges"] = {
+                "size": self.pool.size(),
+                "in_use": self.pool.checkedout(),
+                "idle": self.pool.checkedin(),
+                "overflow": max(0, self.pool.overflow()),
+                "max_overflow": self.pool._max_overflow,
+            }
+        if self.adaptive:
+            data["adaptive"] = self.adaptive.snapshot()
+        return data
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that times every checkout (queue wait + connect + pre-ping)."""
+
+    metrics: PoolMetrics = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except Exception as e:
+            if self.metrics and e.__class__.__name__ == "TimeoutError":
+                self.metrics.checkout_timeouts += 1
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.record_checkout((time.perf_counter() - start) * 1000)
+
+
+class AdaptivePoolController:
+    """
+    Raises max_overflow while the p95 checkout wait is above target and
+    lowers it again once waits are negligible and the extra headroom is
+    unused. pool_size itself stays fixed — only the overflow band moves.
+    """
+
+    def __init__(self, metrics: PoolMetrics, floor: int, ceiling: int):
+        self.metrics = metrics
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        self.adjustments = 0
+        self._last_eval = time.monotonic()
+
+    def maybe_adjust(self):
+        now = time.monotonic()
+        if now - self._last_eval < DB_POOL_ADAPT_INTERVAL_SECONDS:
+            return
+        self._last_eval = now
+
+        pool = self.metrics.pool
+        p95 = self.metrics.recent_p95()
+        current = pool._max_overflow
+        target = current
+        if p95 > DB_POOL_TARGET_WAIT_MS and current < self.ceiling:
+            target = min(self.ceiling, current + DB_POOL_ADAPT_STEP)
+        elif p95 < DB_POOL_TARGET_WAIT_MS / 10 and current > self.floor and pool.overflow() < current - DB_POOL_ADAPT_STEP:
+            target = max(self.floor, current - DB_POOL_ADAPT_STEP)
+
+        if target != current:
+            pool._max_overflow = target
+            self.adjustments += 1
+            logger.info(f"[{self.metrics.name}] max_overflow {current} → {target} (p95 checkout {p95:.1f}ms)")
+        self.metrics.reset_recent()
+
+    def snapshot(self) -> dict:
+        return {
+            "floor": self.floor,
+            "ceiling": self.ceiling,
+            "target_wait_ms": DB_POOL_TARGET_WAIT_MS,
+            "adjustments": self.adjustments,
+            "recent_p95_ms": round(self.metrics.recent_p95(), 3),
+        }
+
+
+pool_registry: dict = {}
+
+
+def instrument_engine(async_engine, name: str) -> PoolMetrics:
+    """Attaches metrics (and optionally the adaptive controller) to an engine built with InstrumentedQueuePool."""
+    sync_engine = async_engine.sync_engine
+    pool = sync_engine.pool
+    metrics = PoolMetrics(name)
+    metrics.pool = pool
+    pool.metrics = metrics
+
+    @event.listens_for(pool, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.connects += 1
+            metrics._born[id(dbapi_connection)] = time.monotonic()
+
+    @event.listens_for(pool, "close")
+    def _on_close(dbapi_connection, connection_record):
+        with metrics._lock:
+            metrics.closes += 1
+            metrics._born.pop(id(dbapi_connection), None)
+
+    @event.listens_for(pool, "close_detached")
+    def _on_close_detached(dbapi_connection):
+        with metrics._lock:
+            metrics._born.pop(id(dbapi_connection), None)
+
+    @event.listens_for(pool, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        with metrics._lock:
+            metrics.invalidations += 1
+
+    # Wrap the dialect's ping so pre-ping cost and failures are visible
+    dialect = sync_engine.dialect
+    original_ping = dialect.do_ping
+
+    def timed_ping(dbapi_connection):
+        start = time.perf_counter()
+        ok = False
+        try:
+            ok = original_ping(dbapi_connection)
+            return ok
+        finally:
+            with metrics._lock:
+                metrics.pre_ping_latency.observe((time.perf_counter() - start) * 1000)
+                if not ok:
+                    metrics.pre_ping_failures += 1
+
+    dialect.do_ping = timed_ping
+
+    if DB_POOL_ADAPTIVE:
+        metrics.adaptive = AdaptivePoolController(metrics, floor=pool._max_overflow, ceiling=DB_POOL_MAX_OVERFLOW_CEILING)
+
+    pool_registry[name] = metrics
+    return metrics
@@ -0,0 +1,188 @@
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Optional, Tuple
+import os
+import threading
+import time
+
+from .models import User, UserRole
+
+
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+CLAIMS_VERSION_TTL_SECONDS = int(os.getenv("CLAIMS_VERSION_TTL_SECONDS", 30))
+
+
+# -------------------------------------------------------------------
+# Principal — detached, read-only snapshot of the authenticated user
+# -------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    role: UserRole
+    organization_id: Optional[int]
+    is_active: bool
+    full_name: Optional[str] = None
+    phone_number: Optional[str] = None
+    # DOCTOR → own Doctor profile PK
+    doctor_profile_id: Optional[int] = None
+    # RECEPTIONIST → user ids of assigned doctors (mirrors Receptionist.doctor_ids)
+    assigned_doctor_user_ids: Tuple[int, ...] = ()
+    claims_version: int = 1
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        """Snapshot a User loaded with doctor_profile and receptionist_profile.doctors."""
+        assigned = ()
+        if user.receptionist_profile:
+            assigned = tuple(d.user_id for d in user.receptionist_profile.doctors)
+        return cls(
+            id=user.id,
+            email=user.email,
+            role=user.role,
+            organization_id=user.organization_id,
+            is_active=user.is_active,
+            full_name=user.full_name,
+            phone_number=user.phone_number,
+            doctor_profile_id=user.doctor_profile.id if user.doctor_profile else None,
+            assigned_doctor_user_ids=assigned,
+            claims_version=user.claims_version or 1,
+        )
+
+    @classmethod
+    def from_claims(cls, payload: dict) -> "Principal":
+        """Rebuild a principal from a verified access-token payload (see auth.build_claims)."""
+        return cls(
+            id=payload["uid"],
+            email=payload["sub"],
+            role=UserRole(payload["role"]),
+            organization_id=payload.get("org"),
+            is_active=True,
+            doctor_profile_id=payload.get("dpid"),
+            assigned_doctor_user_ids=tuple(payload.get("dids") or ()),
+            claims_version=payload["cv"],
+        )
+
+
+# -------------------------------------------------------------------
+# PrincipalCache — bounded LRU with TTL, keyed on the token subject
+# -------------------------------------------------------------------
+
+class PrincipalCache:
+    """
+    In-process cache in front of the get_current_user lookup.
+    Entries expire after `ttl` seconds, so other workers pick up admin
+    changes within one TTL even though eviction is per process.
+    """
+
+    def __init__(self, max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES, ttl: float = PRINCIPAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every eviction — a load that started before an eviction
+        # must not write its (possibly stale) result back afterwards.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, subject: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, principal = entry
+            if expires_at <= time.monotonic():
+                del self._entries[subject]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.hits += 1
+            return principal
+
+    def put(self, subject: str, principal: Principal, generation: int) -> None:
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[subject] = (time.monotonic() + self.ttl, principal)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(subject, None)
+
+    def invalidate_user_id(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for subject in [s for s, (_, p) in self._entries.items() if p.id == user_id]:
+                del self._entries[subject]
+
+    def invalidate_organization(self, organization_id: int) -> None:
+        """Drops every principal of an org — used when a change fans out to many users."""
+        with self._lock:
+            self._generation += 1
+            for subject in [s for s, (_, p) in self._entries.items() if p.organization_id == organization_id]:
+                del self._entries[subject]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+principal_cache = PrincipalCache()
+
+
+# -------------------------------------------------------------------
+# ClaimVersionCache — current users.claims_version per user id
+# -------------------------------------------------------------------
+
+class ClaimVersionCache:
+    """
+    Short-lived map of user id → claims_version, used to reject access
+    tokens minted before an admin change. Local admin writes update it
+    immediately; other workers converge within `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = CLAIMS_VERSION_TTL_SECONDS):
+        self.ttl = ttl
+        self._versions: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            entry = self._versions.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def set(self, user_id: int, version: int) -> None:
+        with self._lock:
+            # Versions only grow — never let a slow read overwrite a local bump
+            current = self._versions.get(user_id)
+            if current is not None and current[1] > version:
+                version = current[1]
+            self._versions[user_id] = (time.monotonic() + self.ttl, version)
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._versions.pop(user_id, None)
+
+
+claim_versions = ClaimVersionCache()
@@ -0,0 +1,128 @@
+from datetime import timedelta
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy import text
+
+from .counters import now_ist_naive
+
+logger = logging.getLogger("reaper")
+
+# pg advisory lock id — one worker reaps per tick
+SLOT_REAPER_LOCK_KEY = 7_340_026
+SLOT_REAPER_INTERVAL_SECONDS = int(os.getenv("SLOT_REAPER_INTERVAL_SECONDS", 900))
+# "archive" moves rows to availabilities_archive, "delete" drops them, "off" disables the job
+SLOT_REAPER_MODE = os.getenv("SLOT_REAPER_MODE", "archive")
+# Count what would be reaped, change nothing
+SLOT_REAPER_DRY_RUN = os.getenv("SLOT_REAPER_DRY_RUN", "0") == "1"
+# Slots are reaped once they started more than this long ago
+SLOT_REAPER_GRACE_HOURS = float(os.getenv("SLOT_REAPER_GRACE_HOURS", 24))
+SLOT_REAPER_BATCH_SIZE = int(os.getenv("SLOT_REAPER_BATCH_SIZE", 1000))
+SLOT_REAPER_MAX_BATCHES = int(os.getenv("SLOT_REAPER_MAX_BATCHES", 200))
+# Minimum pause between batches; the pause also grows with batch time,
+# capping the reaper at roughly half of one connection's time
+SLOT_REAPER_PAUSE_SECONDS = float(os.getenv("SLOT_REAPER_PAUSE_SECONDS", 0.2))
+
+reaper_status: dict = {
+    "mode": SLOT_REAPER_MODE,
+    "dry_run": SLOT_REAPER_DRY_RUN,
+    "runs": 0,
+    "reaped_total": 0,
+    "last_run_reaped": 0,
+    "last_run_batches": 0,
+    "last_run_seconds": None,
+    "last_batch_ms": None,
+    "would_reap": None,
+}
+
+
+# -------------------------------------------------------------------
+# Expired-slot reaper
+#
+# Unbooked slots whose start is past never become bookable again, but
+# they stay in every availability index. The reaper removes them in
+# small batches, each its own short transaction, pausing in between so
+# foreground writes keep the table. Rows are addressed by
+# (tableoid, ctid): cheap to locate, and still unique once the table is
+# partitioned (a bare ctid repeats across partitions). SKIP LOCKED
+# passes over slots someone is booking right now.
+#
+# Only past slots are touched, so dashboard counters (which count open
+# *future* slots) are unaffected.
+# -------------------------------------------------------------------
+
+_EXPIRED = (
+    "SELECT s.tableoid, s.ctid FROM availabilities s "
+    "WHERE s.is_booked = false AND s.start_time < :cutoff "
+    "AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.availability_id = s.id) "
+)
+
+_DELETE_BATCH = text(
+    "DELETE FROM availabilities WHERE (tableoid, ctid) IN ("
+    f"{_EXPIRED} LIMIT :n FOR UPDATE OF s SKIP LOCKED);"
+)
+
+_ARCHIVE_BATCH = text(
+    "WITH gone AS ("
+    "  DELETE FROM availabilities WHERE (tableoid, ctid) IN ("
+    f"    {_EXPIRED} LIMIT :n FOR UPDATE OF s SKIP LOCKED"
+    "  ) RETURNING id, doctor_id, organization_id, start_time, end_time, created_by_id, created_at"
+    ") "
+    "INSERT INTO availabilities_archive (id, doctor_id, organization_id, start_time, end_time, created_by_id, created_at) "
+    "SELECT id, doctor_id, organization_id, start_time, end_time, created_by_id, created_at FROM gone "
+    "ON CONFLICT (id) DO NOTHING;"
+)
+
+_COUNT_EXPIRED = text(
+    "SELECT count(*) FROM availabilities s "
+    "WHERE s.is_booked = false AND s.start_time < :cutoff "
+    "AND NOT EXISTS (SELECT 1 FROM appointments a WHERE a.availability_id = s.id);"
+)
+
+
+def reaper_cutoff():
+    return now_ist_naive() - timedelta(hours=SLOT_REAPER_GRACE_HOURS)
+
+
+async def reap_expired_slots(engine) -> int:
+    """One reaper run: up to SLOT_REAPER_MAX_BATCHES batches, or until nothing expired is left."""
+    if SLOT_REAPER_MODE == "off":
+        return 0
+    cutoff = reaper_cutoff()
+    started = time.monotonic()
+
+    if SLOT_REAPER_DRY_RUN:
+        async with engine.connect() as conn:
+            would = (await conn.execute(_COUNT_EXPIRED, {"cutoff": cutoff})).scalar()
+        reaper_status.update(would_reap=would, runs=reaper_status["runs"] + 1)
+        logger.info(f"[dry run] {would} expired slot(s) would be {SLOT_REAPER_MODE}d.")
+        return 0
+
+    statement = _ARCHIVE_BATCH if SLOT_REAPER_MODE == "archive" else _DELETE_BATCH
+    reaped = batches = 0
+    while batches < SLOT_REAPER_MAX_BATCHES:
+        batch_started = time.monotonic()
+        async with engine.begin() as conn:
+            # Never queue behind a foreground lock for long — give up and retry next tick
+            await conn.execute(text("SET LOCAL lock_timeout = '2s';"))
+            result = await conn.execute(statement, {"cutoff": cutoff, "n": SLOT_REAPER_BATCH_SIZE})
+        elapsed = time.monotonic() - batch_started
+        batches += 1
+        reaped += result.rowcount
+        reaper_status["last_batch_ms"] = round(elapsed * 1000, 1)
+        if result.rowcount < SLOT_REAPER_BATCH_SIZE:
+            break
+        await asyncio.sleep(max(SLOT_REAPER_PAUSE_SECONDS, elapsed))
+
+    reaper_status.update(
+        runs=reaper_status["runs"] + 1,
+        reaped_total=reaper_status["reaped_total"] + reaped,
+        last_run_reaped=reaped,
+        last_run_batches=batches,
+        last_run_seconds=round(time.monotonic() - started, 2),
+    )
+    if reaped:
+        logger.info(f"Reaped {reaped} expired slot(s) in {batches} batch(es) ({SLOT_REAPER_MODE}).")
+    return reaped
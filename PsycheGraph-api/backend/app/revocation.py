@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import logging
+import os
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import RevokedToken
+
+logger = logging.getLogger("revocation")
+
+# How often a worker pulls revocations made by other workers
+REVOCATION_SYNC_SECONDS = int(os.getenv("REVOCATION_SYNC_SECONDS", 30))
+# Overlap when syncing, so rows committed slightly out of revoked_at order are not missed
+_SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class RevocationFilter:
+    """
+    In-process set of revoked refresh-token jtis that have not expired yet.
+    Rebuilt at startup, updated locally on revoke and topped up from
+    revoked_tokens at most every REVOCATION_SYNC_SECONDS, so the usual
+    "not revoked" answer costs no query.
+    """
+
+    def __init__(self, sync_interval: float = REVOCATION_SYNC_SECONDS):
+        self.sync_interval = sync_interval
+        self._revoked: dict = {}           # jti → expires_at (unix ts)
+        self._watermark: Optional[datetime] = None
+        self._last_sync = 0.0
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def is_revoked(self, jti: str) -> bool:
+        expires_at = self._revoked.get(jti)
+        return expires_at is not None and expires_at > time.time()
+
+    def _add(self, jti: str, expires_at: datetime, revoked_at: Optional[datetime] = None):
+        self._revoked[jti] = expires_at.timestamp()
+        if revoked_at and (self._watermark is None or revoked_at > self._watermark):
+            self._watermark = revoked_at
+
+    def _prune(self):
+        now = time.time()
+        for jti in [j for j, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+    async def rebuild(self, conn):
+        """Drops expired rows and reloads the filter — called once per worker at startup."""
+        now = datetime.now(timezone.utc)
+        await conn.execute(delete(RevokedToken).where(RevokedToken.expires_at < now))
+        result = await conn.execute(
+            select(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at)
+        )
+        self._revoked.clear()
+        self._watermark = None
+        for jti, expires_at, revoked_at in result.fetchall():
+            self._add(jti, expires_at, revoked_at)
+        self._last_sync = time.monotonic()
+        logger.info(f"Revocation filter loaded with {len(self._revoked)} active entries")
+
+    async def sync_if_stale(self, db):
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = time.monotonic()
+        query = select(RevokedToken.jti, RevokedToken.expires_at, RevokedToken.revoked_at)
+        if self._watermark is not None:
+            query = query.where(RevokedToken.revoked_at >= self._watermark - _SYNC_OVERLAP)
+        result = await db.execute(query)
+        for jti, expires_at, revoked_at in result.fetchall():
+            self._add(jti, expires_at, revoked_at)
+        self._prune()
+
+    async def revoke(self, db, jti: str, user_id: Optional[int], expires_at: datetime) -> bool:
+        """
+        Records the jti in the caller's transaction. Returns False if it was
+        already revoked — with rotation that means the token was replayed.
+        Call remember() once the transaction has committed.
+        """
+        result = await db.execute(
+            insert(RevokedToken)
+            .values(jti=jti, user_id=user_id, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+            .returning(RevokedToken.jti)
+        )
+        inserted = result.scalar() is not None
+        if not inserted:
+            # Already committed by someone else
+            self._add(jti, expires_at)
+        return inserted
+
+    def remember(self, jti: str, expires_at: datetime):
+        """Adds a committed revocation to this worker's filter."""
+        self._add(jti, expires_at)
+
+
+revocation_filter = RevocationFilter()
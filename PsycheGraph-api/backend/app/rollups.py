@@ -0,0 +1,137 @@
+from datetime import date, timedelta
+import logging
+import os
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session as OrmSession
+
+from .models import Appointment, AppointmentRollupDirty
+
+logger = logging.getLogger("rollups")
+
+# pg advisory lock id — one worker refreshes rollups per tick
+ROLLUP_REFRESH_LOCK_KEY = 7_340_024
+ROLLUP_REFRESH_SECONDS = int(os.getenv("ROLLUP_REFRESH_SECONDS", 60))
+# (organization, day) pairs recomputed per transaction
+ROLLUP_BATCH_DAYS = int(os.getenv("ROLLUP_BATCH_DAYS", 500))
+
+BUCKETS = ("day", "week", "month")
+
+
+# -------------------------------------------------------------------
+# Appointment rollups
+#
+# appointment_rollups holds per-day counts by (organization, doctor,
+# status, booked_by_role). Any flush that inserts, changes or deletes
+# an Appointment — including ORM cascades from patient / organization
+# deletes — marks the affected (organization, day) pairs dirty in the
+# same transaction; refresh_rollups() recomputes those days from the
+# appointments table. Days are IST calendar days, like the counters.
+# -------------------------------------------------------------------
+
+def bucket_start(day: date, bucket: str) -> date:
+    """Python twin of date_trunc(bucket, day) — weeks start on Monday, as in Postgres."""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _days_of(appointment, include_previous: bool) -> set:
+    state = inspect(appointment)
+    values = [appointment.appointment_date]
+    orgs = [appointment.organization_id]
+    if include_previous:
+        values += state.attrs.appointment_date.history.deleted
+        orgs += state.attrs.organization_id.history.deleted
+    return {(org, value.date()) for org in orgs for value in values if org is not None and value is not None}
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _collect_dirty_days(session, flush_context, instances):
+    days = set()
+    for obj in session.new:
+        if isinstance(obj, Appointment):
+            days |= _days_of(obj, include_previous=False)
+    for obj in session.dirty:
+        if isinstance(obj, Appointment) and session.is_modified(obj):
+            days |= _days_of(obj, include_previous=True)
+    for obj in session.deleted:
+        if isinstance(obj, Appointment):
+            days |= _days_of(obj, include_previous=True)
+    if days:
+        session.info.setdefault("rollup_dirty_days", set()).update(days)
+
+
+def _dirty_insert(days: set):
+    return (
+        insert(AppointmentRollupDirty)
+        .values([{"organization_id": org, "day": day} for org, day in sorted(days)])
+        .on_conflict_do_nothing()
+    )
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _mark_dirty_days(session, flush_context):
+    days = session.info.pop("rollup_dirty_days", None)
+    if not days:
+        return
+    session.connection().execute(_dirty_insert(days))
+
+
+async def mark_dirty(db, days: set) -> None:
+    """Marks (organization_id, day) pairs dirty for appointment writes made with Core statements, which skip the flush hooks."""
+    if days:
+        await db.execute(_dirty_insert(days))
+
+
+_PICK_DIRTY = text(
+    "DELETE FROM appointment_rollup_dirty WHERE (organization_id, day) IN ("
+    "  SELECT organization_id, day FROM appointment_rollup_dirty "
+    "  ORDER BY marked_at LIMIT :n FOR UPDATE SKIP LOCKED"
+    ") RETURNING organization_id, day;"
+)
+
+_PICKED = "unnest(CAST(:orgs AS integer[]), CAST(:days AS date[])) AS p(organization_id, day)"
+
+_CLEAR_DAYS = text(
+    f"DELETE FROM appointment_rollups r USING {_PICKED} "
+    "WHERE r.organization_id = p.organization_id AND r.day = p.day;"
+)
+
+# Appointment times are naive IST values stored as if UTC, so a day's
+# range is [day, day + 1) read "AT TIME ZONE 'UTC'".
+_RECOMPUTE_DAYS = text(
+    "INSERT INTO appointment_rollups (organization_id, day, doctor_id, status, booked_by_role, count) "
+    "SELECT a.organization_id, p.day, a.doctor_id, a.status::text, coalesce(a.booked_by_role, ''), count(*) "
+    f"FROM {_PICKED} "
+    "JOIN appointments a ON a.organization_id = p.organization_id "
+    " AND a.appointment_date >= (p.day::timestamp AT TIME ZONE 'UTC') "
+    " AND a.appointment_date < ((p.day + 1)::timestamp AT TIME ZONE 'UTC') "
+    "GROUP BY a.organization_id, p.day, a.doctor_id, a.status, coalesce(a.booked_by_role, '');"
+)
+
+
+async def refresh_rollups(engine) -> None:
+    """
+    Recomputes dirty days in batches. Markers are removed in the same
+    transaction that rewrites their rows; a writer that marks a day while
+    it is being recomputed re-inserts the marker once this commits, so its
+    change is picked up on the next tick.
+    """
+    total = 0
+    while True:
+        async with engine.begin() as conn:
+            picked = (await conn.execute(_PICK_DIRTY, {"n": ROLLUP_BATCH_DAYS})).all()
+            if not picked:
+                break
+            params = {"orgs": [r.organization_id for r in picked], "days": [r.day for r in picked]}
+            await conn.execute(_CLEAR_DAYS, params)
+            await conn.execute(_RECOMPUTE_DAYS, params)
+        total += len(picked)
+        if len(picked) < ROLLUP_BATCH_DAYS:
+            break
+    if total:
+        logger.info(f"Refreshed appointment rollups for {total} organization-day(s).")
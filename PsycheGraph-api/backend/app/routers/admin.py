@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, UploadFile, File, Form, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from typing import List, Optional
-from .. import models, schemas, auth, dependencies, database
+from .. import models, schemas, auth, dependencies, database, counters
+from ..principal import Principal, principal_cache, claim_versions
+from ..pagination import PageParams, page_params, paginate, finish_page
+from ..parallel import ParallelReader, get_parallel_reader
 from sqlalchemy.orm import selectinload
+from sqlalchemy import update
 from ..services.email import send_license_key_email
 from concurrent.futures import ThreadPoolExecutor
 import shutil, os, uuid
@@ -25,7 +29,7 @@ router = APIRouter(prefix="/admin", tags=["Admin"])
 async def register_organization(
     org: schemas.OrganizationCreate,
     background_tasks: BackgroundTasks,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     existing = await db.execute(
@@ -48,6 +52,7 @@ async def register_organization(
     )
     db.add(new_org)
     try:
+        await counters.bump(db, counters.Deltas().add(counters.GLOBAL, 0, "organizations"))
         await db.commit()
         await db.refresh(new_org)
     except Exception as e:
@@ -72,21 +77,20 @@ async def register_organization(
 
 @router.get("/organizations", response_model=List[schemas.OrganizationOut])
 async def get_organizations(
-    skip: int = 0,
-    limit: int = 100,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    response: Response,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    result = await db.execute(
-        select(models.Organization).offset(skip).limit(limit)
-    )
-    return result.scalars().all()
+    query = paginate(select(models.Organization), page, models.Organization.id, models.Organization.id)
+    result = await db.execute(query)
+    return finish_page(result.scalars().all(), page, response, "id")
 
 
 @router.get("/organizations/{org_id}", response_model=schemas.OrganizationOut)
 async def get_organization(
     org_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     result = await db.execute(
@@ -102,7 +106,7 @@ async def get_organization(
 async def update_organization(
     org_id: int,
     org_update: schemas.OrganizationUpdate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     result = await db.execute(
@@ -124,13 +128,14 @@ async def update_organization(
         await db.rollback()
         logger.error(f"update_organization commit failed for org_id={org_id}: {e}")
         raise HTTPException(status_code=500, detail="Update failed. Please try again.")
+    principal_cache.invalidate_organization(org_id)
     return org
 
 
 @router.delete("/organizations/{org_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_organization(
     org_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     result = await db.execute(
@@ -139,14 +144,48 @@ async def delete_organization(
     org = result.scalars().first()
     if not org:
         raise HTTPException(status_code=404, detail="Organization not found")
-    await db.delete(org)
     # ADDED: was a bare commit with no error handling
     try:
+        await counters.bump(db, await counters.organization_removed(db, org_id, counters.Deltas()))
+        await db.delete(org)
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"delete_organization commit failed for org_id={org_id}: {e}")
         raise HTTPException(status_code=500, detail="Delete failed. Please try again.")
+    principal_cache.invalidate_organization(org_id)
+    return None
+
+
+# -------------------------------------------------------------------
+# Token revocation (Super Admin any user, Hospital Admin own org)
+# Bumping claims_version rejects every access and refresh token the
+# user currently holds; they must log in again.
+# -------------------------------------------------------------------
+
+@router.post("/users/{user_id}/revoke-tokens", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_user_tokens(
+    user_id: int,
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    db: AsyncSession = Depends(database.get_db)
+):
+    query = select(models.User).where(models.User.id == user_id)
+    if current_user.role == models.UserRole.HOSPITAL:
+        query = query.where(models.User.organization_id == current_user.organization_id)
+    result = await db.execute(query)
+    user = result.scalars().first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    bump_claims_version(user)
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"revoke_user_tokens commit failed for user_id={user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Revocation failed. Please try again.")
+    principal_cache.invalidate(user.email)
+    claim_versions.set(user.id, user.claims_version)
     return None
 
 
@@ -156,9 +195,9 @@ async def delete_organization(
 
 async def get_role_users(
     role: models.UserRole,
-    skip: int,
-    limit: int,
-    current_user: models.User,
+    page: PageParams,
+    response: Response,
+    current_user: Principal,
     db: AsyncSession,
     org_id: Optional[int] = None
 ):
@@ -175,9 +214,9 @@ async def get_role_users(
     else:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    query = query.offset(skip).limit(limit)
+    query = paginate(query, page, models.User.id, models.User.id)
     result = await db.execute(query)
-    return result.scalars().all()
+    return finish_page(result.scalars().all(), page, response, "id")
 
 
 async def fetch_user_with_profiles(user_id: int, db: AsyncSession) -> models.User:
@@ -193,6 +232,11 @@ async def fetch_user_with_profiles(user_id: int, db: AsyncSession) -> models.Use
     return result.scalars().first()
 
 
+def bump_claims_version(user: models.User):
+    """Makes access tokens already issued to `user` stale (see dependencies.get_current_claims)."""
+    user.claims_version = (user.claims_version or 1) + 1
+
+
 # -------------------------------------------------------------------
 # FIX: Validate multiple doctor IDs in a single IN query
 # instead of one DB query per doctor (N+1 problem)
@@ -234,16 +278,17 @@ hospital_profile_router = APIRouter(prefix="/admin/hospital", tags=["Hospital Pr
 
 @hospital_router.get("", response_model=List[schemas.UserOut])
 async def list_hospitals(
-    skip: int = 0, limit: int = 100,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    response: Response,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    return await get_role_users(models.UserRole.HOSPITAL, skip, limit, current_user, db)
+    return await get_role_users(models.UserRole.HOSPITAL, page, response, current_user, db)
 
 @hospital_router.get("/{user_id}", response_model=schemas.UserOut)
 async def get_hospital(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     user = await fetch_user_with_profiles(user_id, db)
@@ -255,7 +300,7 @@ async def get_hospital(
 async def update_hospital(
     user_id: int,
     user_update: schemas.UserUpdate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     user = await fetch_user_with_profiles(user_id, db)
@@ -264,10 +309,12 @@ async def update_hospital(
 
     update_data = user_update.model_dump(exclude_unset=True)
     if "password" in update_data:
-        update_data["hashed_password"] = auth.get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await auth.hash_password_async(update_data.pop("password"))
     for key, value in update_data.items():
         setattr(user, key, value)
 
+    bump_claims_version(user)
+
     # ADDED: was a bare commit with no error handling
     try:
         await db.commit()
@@ -275,25 +322,31 @@ async def update_hospital(
         await db.rollback()
         logger.error(f"update_hospital commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Update failed. Please try again.")
+    principal_cache.invalidate(user.email)
+    claim_versions.set(user.id, user.claims_version)
     return await fetch_user_with_profiles(user_id, db)
 
 @hospital_router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_hospital(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     user = await fetch_user_with_profiles(user_id, db)
     if not user or user.role != models.UserRole.HOSPITAL:
         raise HTTPException(status_code=404, detail="Hospital Admin not found")
-    await db.delete(user)
+    email = user.email
     # ADDED: was a bare commit with no error handling
     try:
+        await counters.bump(db, await counters.user_removed(db, user, counters.Deltas()))
+        await db.delete(user)
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"delete_hospital commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Delete failed. Please try again.")
+    principal_cache.invalidate(email)
+    claim_versions.forget(user_id)
     return None
 
 
@@ -301,8 +354,8 @@ async def delete_hospital(
 @hospital_profile_router.get("/profile", response_model=schemas.HospitalProfileOut)
 async def get_hospital_profile(
     org_id: Optional[int] = None,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.HOSPITAL, models.UserRole.SUPER_ADMIN, models.UserRole.RECEPTIONIST, models.UserRole.DOCTOR])),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.HOSPITAL, models.UserRole.SUPER_ADMIN, models.UserRole.RECEPTIONIST, models.UserRole.DOCTOR])),
+    parallel: ParallelReader = Depends(get_parallel_reader)
 ):
     """GET hospital profile — org name, logo, address, email + admin full_name, phone_number."""
     if current_user.role == models.UserRole.SUPER_ADMIN:
@@ -312,29 +365,30 @@ async def get_hospital_profile(
     else:
         target_org_id = current_user.organization_id
 
-    org_res = await db.execute(
-        select(models.Organization).where(models.Organization.id == target_org_id)
-    )
-    org = org_res.scalars().first()
-    if not org:
-        raise HTTPException(status_code=404, detail="Organization not found")
+    org_query = select(models.Organization).where(models.Organization.id == target_org_id)
 
     # For hospital role: use current_user directly
-    # For super admin: fetch the hospital admin user of that org
+    # For super admin: fetch the hospital admin user of that org, alongside the org
     if current_user.role == models.UserRole.SUPER_ADMIN:
-        hospital_user_res = await db.execute(
-            select(models.User).where(
+        org_res, hospital_user_res = await parallel(
+            org_query,
+            select(models.User.full_name, models.User.phone_number).where(
                 models.User.organization_id == target_org_id,
                 models.User.role == models.UserRole.HOSPITAL
-            )
+            ).limit(1),
         )
-        hospital_user = hospital_user_res.scalars().first()
+        hospital_user = hospital_user_res.first()
         full_name    = hospital_user.full_name    if hospital_user else None
         phone_number = hospital_user.phone_number if hospital_user else None
     else:
+        (org_res,) = await parallel(org_query)
         full_name    = current_user.full_name
         phone_number = current_user.phone_number
 
+    org = org_res.scalars().first()
+    if not org:
+        raise HTTPException(status_code=404, detail="Organization not found")
+
     return schemas.HospitalProfileOut(
         org_name=org.name,
         email=org.email,
@@ -370,7 +424,7 @@ async def update_hospital_profile(
     phone_number: Optional[str] = Form(None),
     address:      Optional[str] = Form(None),
     logo:         Optional[UploadFile] = File(None),
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.HOSPITAL, models.UserRole.SUPER_ADMIN])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.HOSPITAL, models.UserRole.SUPER_ADMIN])),
     db: AsyncSession = Depends(database.get_db)
 ):
     """PUT hospital profile — phone_number (users table), address + logo_url (organizations table)."""
@@ -388,8 +442,11 @@ async def update_hospital_profile(
     if not org:
         raise HTTPException(status_code=404, detail="Organization not found")
 
+    # current_user is a detached Principal — load the row we actually modify
+    admin_user = await db.get(models.User, current_user.id)
+
     if phone_number is not None:
-        current_user.phone_number = phone_number
+        admin_user.phone_number = phone_number
 
     if address is not None:
         org.address = address
@@ -407,19 +464,20 @@ async def update_hospital_profile(
     try:
         await db.commit()
         await db.refresh(org)
-        await db.refresh(current_user)
+        await db.refresh(admin_user)
     except Exception as e:
         await db.rollback()
         logger.error(f"update_hospital_profile commit failed for org_id={target_org_id}: {e}")
         raise HTTPException(status_code=500, detail="Profile update failed. Please try again.")
+    principal_cache.invalidate(admin_user.email)
 
     return schemas.HospitalProfileOut(
         org_name=org.name,
         email=org.email,
         logo_url=org.logo_url,
         address=org.address,
-        full_name=current_user.full_name,
-        phone_number=current_user.phone_number,
+        full_name=admin_user.full_name,
+        phone_number=admin_user.phone_number,
     )
 
 
@@ -432,7 +490,7 @@ doctor_router = APIRouter(prefix="/admin/doctors", tags=["Doctor Login"])
 @doctor_router.post("", response_model=schemas.DoctorOut)
 async def create_doctor(
     user: schemas.DoctorRegister,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db),
     organization_id: Optional[int] = None
 ):
@@ -453,7 +511,7 @@ async def create_doctor(
     # 1. Create User row
     new_user = models.User(
         email=user.email,
-        hashed_password=auth.get_password_hash(user.password),
+        hashed_password=await auth.hash_password_async(user.password),
         role=models.UserRole.DOCTOR,
         organization_id=org_id,
         full_name=user.full_name,
@@ -480,21 +538,25 @@ async def create_doctor(
         logger.error(f"create_doctor profile flush failed for user_id={new_user.id}: {e}")  # ADDED
         raise HTTPException(status_code=500, detail="Doctor profile creation failed. Please try again.")  # FIXED: was leaking str(e)
 
+    await counters.bump(
+        db, counters.Deltas().add(counters.GLOBAL, 0, "users").add(counters.ORG, org_id, "doctors")
+    )
     await db.commit()
     return await fetch_user_with_profiles(new_user.id, db)
 
 @doctor_router.get("", response_model=List[schemas.DoctorOut])
 async def list_doctors(
-    skip: int = 0, limit: int = 100,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
+    response: Response,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    return await get_role_users(models.UserRole.DOCTOR, skip, limit, current_user, db)
+    return await get_role_users(models.UserRole.DOCTOR, page, response, current_user, db)
 
 @doctor_router.get("/{user_id}", response_model=schemas.DoctorOut)
 async def get_doctor(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -513,7 +575,7 @@ async def get_doctor(
 async def update_doctor(
     user_id: int,
     user_update: schemas.UserUpdate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -529,11 +591,13 @@ async def update_doctor(
 
     update_data = user_update.model_dump(exclude_unset=True)
     if "password" in update_data:
-        update_data["hashed_password"] = auth.get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await auth.hash_password_async(update_data.pop("password"))
     update_data.pop("doctor_ids", None)
     for key, value in update_data.items():
         setattr(user, key, value)
 
+    bump_claims_version(user)
+
     # ADDED: was a bare commit with no error handling
     try:
         await db.commit()
@@ -541,12 +605,14 @@ async def update_doctor(
         await db.rollback()
         logger.error(f"update_doctor commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Update failed. Please try again.")
+    principal_cache.invalidate(user.email)
+    claim_versions.set(user.id, user.claims_version)
     return await fetch_user_with_profiles(user_id, db)
 
 @doctor_router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_doctor(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -559,14 +625,36 @@ async def delete_doctor(
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Doctor not found")
-    await db.delete(user)
+    email, org_id = user.email, user.organization_id
+
+    # Receptionists assigned to this doctor carry its id in their "dids" claim
+    rec_res = await db.execute(
+        update(models.User)
+        .where(models.User.id.in_(
+            select(models.Receptionist.user_id).where(models.Receptionist.doctor_ids.any(user_id))
+        ))
+        .values(claims_version=models.User.claims_version + 1)
+        .returning(models.User.id, models.User.claims_version)
+        .execution_options(synchronize_session=False)
+    )
+    bumped_receptionists = rec_res.fetchall()
+
     # ADDED: was a bare commit with no error handling
     try:
+        await counters.bump(db, await counters.user_removed(db, user, counters.Deltas()))
+        await db.delete(user)
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"delete_doctor commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Delete failed. Please try again.")
+    # Receptionists assigned to this doctor cache the doctor in their principal
+    principal_cache.invalidate(email)
+    claim_versions.forget(user_id)
+    for rec_user_id, version in bumped_receptionists:
+        claim_versions.set(rec_user_id, version)
+    if org_id:
+        principal_cache.invalidate_organization(org_id)
     return None
 
 
@@ -579,7 +667,7 @@ receptionist_router = APIRouter(prefix="/admin/receptionists", tags=["Receptioni
 @receptionist_router.post("", response_model=schemas.ReceptionistOut)
 async def create_receptionist(
     user: schemas.ReceptionistRegister,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db),
     organization_id: Optional[int] = None
 ):
@@ -605,7 +693,7 @@ async def create_receptionist(
     # 1. Create User row
     new_user = models.User(
         email=user.email,
-        hashed_password=auth.get_password_hash(user.password),
+        hashed_password=await auth.hash_password_async(user.password),
         role=models.UserRole.RECEPTIONIST,
         organization_id=org_id,
         full_name=user.full_name,
@@ -632,21 +720,23 @@ async def create_receptionist(
         logger.error(f"create_receptionist profile flush failed for user_id={new_user.id}: {e}")  # ADDED
         raise HTTPException(status_code=500, detail="Receptionist profile creation failed. Please try again.")  # FIXED: was leaking str(e)
 
+    await counters.bump(db, counters.Deltas().add(counters.GLOBAL, 0, "users"))
     await db.commit()
     return await fetch_user_with_profiles(new_user.id, db)
 
 @receptionist_router.get("", response_model=List[schemas.ReceptionistOut])
 async def list_receptionists(
-    skip: int = 0, limit: int = 100,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
+    response: Response,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    return await get_role_users(models.UserRole.RECEPTIONIST, skip, limit, current_user, db)
+    return await get_role_users(models.UserRole.RECEPTIONIST, page, response, current_user, db)
 
 @receptionist_router.get("/{user_id}", response_model=schemas.ReceptionistOut)
 async def get_receptionist(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -665,7 +755,7 @@ async def get_receptionist(
 async def update_receptionist(
     user_id: int,
     user_update: schemas.UserUpdate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -681,7 +771,7 @@ async def update_receptionist(
 
     update_data = user_update.model_dump(exclude_unset=True)
     if "password" in update_data:
-        update_data["hashed_password"] = auth.get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await auth.hash_password_async(update_data.pop("password"))
 
     if "assigned_doctor_user_ids" in update_data:
         new_doc_ids = update_data.pop("assigned_doctor_user_ids") or []
@@ -701,6 +791,8 @@ async def update_receptionist(
     for key, value in update_data.items():
         setattr(user, key, value)
 
+    bump_claims_version(user)
+
     # ADDED: was a bare commit with no error handling
     try:
         await db.commit()
@@ -708,12 +800,14 @@ async def update_receptionist(
         await db.rollback()
         logger.error(f"update_receptionist commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Update failed. Please try again.")
+    principal_cache.invalidate(user.email)
+    claim_versions.set(user.id, user.claims_version)
     return await fetch_user_with_profiles(user_id, db)
 
 @receptionist_router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_receptionist(
     user_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.SUPER_ADMIN, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
     query = select(models.User).options(
@@ -726,12 +820,16 @@ async def delete_receptionist(
     user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="Receptionist not found")
-    await db.delete(user)
+    email = user.email
     # ADDED: was a bare commit with no error handling
     try:
+        await counters.bump(db, await counters.user_removed(db, user, counters.Deltas()))
+        await db.delete(user)
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"delete_receptionist commit failed for user_id={user_id}: {e}")
         raise HTTPException(status_code=500, detail="Delete failed. Please try again.")
-    return None
\ No newline at end of file
+    principal_cache.invalidate(email)
+    claim_versions.forget(user_id)
+    return None
@@ -1,14 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, status, BackgroundTasks, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from typing import List, Optional
-from .. import models, schemas, dependencies, database
+from .. import models, schemas, dependencies, database, counters, rollups
+from ..principal import Principal
+from ..scopes import apply_scope, fetch_scoped
+from ..pagination import PageParams, page_params, paginate, finish_page
+from ..streaming import stream_format, stream_response
 from ..database import AsyncSessionLocal
-from sqlalchemy import text
+from ..virtual_slots import VIRTUAL_SLOT_MAX_DAYS, load_engine, is_virtual_slot, lock_doctor_bookings
+from ..free_time import FREE_TIME_SEARCH_MAX_DAYS, free_time_index
+from ..booking import book_slot, book_slots, slot_by_id, first_open_slot
+from ..idempotency import Idempotency, IdempotencyRequest, idempotency
+from sqlalchemy import text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta, timezone
 from ..services.google_calendar import GoogleCalendarService
-from ..services.email import send_meet_link_email, send_reschedule_email
+from ..services.email import send_meet_link_email, send_meet_links_email, send_reschedule_email
 from ..services.fireflies import send_bot_to_meeting as ff_send_bot
 from apscheduler.schedulers.background import BackgroundScheduler
 import asyncio
@@ -17,7 +26,9 @@ import psycopg2
 import os
 import threading
 import logging
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 scheduler = BackgroundScheduler()
 scheduler.start()
@@ -28,6 +39,13 @@ executor = ThreadPoolExecutor()
 
 IST = timezone(timedelta(hours=5, minutes=30))
 
+
+def to_ist_naive(value: datetime) -> datetime:
+    """Request datetimes in the stored form: naive IST, whole seconds."""
+    if value.tzinfo:
+        return value.astimezone(IST).replace(tzinfo=None, microsecond=0)
+    return value.replace(microsecond=0)
+
 _calendar_service = None
 
 def get_calendar_service():
@@ -163,6 +181,119 @@ def generate_meet_link_sync(
         logger.info(f"[MEET EMAIL] Scheduled for appointment {appointment_id} at {send_at} UTC")
 
 
+def save_meet_links_sync(links: List[tuple]):
+    """Saves many (meet_link, appointment_id) pairs over one connection — runs in a thread."""
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("DB_HOST", "localhost"),
+            port=int(os.getenv("DB_PORT", 5432)),
+            database=os.getenv("DB_NAME", "psychedb"),
+            user=os.getenv("DB_USER", "psycheuser"),
+            password=os.getenv("DB_PASSWORD", "password")
+        )
+        cur = conn.cursor()
+        cur.executemany("UPDATE appointments SET meet_link = %s WHERE id = %s", links)
+        conn.commit()
+        cur.close()
+        conn.close()
+        logger.info(f"[MEET LINK] Saved {len(links)} link(s)")
+    except Exception as e:
+        logger.error(f"[MEET LINK] Failed to save {len(links)} link(s): {e}")
+        logger.error(traceback.format_exc())
+
+
+def send_meet_link_batch(recipients: dict):
+    """(email, name) -> meetings starting together; one email per recipient."""
+    for (email, name), meetings in recipients.items():
+        try:
+            if len(meetings) == 1:
+                m = meetings[0]
+                send_meet_link_email(
+                    to_email=email,
+                    recipient_name=name,
+                    doctor_name=m["doctor_name"],
+                    appointment_date=m["appointment_date"],
+                    start_time=m["start_time"],
+                    end_time=m["end_time"],
+                    meet_link=m["meet_link"]
+                )
+            else:
+                send_meet_links_email(to_email=email, recipient_name=name, meetings=meetings)
+        except Exception as e:
+            logger.error(f"[MEET EMAIL] Failed for {email}: {e}")
+
+
+def generate_meet_links_batch_sync(meetings: List[dict]):
+    """
+    generate_meet_link_sync for a bulk booking, in one thread:
+    1. Creates a Google Meet link per appointment
+    2. Saves all links over one DB connection
+    3. Sends Fireflies bot to each meeting
+    4. Sends email reminders — one per recipient for all their meetings that start together
+    """
+    logger.info(f"[MEET LINK] Starting batch of {len(meetings)} appointment(s)")
+
+    # Step 1: Generate meet links
+    service = get_calendar_service()
+    linked = []
+    for m in meetings:
+        meet_link = None
+        try:
+            if service:
+                meet_link = service.create_event(
+                    summary=m["summary"],
+                    start_time=m["start_utc"],
+                    end_time=m["end_utc"],
+                    attendee_email=None
+                )
+        except Exception as e:
+            logger.error(f"[MEET LINK] Failed for appointment {m['appointment_id']}: {e}")
+        if not meet_link:
+            logger.error(f"[MEET LINK] No link generated for appointment {m['appointment_id']}")
+            continue
+        linked.append({**m, "meet_link": meet_link})
+
+    if not linked:
+        return
+
+    # Step 2: Save meet links to DB
+    save_meet_links_sync([(m["meet_link"], m["appointment_id"]) for m in linked])
+
+    # Step 3: Send Fireflies bot to transcribe each meeting
+    for m in linked:
+        try:
+            if not ff_send_bot(meet_link=m["meet_link"], title=m["summary"]):
+                logger.error(f"[FIREFLIES] Bot could not be sent for appointment {m['appointment_id']} (non-fatal)")
+        except Exception as e:
+            logger.error(f"[FIREFLIES] Error sending bot for appointment {m['appointment_id']}: {e}")
+
+    # Step 4: Group reminders by send time, then by recipient
+    batches = defaultdict(lambda: defaultdict(list))
+    for m in linked:
+        send_at = m["start_utc"] - timedelta(minutes=30)
+        if m["patient_email"]:
+            batches[send_at][(m["patient_email"], m["patient_name"])].append(m)
+        if m["doctor_email"]:
+            batches[send_at][(m["doctor_email"], f"Dr. {m['doctor_name']}")].append(m)
+
+    now = datetime.now(timezone.utc)
+    for send_at, recipients in batches.items():
+        recipients = dict(recipients)
+        if send_at <= now:
+            send_meet_link_batch(recipients)
+            continue
+        first_id = min(m["appointment_id"] for group in recipients.values() for m in group)
+        scheduler.add_job(
+            func=send_meet_link_batch,
+            args=[recipients],
+            trigger='date',
+            run_date=send_at,
+            id=f"email_appointment_batch_{first_id}",
+            replace_existing=True
+        )
+        logger.info(f"[MEET EMAIL] Scheduled {len(recipients)} reminder(s) at {send_at} UTC")
+
+
 # -------------------------------------------------------------------
 # DEBUG — Test meet link generation directly
 # -------------------------------------------------------------------
@@ -231,7 +362,7 @@ async def test_meet_link():
 @router.post("/availability", response_model=schemas.AvailabilityOut)
 async def create_availability(
     slot: schemas.AvailabilityCreate,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
     ])),
     db: AsyncSession = Depends(database.get_db)
@@ -288,11 +419,14 @@ async def create_availability(
     )
     db.add(new_slot)
     try:
+        if counters.is_future(start_naive):
+            await counters.bump(db, counters.Deltas().add(counters.ORG, org_id, "active_slots"))
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"create_availability commit failed for doctor_id={target_doctor_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to create availability slot.")
+    free_time_index.slot_saved(target_doctor_id, new_slot.id, start_naive, end_naive, False)
 
     res = await db.execute(
         select(models.Availability)
@@ -305,7 +439,7 @@ async def create_availability(
 @router.post("/availability/batch", response_model=List[schemas.AvailabilityOut])
 async def batch_create_availability(
     batch: schemas.AvailabilityBatchCreate,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
     ])),
     db: AsyncSession = Depends(database.get_db)
@@ -372,11 +506,14 @@ async def batch_create_availability(
         raise HTTPException(status_code=400, detail="No slots generated — check start/end time and duration")
 
     try:
+        future_slots = sum(1 for s in slots if counters.is_future(s.start_time))
+        await counters.bump(db, counters.Deltas().add(counters.ORG, org_id, "active_slots", future_slots))
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"batch_create_availability commit failed for doctor_id={target_doctor_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to create availability slots.")
+    free_time_index.invalidate_doctors([target_doctor_id])
 
     result = await db.execute(
         select(models.Availability)
@@ -392,15 +529,176 @@ async def batch_create_availability(
     return result.scalars().all()
 
 
+# Bulk generation: every slot is computed and inserted by Postgres in one
+# INSERT … SELECT over generate_series — nothing is built row by row in
+# Python. Existing (doctor_id, start_time) slots are skipped, so re-running
+# a generation is safe. Times are naive IST stored as-is (read as UTC).
+_BULK_GENERATE_SLOTS = text(
+    "WITH windows AS ("
+    "  SELECT * FROM unnest(CAST(:window_starts AS time[]), CAST(:window_ends AS time[]), CAST(:window_days AS int[]))"
+    "  AS w(start_at, end_at, days)"
+    "), "
+    "slots AS ("
+    "  SELECT doctor.id AS doctor_id, slot.start_at"
+    "  FROM generate_series(CAST(:first_day AS timestamp), CAST(:last_day AS timestamp), interval '1 day') AS day(value)"
+    "  JOIN windows w ON w.days & (1 << (extract(isodow FROM day.value)::int - 1)) <> 0"
+    "  CROSS JOIN LATERAL generate_series("
+    "    day.value + w.start_at, day.value + w.end_at - make_interval(mins => CAST(:minutes AS int)),"
+    "    make_interval(mins => CAST(:minutes AS int))"
+    "  ) AS slot(start_at)"
+    "  CROSS JOIN unnest(CAST(:doctor_ids AS int[])) AS doctor(id)"
+    "), "
+    "inserted AS ("
+    "  INSERT INTO availabilities (doctor_id, organization_id, start_time, end_time, is_booked, created_by_id)"
+    "  SELECT doctor_id, CAST(:org_id AS int), start_at AT TIME ZONE 'UTC',"
+    "         (start_at + make_interval(mins => CAST(:minutes AS int))) AT TIME ZONE 'UTC', false, CAST(:created_by AS int)"
+    "  FROM slots"
+    "  ON CONFLICT (doctor_id, start_time) DO NOTHING"
+    "  RETURNING id, start_time"
+    ") "
+    "SELECT count(*) AS created, min(id) AS first_id, max(id) AS last_id, "
+    "       count(*) FILTER (WHERE start_time >= :now) AS future "
+    "FROM inserted;"
+)
+
+BULK_MAX_DOCTORS = int(os.getenv("BULK_AVAILABILITY_MAX_DOCTORS", 200))
+BULK_MAX_DAYS = int(os.getenv("BULK_AVAILABILITY_MAX_DAYS", 366))
+BULK_MAX_SLOTS = int(os.getenv("BULK_AVAILABILITY_MAX_SLOTS", 250_000))
+
+
+def _hhmm(value: str):
+    return datetime.strptime(value, "%H:%M").time()
+
+
+def _day_mask(days: Optional[List[str]]) -> int:
+    """Bit 0 = Monday … bit 6 = Sunday; no days means every day."""
+    if not days:
+        return 0b1111111
+    return sum(1 << schemas.WEEKDAYS.index(d) for d in set(days))
+
+
+async def _check_doctors_manageable(db: AsyncSession, current_user: Principal, doctor_ids: List[int], org_id: int):
+    if current_user.role == models.UserRole.DOCTOR:
+        if doctor_ids != [current_user.id]:
+            raise HTTPException(status_code=403, detail="Doctors can only manage their own availability")
+        return
+
+    if current_user.role == models.UserRole.RECEPTIONIST:
+        rec_res = await db.execute(
+            select(models.Receptionist)
+            .options(selectinload(models.Receptionist.doctors))
+            .where(models.Receptionist.user_id == current_user.id)
+        )
+        receptionist_profile = rec_res.scalars().first()
+        if not receptionist_profile:
+            raise HTTPException(status_code=403, detail="Receptionist profile not found")
+        allowed = {d.user_id for d in receptionist_profile.doctors}
+        missing = sorted(set(doctor_ids) - allowed)
+        if missing:
+            raise HTTPException(status_code=403, detail=f"You are not assigned to doctor(s): {missing}")
+        return
+
+    doc_res = await db.execute(
+        select(models.Doctor.user_id)
+        .join(models.User, models.User.id == models.Doctor.user_id)
+        .where(
+            models.Doctor.user_id.in_(doctor_ids),
+            models.User.organization_id == org_id
+        )
+    )
+    missing = sorted(set(doctor_ids) - set(doc_res.scalars().all()))
+    if missing:
+        raise HTTPException(status_code=403, detail=f"Doctor(s) not found in your organization: {missing}")
+
+
+@router.post("/availability/bulk", response_model=schemas.AvailabilityBulkResult)
+async def bulk_create_availability(
+    bulk: schemas.AvailabilityBulkCreate,
+    current_user: Principal = Depends(dependencies.require_role([
+        models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
+    ])),
+    db: AsyncSession = Depends(database.get_db)
+):
+    doctor_ids = sorted(set(bulk.doctor_ids))
+    org_id = bulk.organization_id or current_user.organization_id
+    if current_user.role == models.UserRole.HOSPITAL:
+        org_id = current_user.organization_id
+
+    if not doctor_ids or not bulk.windows:
+        raise HTTPException(status_code=400, detail="doctor_ids and windows must not be empty")
+    if len(doctor_ids) > BULK_MAX_DOCTORS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_DOCTORS} doctors per request")
+    if bulk.duration_minutes <= 0:
+        raise HTTPException(status_code=400, detail="duration_minutes must be positive")
+    if bulk.end_date < bulk.start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    days = (bulk.end_date - bulk.start_date).days + 1
+    if days > BULK_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {BULK_MAX_DAYS} days")
+
+    # Size the request up front — cheap arithmetic, no slots materialized
+    windows = [(_hhmm(w.start_time), _hhmm(w.end_time), _day_mask(w.days)) for w in bulk.windows]
+    weekday_counts = [0] * 7
+    for offset in range(days):
+        weekday_counts[(bulk.start_date + timedelta(days=offset)).weekday()] += 1
+    requested = 0
+    for start_at, end_at, mask in windows:
+        span = (end_at.hour * 60 + end_at.minute) - (start_at.hour * 60 + start_at.minute)
+        matching_days = sum(n for wd, n in enumerate(weekday_counts) if mask & (1 << wd))
+        requested += (span // bulk.duration_minutes) * matching_days
+    requested *= len(doctor_ids)
+    if requested == 0:
+        raise HTTPException(status_code=400, detail="No slots generated — check windows, days and duration")
+    if requested > BULK_MAX_SLOTS:
+        raise HTTPException(status_code=400, detail=f"Request describes {requested} slots; the limit is {BULK_MAX_SLOTS}")
+
+    await _check_doctors_manageable(db, current_user, doctor_ids, org_id)
+
+    try:
+        row = (await db.execute(_BULK_GENERATE_SLOTS, {
+            "window_starts": [w[0] for w in windows],
+            "window_ends":   [w[1] for w in windows],
+            "window_days":   [w[2] for w in windows],
+            "first_day":     datetime.combine(bulk.start_date, datetime.min.time()),
+            "last_day":      datetime.combine(bulk.end_date, datetime.min.time()),
+            "minutes":       bulk.duration_minutes,
+            "doctor_ids":    doctor_ids,
+            "org_id":        org_id,
+            "created_by":    current_user.id,
+            "now":           counters.now_ist_naive(),
+        })).one()
+        await counters.bump(db, counters.Deltas().add(counters.ORG, org_id, "active_slots", row.future))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"bulk_create_availability failed for doctor_ids={doctor_ids}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create availability slots.")
+    free_time_index.invalidate_doctors(doctor_ids)
+
+    return schemas.AvailabilityBulkResult(
+        requested=requested,
+        created=row.created,
+        skipped=requested - row.created,
+        first_id=row.first_id,
+        last_id=row.last_id,
+    )
+
+
 @router.get("/availability", response_model=List[schemas.AvailabilityOut])
 async def get_availability(
+    response: Response,
     doctor_id: Optional[int] = None,
     organization_id: Optional[int] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     only_available: bool = True,
-    db: AsyncSession = Depends(database.get_db)
+    virtual: bool = False,
+    page: PageParams = Depends(page_params),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
+    if virtual:
+        return await _virtual_availability(response, doctor_id, organization_id, start_date, end_date, page, db)
+
     query = select(models.Availability).options(selectinload(models.Availability.doctor))
     if doctor_id:
         query = query.where(models.Availability.doctor_id == doctor_id)
@@ -411,105 +709,609 @@ async def get_availability(
     if end_date:
         query = query.where(models.Availability.start_time <= end_date.replace(tzinfo=None))
     if only_available:
+        # Open slots in the past can't be booked — keep the scan on the future
+        # end of the partial idx_avail_open_* indexes
+        now = counters.now_ist_naive()
+        if not start_date or start_date.replace(tzinfo=None) < now:
+            query = query.where(models.Availability.start_time >= now)
         query = query.where(models.Availability.is_booked == False)
+    query = paginate(query, page, models.Availability.start_time, models.Availability.id)
 
     result = await db.execute(query)
-    return result.scalars().all()
+    return finish_page(result.scalars().all(), page, response, "start_time")
+
+
+async def _virtual_availability(response, doctor_id, organization_id, start_date, end_date, page: PageParams, db):
+    """
+    Open slots from working hours (see virtual_slots.py) merged with
+    materialized open slots, ordered by (start_time, doctor_id). Virtual
+    slots have no id. The window defaults to the next 7 days and is capped
+    at VIRTUAL_SLOT_MAX_DAYS; the cursor is keyed on (start_time, doctor_id).
+    """
+    if not organization_id:
+        if not doctor_id:
+            raise HTTPException(status_code=400, detail="virtual=true needs organization_id or doctor_id")
+        org_res = await db.execute(
+            select(models.User.organization_id).where(
+                models.User.id == doctor_id, models.User.role == models.UserRole.DOCTOR
+            )
+        )
+        organization_id = org_res.scalar()
+        if organization_id is None:
+            raise HTTPException(status_code=404, detail="Doctor not found")
+
+    now = counters.now_ist_naive()
+    start = max(to_ist_naive(start_date), now) if start_date else now
+    end = to_ist_naive(end_date) if end_date else start + timedelta(days=7)
+    end = min(end, start + timedelta(days=VIRTUAL_SLOT_MAX_DAYS))
+    after = page.cursor
+    if after is not None:
+        start = max(start, after[0])
+
+    query = (
+        select(models.Availability)
+        .options(selectinload(models.Availability.doctor))
+        .where(
+            models.Availability.organization_id == organization_id,
+            models.Availability.is_booked == False,
+            models.Availability.start_time >= start,
+            models.Availability.start_time < end
+        )
+        .order_by(models.Availability.start_time, models.Availability.doctor_id)
+        .limit(page.limit + 1)
+    )
+    if doctor_id:
+        query = query.where(models.Availability.doctor_id == doctor_id)
+    if after is not None:
+        query = query.where(tuple_(models.Availability.start_time, models.Availability.doctor_id) > tuple_(*after))
+    materialized = (await db.execute(query)).scalars().all()
+
+    engine = await load_engine(db, organization_id, start, end, [doctor_id] if doctor_id else None)
+    rows = [schemas.AvailabilityOut.model_validate(slot) for slot in materialized]
+    rows += [schemas.AvailabilityOut(**slot) for slot in islice(engine.slots(start, end, after), page.limit + 1)]
+    rows.sort(key=lambda r: (r.start_time.replace(tzinfo=None), r.doctor_id))
+    for row in rows:
+        row.start_time = row.start_time.replace(tzinfo=None)
+        row.end_time = row.end_time.replace(tzinfo=None)
+    return finish_page(rows[:page.limit + 1], page, response, "start_time", "doctor_id")
 
 
 # -------------------------------------------------------------------
-# 2. Booking
+# 1a. Free-time search — answered from the in-memory free-time index
+# (see free_time.py) instead of a range scan per request
 # -------------------------------------------------------------------
 
-@router.post("/book", response_model=schemas.AppointmentOut)
-async def book_appointment(
-    booking: schemas.AppointmentCreate,
-    background_tasks: BackgroundTasks,
-    current_user: models.User = Depends(dependencies.get_current_user),
+@router.get("/free-time", response_model=List[schemas.FreeWindowOut])
+async def get_free_time(
+    doctor_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    length: int = Query(30, ge=1, le=24 * 60, description="Minutes of continuous free time"),
+    limit: int = Query(10, ge=1, le=200),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    # Primary, not the replica: index misses are cached for every caller (see app/free_time.py)
     db: AsyncSession = Depends(database.get_db)
 ):
-    slot_res = await db.execute(
-        select(models.Availability)
-        .options(selectinload(models.Availability.doctor))
-        .where(models.Availability.id == booking.availability_id)
+    """First `limit` windows of `length` free minutes for a doctor, each starting at an open slot."""
+    doc_res = await db.execute(
+        select(models.User.organization_id).where(
+            models.User.id == doctor_id, models.User.role == models.UserRole.DOCTOR
+        )
     )
-    slot = slot_res.scalars().first()
+    doctor_org = doc_res.first()
+    if doctor_org is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if current_user.role != models.UserRole.SUPER_ADMIN and doctor_org.organization_id != current_user.organization_id:
+        raise HTTPException(status_code=403, detail="Not authorized to view this doctor's schedule")
+
+    now = counters.now_ist_naive()
+    start = max(to_ist_naive(start_date), now) if start_date else now
+    end = to_ist_naive(end_date) if end_date else start + timedelta(days=7)
+    end = min(end, start + timedelta(days=FREE_TIME_SEARCH_MAX_DAYS))
+    if end <= start:
+        return []
+    return await free_time_index.first_free(db, doctor_id, start, end, length, limit)
+
+
+@router.get("/free-at", response_model=List[schemas.FreeWindowOut])
+async def get_doctors_free_at(
+    at: datetime,
+    organization_id: Optional[int] = None,
+    length: int = Query(30, ge=1, le=24 * 60, description="Minutes of continuous free time from `at`"),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    # Primary, not the replica: index misses are cached for every caller (see app/free_time.py)
+    db: AsyncSession = Depends(database.get_db)
+):
+    """Every doctor of the organization (default: the caller's) free for `length` minutes from `at`."""
+    if current_user.role != models.UserRole.SUPER_ADMIN:
+        if organization_id is not None and organization_id != current_user.organization_id:
+            raise HTTPException(status_code=403, detail="Not authorized to view this organization's schedule")
+        organization_id = None
+    org_id = organization_id or current_user.organization_id
+    if org_id is None:
+        raise HTTPException(status_code=400, detail="organization_id is required")
+    doc_res = await db.execute(
+        select(models.User.id).where(
+            models.User.organization_id == org_id,
+            models.User.role == models.UserRole.DOCTOR,
+            models.User.is_active == True
+        ).order_by(models.User.id)
+    )
+    doctor_ids = doc_res.scalars().all()
+    if not doctor_ids:
+        return []
+    return await free_time_index.free_at(db, doctor_ids, to_ist_naive(at), length)
 
-    if not slot:
-        raise HTTPException(status_code=404, detail="Availability slot not found")
-    if slot.is_booked:
-        raise HTTPException(status_code=400, detail="Slot is already booked")
-    if not slot.doctor_id:
-        raise HTTPException(status_code=400, detail="Slot has no doctor assigned")
 
+# -------------------------------------------------------------------
+# 1b. Virtual slot settings — slot length and blocked time
+# -------------------------------------------------------------------
+
+@router.put("/doctors/{doctor_id}/slot-duration", response_model=schemas.SlotDurationUpdate)
+async def set_slot_duration(
+    doctor_id: int,
+    settings: schemas.SlotDurationUpdate,
+    current_user: Principal = Depends(dependencies.require_role([
+        models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
+    ])),
+    db: AsyncSession = Depends(database.get_db)
+):
+    if settings.slot_duration_minutes is not None and not 5 <= settings.slot_duration_minutes <= 480:
+        raise HTTPException(status_code=400, detail="slot_duration_minutes must be between 5 and 480")
+    await _check_doctors_manageable(db, current_user, [doctor_id], current_user.organization_id)
+
+    doc_res = await db.execute(select(models.Doctor).where(models.Doctor.user_id == doctor_id))
+    doctor = doc_res.scalars().first()
+    if not doctor:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    doctor.slot_duration_minutes = settings.slot_duration_minutes
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"set_slot_duration commit failed for doctor_id={doctor_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to update slot duration.")
+    return settings
+
+
+@router.post("/time-blocks", response_model=schemas.TimeBlockOut)
+async def create_time_block(
+    block: schemas.TimeBlockCreate,
+    current_user: Principal = Depends(dependencies.require_role([
+        models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
+    ])),
+    db: AsyncSession = Depends(database.get_db)
+):
+    start, end = to_ist_naive(block.start_time), to_ist_naive(block.end_time)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    await _check_doctors_manageable(db, current_user, [block.doctor_id], current_user.organization_id)
+
+    new_block = models.DoctorTimeBlock(
+        doctor_id=block.doctor_id,
+        organization_id=current_user.organization_id,
+        start_time=start,
+        end_time=end,
+        reason=block.reason,
+        created_by_id=current_user.id
+    )
+    db.add(new_block)
+    try:
+        await db.commit()
+        await db.refresh(new_block)
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"create_time_block commit failed for doctor_id={block.doctor_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create time block.")
+    return new_block
+
+
+@router.get("/time-blocks", response_model=List[schemas.TimeBlockOut])
+async def get_time_blocks(
+    doctor_id: Optional[int] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    query = apply_scope(select(models.DoctorTimeBlock), current_user, models.DoctorTimeBlock)
+    if doctor_id:
+        query = query.where(models.DoctorTimeBlock.doctor_id == doctor_id)
+    if start_date:
+        query = query.where(models.DoctorTimeBlock.end_time > to_ist_naive(start_date))
+    if end_date:
+        query = query.where(models.DoctorTimeBlock.start_time < to_ist_naive(end_date))
+    result = await db.execute(query.order_by(models.DoctorTimeBlock.start_time, models.DoctorTimeBlock.id))
+    return result.scalars().all()
+
+
+@router.delete("/time-blocks/{block_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_time_block(
+    block_id: int,
+    current_user: Principal = Depends(dependencies.require_role([
+        models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL
+    ])),
+    db: AsyncSession = Depends(database.get_db)
+):
+    block = await fetch_scoped(db, current_user, models.DoctorTimeBlock, block_id, not_found="Time block not found")
+    await db.delete(block)
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"delete_time_block commit failed for block {block_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to delete time block.")
+
+
+# -------------------------------------------------------------------
+# 2. Booking
+# -------------------------------------------------------------------
+
+async def _load_patient(db: AsyncSession, patient_id: int) -> models.Patient:
     patient_res = await db.execute(
-        select(models.Patient).where(models.Patient.id == booking.patient_id)
+        select(models.Patient).where(models.Patient.id == patient_id)
     )
     patient = patient_res.scalars().first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    return patient
 
-    doctor_user = slot.doctor
-
-    new_app = models.Appointment(
-        patient_id=booking.patient_id,
-        doctor_id=slot.doctor_id,
-        organization_id=slot.organization_id,
-        availability_id=slot.id,
-        appointment_date=slot.start_time,
-        start_time=slot.start_time,
-        end_time=slot.end_time,
-        notes=booking.notes,
-        meet_link=None,
-        status="SCHEDULED",
-        patient_name=patient.full_name,
-        patient_age=patient.age,
-        doctor_name=slot.doctor.full_name if slot.doctor else None,
-        booked_by_role=current_user.role.value,
-        created_by_id=current_user.id
-    )
 
-    patient.doctor_id = slot.doctor_id
-    slot.is_booked = True
-    db.add(new_app)
+async def _complete_booking(db: AsyncSession, current_user, patient: models.Patient, claimed, idem: Idempotency):
+    """
+    Counters, rollup marker and patient reassignment for an appointment
+    booking.book_slot just inserted, then commit, the meet-link thread
+    and the loaded appointment.
+    """
+    deltas = counters.Deltas()
+    deltas.add(counters.ORG, claimed.organization_id, "appointments")
+    deltas.add(counters.ORG, claimed.organization_id, counters.day_metric(claimed.start_time.date()))
+    deltas.add(counters.USER, claimed.doctor_id, "appointments")
+    if counters.is_future(claimed.start_time):
+        deltas.add(counters.ORG, claimed.organization_id, "active_slots", -1)
+    counters.reassign_patient(deltas, patient.doctor_id, claimed.doctor_id)
+
+    patient.doctor_id = claimed.doctor_id
     try:
+        await rollups.mark_dirty(db, {(claimed.organization_id, claimed.start_time.date())})
+        await counters.bump(db, deltas)
+        res = await db.execute(
+            select(models.Appointment)
+            .options(
+                selectinload(models.Appointment.doctor),
+                selectinload(models.Appointment.patient)
+            )
+            .where(models.Appointment.id == claimed.id)
+        )
+        new_app = res.scalars().first()
+        await idem.save(db, new_app)
         await db.commit()
     except Exception as e:
         await db.rollback()
-        logger.error(f"book_appointment commit failed for slot {booking.availability_id}: {e}")
+        logger.error(f"book_appointment commit failed for slot {claimed.availability_id}: {e}")
         raise HTTPException(status_code=500, detail="Booking failed. Please try again.")
+    free_time_index.slot_saved(claimed.doctor_id, claimed.availability_id, claimed.start_time, claimed.end_time, True)
 
+    doctor_user = new_app.doctor
+    doctor_name = doctor_user.full_name if doctor_user else "Unknown"
     doctor_email = doctor_user.email if (doctor_user and doctor_user.role == models.UserRole.DOCTOR) else None
+    start_time = new_app.start_time.replace(tzinfo=None)
+    end_time = new_app.end_time.replace(tzinfo=None)
 
     thread = threading.Thread(
         target=generate_meet_link_sync,
         kwargs=dict(
             appointment_id=new_app.id,
-            summary=f"Appointment: {patient.full_name} with Dr. {slot.doctor.full_name if slot.doctor else 'Unknown'}",
-            start_time_utc=slot.start_time.replace(tzinfo=IST).astimezone(timezone.utc),
-            end_time_utc=slot.end_time.replace(tzinfo=IST).astimezone(timezone.utc),
+            summary=f"Appointment: {patient.full_name} with Dr. {doctor_name}",
+            start_time_utc=start_time.replace(tzinfo=IST).astimezone(timezone.utc),
+            end_time_utc=end_time.replace(tzinfo=IST).astimezone(timezone.utc),
             patient_email=patient.email,
             doctor_email=doctor_email,
             patient_name=patient.full_name,
-            doctor_name=slot.doctor.full_name if slot.doctor else "Unknown",
-            appointment_date=slot.start_time.strftime("%Y-%m-%d"),
-            start_time_str=slot.start_time.strftime("%H:%M"),
-            end_time_str=slot.end_time.strftime("%H:%M"),
-            appointment_start_utc=slot.start_time.replace(tzinfo=IST).astimezone(timezone.utc),
+            doctor_name=doctor_name,
+            appointment_date=start_time.strftime("%Y-%m-%d"),
+            start_time_str=start_time.strftime("%H:%M"),
+            end_time_str=end_time.strftime("%H:%M"),
+            appointment_start_utc=start_time.replace(tzinfo=IST).astimezone(timezone.utc),
         ),
         daemon=True
     )
     thread.start()
+    return new_app
 
-    res = await db.execute(
-        select(models.Appointment)
-        .options(
-            selectinload(models.Appointment.doctor),
-            selectinload(models.Appointment.patient)
+
+async def _book_by_id(db: AsyncSession, current_user, booking: schemas.AppointmentCreate, idem: Idempotency):
+    patient = await _load_patient(db, booking.patient_id)
+
+    # Claim + insert in one statement (see booking.py) — a lost race is a fast 409, not a failed commit
+    claimed = await book_slot(db, slot_by_id(booking.availability_id), patient, booking.notes, current_user)
+    if claimed is None:
+        slot_res = await db.execute(
+            select(models.Availability.id).where(models.Availability.id == booking.availability_id)
         )
-        .where(models.Appointment.id == new_app.id)
+        if slot_res.scalar() is None:
+            raise HTTPException(status_code=404, detail="Availability slot not found")
+        raise HTTPException(status_code=409, detail="Slot is already booked")
+
+    return await _complete_booking(db, current_user, patient, claimed, idem)
+
+
+@router.post("/book", response_model=schemas.AppointmentOut)
+async def book_appointment(
+    booking: schemas.AppointmentCreate,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
+):
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(lambda: _book_by_id(db, current_user, booking, idem), schemas.AppointmentOut)
+
+
+@router.post("/book/any", response_model=schemas.AppointmentOut)
+async def book_any_slot(
+    booking: schemas.AnySlotBookingCreate,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
+):
+    """Books the doctor's earliest open slot in the window. Slots other bookers are claiming are skipped, not waited on."""
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(lambda: _book_any(db, current_user, booking, idem), schemas.AppointmentOut)
+
+
+async def _book_any(db: AsyncSession, current_user, booking: schemas.AnySlotBookingCreate, idem: Idempotency):
+    window_start = max(to_ist_naive(booking.window_start), counters.now_ist_naive())
+    window_end = to_ist_naive(booking.window_end)
+    if window_end <= window_start:
+        raise HTTPException(status_code=400, detail="window_end must be after window_start (and in the future)")
+
+    patient = await _load_patient(db, booking.patient_id)
+    claimed = await book_slot(
+        db, first_open_slot(booking.doctor_id, window_start, window_end), patient, booking.notes, current_user
     )
-    return res.scalars().first()
+    if claimed is None:
+        raise HTTPException(status_code=409, detail="No open slot for this doctor in that window")
+
+    return await _complete_booking(db, current_user, patient, claimed, idem)
+
+
+@router.post("/book/virtual", response_model=schemas.AppointmentOut)
+async def book_virtual_slot(
+    booking: schemas.VirtualBookingCreate,
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
+):
+    """Books a virtual slot: materializes its Availability row, then books it like /book, in one transaction."""
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(lambda: _book_virtual(db, current_user, booking, idem), schemas.AppointmentOut)
+
+
+async def _book_virtual(db: AsyncSession, current_user, booking: schemas.VirtualBookingCreate, idem: Idempotency):
+    start = to_ist_naive(booking.start_time)
+    org_res = await db.execute(
+        select(models.User.organization_id).where(
+            models.User.id == booking.doctor_id, models.User.role == models.UserRole.DOCTOR
+        )
+    )
+    org_id = org_res.scalar()
+    if org_id is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+
+    # Held until commit, so the free check below still holds when the slot is inserted
+    await lock_doctor_bookings(db, booking.doctor_id)
+    slot = await is_virtual_slot(db, org_id, booking.doctor_id, start)
+    if not slot:
+        raise HTTPException(status_code=400, detail="No open slot for this doctor at that time")
+
+    # A concurrent booking of the same time collides on uq_doctor_start_time
+    result = await db.execute(
+        pg_insert(models.Availability)
+        .values(
+            doctor_id=booking.doctor_id,
+            organization_id=org_id,
+            start_time=slot["start_time"],
+            end_time=slot["end_time"],
+            is_booked=False,
+            created_by_id=current_user.id
+        )
+        .on_conflict_do_nothing(index_elements=["doctor_id", "start_time"])
+        .returning(models.Availability.id)
+    )
+    slot_id = result.scalar()
+    if slot_id is None:
+        raise HTTPException(status_code=409, detail="Slot is already booked")
+    # The new row is an open future slot until book_appointment takes it
+    await counters.bump(db, counters.Deltas().add(counters.ORG, org_id, "active_slots"))
+
+    return await _book_by_id(db, current_user, schemas.AppointmentCreate(
+        availability_id=slot_id,
+        patient_id=booking.patient_id,
+        doctor_id=booking.doctor_id,
+        start_time=slot["start_time"],
+        end_time=slot["end_time"],
+        notes=booking.notes
+    ), idem)
+
+
+BULK_BOOKING_MAX_ITEMS = int(os.getenv("BULK_BOOKING_MAX_ITEMS", 200))
+
+
+@router.post("/book/bulk", response_model=schemas.BulkBookingResult)
+async def book_bulk(
+    booking: schemas.BulkBookingCreate,
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
+):
+    """
+    Books many (patient, slot) pairs — a group session, or a recurring series from
+    `recurrence` — in one transaction. all_or_nothing books every pair or none and
+    answers 409 listing what failed; best_effort books what it can and reports the rest.
+    """
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(lambda: _book_bulk(db, current_user, booking, idem), schemas.BulkBookingResult)
+
+
+def _bulk_failure(patient_id: int, reason: str, availability_id: Optional[int] = None,
+                  start_time: Optional[datetime] = None) -> schemas.BulkBookingFailure:
+    return schemas.BulkBookingFailure(
+        patient_id=patient_id, availability_id=availability_id, start_time=start_time, reason=reason
+    )
+
+
+def _bulk_conflict(failed: List[schemas.BulkBookingFailure]) -> HTTPException:
+    return HTTPException(status_code=409, detail={
+        "message": "Nothing was booked: some appointments could not be booked",
+        "failed": [f.model_dump(mode="json") for f in failed]
+    })
+
+
+async def _book_bulk(db: AsyncSession, current_user, booking: schemas.BulkBookingCreate, idem: Idempotency):
+    A = models.Availability
+    slot_columns = (A.id, A.doctor_id, A.organization_id, A.start_time, A.is_booked)
+    failed = []
+
+    # One query for every requested slot
+    if booking.recurrence:
+        rec = booking.recurrence
+        first = to_ist_naive(rec.first_start)
+        starts = [first + timedelta(days=rec.every_days * n) for n in range(rec.count)]
+        slot_res = await db.execute(
+            select(*slot_columns).where(A.doctor_id == rec.doctor_id, A.start_time.in_(starts))
+        )
+        by_start = {row.start_time.replace(tzinfo=None): row for row in slot_res.all()}
+        items, slots = [], {}
+        for start in starts:
+            slot = by_start.get(start)
+            if slot is None:
+                failed.append(_bulk_failure(rec.patient_id, "No slot for this doctor at that time", start_time=start))
+                continue
+            items.append(schemas.BulkBookingItem(patient_id=rec.patient_id, availability_id=slot.id, notes=rec.notes))
+            slots[slot.id] = slot
+    else:
+        items = booking.items
+        if len(items) > BULK_BOOKING_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_BOOKING_MAX_ITEMS} bookings per request")
+        slot_res = await db.execute(
+            select(*slot_columns).where(A.id.in_({item.availability_id for item in items}))
+        )
+        slots = {row.id: row for row in slot_res.all()}
+
+    patient_res = await db.execute(
+        select(models.Patient).where(models.Patient.id.in_({item.patient_id for item in items}))
+    )
+    patients = {p.id: p for p in patient_res.scalars().all()}
+
+    wanted, seen = [], set()
+    for item in items:
+        slot = slots.get(item.availability_id)
+        start = slot.start_time.replace(tzinfo=None) if slot else None
+        if slot is None:
+            reason = "Availability slot not found"
+        elif item.availability_id in seen:
+            reason = "Slot appears more than once in the request"
+        elif slot.is_booked:
+            reason = "Slot is already booked"
+        elif item.patient_id not in patients:
+            reason = "Patient not found"
+        else:
+            seen.add(item.availability_id)
+            wanted.append(item)
+            continue
+        failed.append(_bulk_failure(item.patient_id, reason, item.availability_id, start))
+
+    if failed and booking.mode == "all_or_nothing":
+        raise _bulk_conflict(failed)
+
+    # Claim + insert every pair in one statement (see booking.py)
+    claimed = await book_slots(db, [
+        (item.availability_id, item.patient_id, patients[item.patient_id].full_name,
+         patients[item.patient_id].age, item.notes)
+        for item in wanted
+    ], current_user)
+    booked_ids = {row.availability_id for row in claimed}
+    lost = [
+        _bulk_failure(item.patient_id, "Slot was booked by someone else", item.availability_id,
+                      slots[item.availability_id].start_time.replace(tzinfo=None))
+        for item in wanted if item.availability_id not in booked_ids
+    ]
+    if lost and booking.mode == "all_or_nothing":
+        await db.rollback()
+        raise _bulk_conflict(lost)
+    failed += lost
+    if not claimed:
+        return schemas.BulkBookingResult(booked=[], failed=failed)
+
+    deltas = counters.Deltas()
+    dirty = set()
+    latest = {}
+    for row in sorted(claimed, key=lambda r: r.start_time):
+        deltas.add(counters.ORG, row.organization_id, "appointments")
+        deltas.add(counters.ORG, row.organization_id, counters.day_metric(row.start_time.date()))
+        deltas.add(counters.USER, row.doctor_id, "appointments")
+        if counters.is_future(row.start_time):
+            deltas.add(counters.ORG, row.organization_id, "active_slots", -1)
+        dirty.add((row.organization_id, row.start_time.date()))
+        latest[row.patient_id] = row.doctor_id
+    # Each patient moves to the doctor of their last new appointment, once
+    for patient_id, doctor_id in latest.items():
+        patient = patients[patient_id]
+        counters.reassign_patient(deltas, patient.doctor_id, doctor_id)
+        patient.doctor_id = doctor_id
+
+    try:
+        await rollups.mark_dirty(db, dirty)
+        await counters.bump(db, deltas)
+        res = await db.execute(
+            select(models.Appointment)
+            .options(
+                selectinload(models.Appointment.doctor),
+                selectinload(models.Appointment.patient)
+            )
+            .where(models.Appointment.id.in_([row.id for row in claimed]))
+            .order_by(models.Appointment.start_time, models.Appointment.id)
+        )
+        appointments = res.scalars().all()
+        result = schemas.BulkBookingResult(
+            booked=[schemas.AppointmentOut.model_validate(a) for a in appointments],
+            failed=failed
+        )
+        await idem.save(db, result)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"book_bulk commit failed for {len(claimed)} slot(s): {e}")
+        raise HTTPException(status_code=500, detail="Booking failed. Please try again.")
+    for row in claimed:
+        free_time_index.slot_saved(row.doctor_id, row.availability_id, row.start_time, row.end_time, True)
+
+    # Side effects for the whole batch go to one thread
+    meetings = []
+    for appointment in appointments:
+        doctor_user = appointment.doctor
+        doctor_name = doctor_user.full_name if doctor_user else "Unknown"
+        patient = patients[appointment.patient_id]
+        start_time = appointment.start_time.replace(tzinfo=None)
+        end_time = appointment.end_time.replace(tzinfo=None)
+        meetings.append({
+            "appointment_id": appointment.id,
+            "summary": f"Appointment: {patient.full_name} with Dr. {doctor_name}",
+            "start_utc": start_time.replace(tzinfo=IST).astimezone(timezone.utc),
+            "end_utc": end_time.replace(tzinfo=IST).astimezone(timezone.utc),
+            "patient_email": patient.email,
+            "doctor_email": doctor_user.email if (doctor_user and doctor_user.role == models.UserRole.DOCTOR) else None,
+            "patient_name": patient.full_name,
+            "doctor_name": doctor_name,
+            "appointment_date": start_time.strftime("%Y-%m-%d"),
+            "start_time": start_time.strftime("%H:%M"),
+            "end_time": end_time.strftime("%H:%M"),
+        })
+    threading.Thread(target=generate_meet_links_batch_sync, args=(meetings,), daemon=True).start()
+    return result
 
 
 # -------------------------------------------------------------------
@@ -519,18 +1321,16 @@ async def book_appointment(
 @router.delete("/availability/{slot_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_availability_slot(
     slot_id: int,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    slot_res = await db.execute(
-        select(models.Availability).where(models.Availability.id == slot_id)
+    slot = await fetch_scoped(
+        db, current_user, models.Availability, slot_id, not_found="Slot not found"
     )
-    slot = slot_res.scalars().first()
 
-    if not slot:
-        raise HTTPException(status_code=404, detail="Slot not found")
-    if slot.organization_id != current_user.organization_id:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    deltas = counters.Deltas()
+    if not slot.is_booked and counters.is_future(slot.start_time):
+        deltas.add(counters.ORG, slot.organization_id, "active_slots", -1)
 
     if slot.is_booked:
         app_res = await db.execute(
@@ -544,39 +1344,46 @@ async def delete_availability_slot(
         if appointment:
             appointment.status = "CANCELLED"
             appointment.notes = (appointment.notes or "") + " [CANCELLED: Doctor Unavailable]"
+            deltas.add(counters.ORG, appointment.organization_id, counters.day_metric(appointment.start_time.date()), -1)
             print(f"NOTIFICATION: Appointment {appointment.id} cancelled.")
 
     await db.delete(slot)
     try:
+        await counters.bump(db, deltas)
         await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"delete_availability_slot commit failed for slot {slot_id}: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete availability slot.")
+    free_time_index.slot_removed(slot.doctor_id, slot.start_time)
 
 
 @router.get("", response_model=List[schemas.AppointmentOut])
 async def get_appointments(
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    request: Request,
+    response: Response,
+    format: Optional[str] = None,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
+    # Streamed export (?format=ndjson|csv or Accept: application/x-ndjson) — every row, no paging.
+    # AppointmentOut only needs the denormalized names, so doctor/patient are not loaded.
+    fmt = stream_format(request, format)
+    if fmt:
+        query = apply_scope(select(models.Appointment), current_user, models.Appointment)
+        query = query.order_by(models.Appointment.start_time, models.Appointment.id)
+        return stream_response(database.read_session_factory(request), query, schemas.AppointmentOut, fmt, "appointments")
+
     query = select(models.Appointment).options(
         selectinload(models.Appointment.doctor),
         selectinload(models.Appointment.patient)
     )
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.where(models.Appointment.organization_id == current_user.organization_id)
-    elif current_user.role == models.UserRole.DOCTOR:
-        query = query.where(models.Appointment.doctor_id == current_user.id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.where(models.Appointment.organization_id == current_user.organization_id)
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    query = apply_scope(query, current_user, models.Appointment)
+    query = paginate(query, page, models.Appointment.start_time, models.Appointment.id)
 
     result = await db.execute(query)
-    return result.scalars().all()
+    return finish_page(result.scalars().all(), page, response, "start_time")
 
 
 @router.post("/{appointment_id}/reschedule", response_model=schemas.AppointmentOut)
@@ -584,9 +1391,19 @@ async def reschedule_appointment(
     appointment_id: int,
     new_booking: schemas.AppointmentReschedule,
     background_tasks: BackgroundTasks,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST])),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST])),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
 ):
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(
+        lambda: _reschedule(appointment_id, new_booking, background_tasks, current_user, db, idem),
+        schemas.AppointmentOut
+    )
+
+
+async def _reschedule(appointment_id: int, new_booking: schemas.AppointmentReschedule,
+                      background_tasks: BackgroundTasks, current_user, db: AsyncSession, idem: Idempotency):
     app_res = await db.execute(
         select(models.Appointment)
         .options(selectinload(models.Appointment.doctor), selectinload(models.Appointment.patient))
@@ -598,8 +1415,11 @@ async def reschedule_appointment(
     if appointment.organization_id != current_user.organization_id:
         raise HTTPException(status_code=403, detail="Not authorized to modify this appointment")
 
+    # Row lock — a concurrent booking of the new slot waits, then sees is_booked
     slot_res = await db.execute(
-        select(models.Availability).where(models.Availability.id == new_booking.new_availability_id)
+        select(models.Availability)
+        .where(models.Availability.id == new_booking.new_availability_id)
+        .with_for_update()
     )
     new_slot = slot_res.scalars().first()
     if not new_slot or new_slot.is_booked:
@@ -609,6 +1429,16 @@ async def reschedule_appointment(
         select(models.Availability).where(models.Availability.id == appointment.availability_id)
     )
     old_slot = old_slot_res.scalars().first()
+
+    deltas = counters.Deltas()
+    if appointment.status != models.AppointmentStatus.CANCELLED:
+        deltas.add(counters.ORG, appointment.organization_id, counters.day_metric(appointment.start_time.date()), -1)
+    deltas.add(counters.ORG, appointment.organization_id, counters.day_metric(new_slot.start_time.date()))
+    if old_slot and counters.is_future(old_slot.start_time):
+        deltas.add(counters.ORG, old_slot.organization_id, "active_slots")
+    if counters.is_future(new_slot.start_time):
+        deltas.add(counters.ORG, new_slot.organization_id, "active_slots", -1)
+
     if old_slot:
         old_slot.is_booked = False
 
@@ -620,12 +1450,18 @@ async def reschedule_appointment(
     new_slot.is_booked = True
 
     try:
+        await counters.bump(db, deltas)
+        await db.flush()
+        await idem.save(db, appointment)
         await db.commit()
         await db.refresh(appointment)
     except Exception as e:
         await db.rollback()
         logger.error(f"reschedule_appointment commit failed for appointment_id={appointment_id}: {e}")
         raise HTTPException(status_code=500, detail="Reschedule failed. Please try again.")
+    if old_slot:
+        free_time_index.slot_saved(old_slot.doctor_id, old_slot.id, old_slot.start_time, old_slot.end_time, False)
+    free_time_index.slot_saved(new_slot.doctor_id, new_slot.id, new_slot.start_time, new_slot.end_time, True)
 
     # Send reschedule emails to patient and doctor
     new_date_str  = new_slot.start_time.strftime("%Y-%m-%d")
@@ -671,18 +1507,14 @@ async def reschedule_appointment(
 
 @router.get("/updated", response_model=List[schemas.AppointmentOut])
 async def get_updated_appointments(
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST])),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.require_role_claims([models.UserRole.DOCTOR, models.UserRole.RECEPTIONIST])),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
     query = select(models.Appointment).options(
         selectinload(models.Appointment.doctor),
         selectinload(models.Appointment.patient)
-    ).where(
-        models.Appointment.status == models.AppointmentStatus.RESCHEDULED,
-        models.Appointment.organization_id == current_user.organization_id
-    )
-    if current_user.role == models.UserRole.DOCTOR:
-        query = query.where(models.Appointment.doctor_id == current_user.id)
+    ).where(models.Appointment.status == models.AppointmentStatus.RESCHEDULED)
+    query = apply_scope(query, current_user, models.Appointment)
 
     result = await db.execute(query)
     return result.scalars().all()
\ No newline at end of file
@@ -3,12 +3,18 @@ from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Union, Optional
-from .. import models, schemas, auth, database
+from .. import models, schemas, auth, database, dependencies, counters
 from ..models import Receptionist
+from ..principal import Principal
+from ..revocation import revocation_filter
 import shutil, os, uuid
 import base64
+import hashlib
+import logging
+
+logger = logging.getLogger("auth")
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -17,7 +23,7 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 # Helper — build UserWithToken from a User row
 # -------------------------------------------------------------------
 
-def build_user_with_token(user: models.User, access_token: str, refresh_token: str) -> schemas.UserWithToken:
+def build_user_with_token(user: Principal, access_token: str, refresh_token: str) -> schemas.UserWithToken:
     return schemas.UserWithToken(
         id=user.id,
         email=user.email,
@@ -26,7 +32,7 @@ def build_user_with_token(user: models.User, access_token: str, refresh_token: s
         organization_id=user.organization_id,
         is_active=user.is_active,
         phone_number=user.phone_number,
-        doctor_id=user.doctor_profile.id if user.role == models.UserRole.DOCTOR and user.doctor_profile else None,
+        doctor_id=user.doctor_profile_id if user.role == models.UserRole.DOCTOR else None,
         doctor_name=None,
         access_token=access_token,
         refresh_token=refresh_token,
@@ -34,14 +40,15 @@ def build_user_with_token(user: models.User, access_token: str, refresh_token: s
     )
 
 
-def make_tokens(user: models.User):
+def make_tokens(user: Principal):
     role_str = user.role.value if hasattr(user.role, "value") else str(user.role)
     access_token = auth.create_access_token(
-        data={"sub": user.email, "role": role_str},
+        data=auth.build_claims(user),
         expires_delta=timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     )
+    # uid + cv let the refresh endpoint reject tokens of changed/revoked users
     refresh_token = auth.create_refresh_token(
-        data={"sub": user.email, "role": role_str}
+        data={"sub": user.email, "role": role_str, "uid": user.id, "cv": user.claims_version}
     )
     return access_token, refresh_token
 
@@ -61,7 +68,7 @@ async def login_user(user_credentials: schemas.UserLogin, role: models.UserRole,
     )
     user = result.scalars().first()
 
-    if not user or not auth.verify_password(user_credentials.password, user.hashed_password):
+    if not user or not await auth.verify_password_async(user_credentials.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -74,8 +81,9 @@ async def login_user(user_credentials: schemas.UserLogin, role: models.UserRole,
             detail=f"User is not registered as a {role.value}"
         )
 
-    access_token, refresh_token = make_tokens(user)
-    return build_user_with_token(user, access_token, refresh_token)
+    principal = Principal.from_user(user)
+    access_token, refresh_token = make_tokens(principal)
+    return build_user_with_token(principal, access_token, refresh_token)
 
 
 # -------------------------------------------------------------------
@@ -114,7 +122,7 @@ async def register_hospital(user_data: schemas.HospitalRegister, db: AsyncSessio
 
     new_user = models.User(
         email=user_data.email,
-        hashed_password=auth.get_password_hash(user_data.password),
+        hashed_password=await auth.hash_password_async(user_data.password),
         role=models.UserRole.HOSPITAL,
         organization_id=org.id,
         full_name=user_data.full_name,
@@ -122,6 +130,7 @@ async def register_hospital(user_data: schemas.HospitalRegister, db: AsyncSessio
     )
     db.add(new_user)
     try:
+        await counters.bump(db, counters.Deltas().add(counters.GLOBAL, 0, "users"))
         await db.commit()
         await db.refresh(new_user)
     except Exception as e:
@@ -154,63 +163,105 @@ async def login_for_access_token(
     )
     user = result.scalars().first()
 
-    if not user or not auth.verify_password(user_credentials.password, user.hashed_password):
+    if not user or not await auth.verify_password_async(user_credentials.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token, refresh_token = make_tokens(user)
-    return build_user_with_token(user, access_token, refresh_token)
+    principal = Principal.from_user(user)
+    access_token, refresh_token = make_tokens(principal)
+    return build_user_with_token(principal, access_token, refresh_token)
 
 
 # -------------------------------------------------------------------
 # Token refresh
 # -------------------------------------------------------------------
 
+def decode_refresh_token(refresh_token: str) -> dict:
+    try:
+        payload = jwt.decode(refresh_token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    except JWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if payload.get("sub") is None or payload.get("type") != "refresh":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    return payload
+
+
+def refresh_token_jti(payload: dict, raw_token: str) -> str:
+    """The token's jti; tokens minted before jti existed are identified by a hash of the token itself."""
+    return payload.get("jti") or "sha256:" + hashlib.sha256(raw_token.encode()).hexdigest()
+
+
 @router.post("/token/refresh", response_model=Union[schemas.UserWithToken, schemas.Token])
 async def refresh_access_token(
     token_data: schemas.TokenRefresh,
     db: AsyncSession = Depends(database.get_db)
 ):
+    payload = decode_refresh_token(token_data.refresh_token)
+    jti = refresh_token_jti(payload, token_data.refresh_token)
+
+    # Normally answered from memory — see app/revocation.py
+    await revocation_filter.sync_if_stale(db)
+    if revocation_filter.is_revoked(jti):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token has been revoked")
+
+    if "uid" in payload and "cv" in payload:
+        await dependencies.check_claims_version(payload["uid"], payload["cv"], db)
+
+    try:
+        user = await dependencies.load_principal(payload["sub"], db)
+    except HTTPException:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+
+    # Rotation — the presented token is spent, legacy tokens without a jti included
+    expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+    if not await revocation_filter.revoke(db, jti, user.id, expires_at):
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Refresh token has been revoked")
     try:
-        payload = jwt.decode(token_data.refresh_token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        email: str = payload.get("sub")
-        token_type: str = payload.get("type")
-
-        if email is None or token_type != "refresh":
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
-
-        result = await db.execute(
-            select(models.User)
-            .options(
-                selectinload(models.User.doctor_profile),
-                selectinload(models.User.receptionist_profile).selectinload(Receptionist.doctors)
-            )
-            .where(models.User.email == email)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"refresh_access_token revoke failed for user_id={user.id}: {e}")
+        raise HTTPException(status_code=500, detail="Token refresh failed. Please try again.")
+    revocation_filter.remember(jti, expires_at)
+
+    access_token, refresh_token = make_tokens(user)
+
+    if user.role == models.UserRole.SUPER_ADMIN:
+        return schemas.Token(
+            access_token=access_token,
+            refresh_token=refresh_token,
+            token_type="bearer"
         )
-        user = result.scalars().first()
-        if not user:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
-        access_token, refresh_token = make_tokens(user)
+    return build_user_with_token(user, access_token, refresh_token)
 
-        if user.role == models.UserRole.SUPER_ADMIN:
-            return schemas.Token(
-                access_token=access_token,
-                refresh_token=refresh_token,
-                token_type="bearer"
-            )
 
-        return build_user_with_token(user, access_token, refresh_token)
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(
+    token_data: schemas.TokenRefresh,
+    db: AsyncSession = Depends(database.get_db)
+):
+    payload = decode_refresh_token(token_data.refresh_token)
+    jti = refresh_token_jti(payload, token_data.refresh_token)
 
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    expires_at = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
+    await revocation_filter.revoke(db, jti, payload.get("uid"), expires_at)
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"logout revoke failed for jti={jti}: {e}")
+        raise HTTPException(status_code=500, detail="Logout failed. Please try again.")
+    revocation_filter.remember(jti, expires_at)
+    return None
 
 
 # -------------------------------------------------------------------
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends
+from .. import models, dependencies
+from ..auth import hashing_pool
+from ..background import job_status
+from ..online_migrations import online_migration_status
+from ..pool_metrics import pool_registry
+from ..principal import principal_cache
+from ..reaper import reaper_status
+from ..free_time import free_time_index
+from ..revocation import revocation_filter
+
+router = APIRouter(prefix="/internal", tags=["Internal"])
+
+
+# -------------------------------------------------------------------
+# GET /internal/metrics
+# Accessible by: SUPER_ADMIN
+# Pool telemetry plus the in-process caches, for telling pool
+# starvation apart from slow queries during latency spikes.
+# -------------------------------------------------------------------
+
+@router.get("/metrics")
+async def get_metrics(
+    current_user=Depends(dependencies.require_role_claims([models.UserRole.SUPER_ADMIN])),
+):
+    return {
+        "db_pools": {name: metrics.snapshot() for name, metrics in pool_registry.items()},
+        "principal_cache": principal_cache.stats(),
+        "password_hashing": hashing_pool.stats(),
+        "revoked_tokens": len(revocation_filter),
+        "online_migrations": online_migration_status,
+        "background_jobs": job_status,
+        "slot_reaper": reaper_status,
+        "free_time_index": free_time_index.stats(),
+    }
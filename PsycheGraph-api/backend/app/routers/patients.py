@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import func
+from sqlalchemy.orm import aliased
 from datetime import datetime
 from typing import List
 import logging
-from .. import models, schemas, dependencies, database
+import re
+from .. import models, schemas, dependencies, database, counters
+from ..principal import Principal
+from ..scopes import apply_scope
+from ..pagination import PageParams, page_params, paginate, finish_page
+from ..search import patient_match, patient_text_score
+from ..idempotency import Idempotency, IdempotencyRequest, idempotency
 
 logger = logging.getLogger("patients")
 
@@ -13,9 +21,15 @@ router = APIRouter(prefix="/patients", tags=["Patients"])
 @router.post("/", response_model=schemas.PatientOut)
 async def create_patient(
     patient: schemas.PatientCreate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
+    db: AsyncSession = Depends(database.get_db),
+    idem_key: IdempotencyRequest = Depends(idempotency)
 ):
+    idem = idem_key.for_user(current_user.id)
+    return await idem.run(lambda: _create_patient(patient, current_user, db, idem), schemas.PatientOut)
+
+
+async def _create_patient(patient: schemas.PatientCreate, current_user, db: AsyncSession, idem: Idempotency):
     if current_user.role in [models.UserRole.HOSPITAL, models.UserRole.RECEPTIONIST]:
         org_id = current_user.organization_id
     else:
@@ -37,8 +51,17 @@ async def create_patient(
     )
     db.add(new_patient)
     try:
-        await db.commit()
+        await counters.bump(
+            db,
+            counters.Deltas()
+            .add(counters.GLOBAL, 0, "patients")
+            .add(counters.ORG, org_id, "patients")
+            .add(counters.USER, current_user.id, "patients_created")
+        )
+        await db.flush()
         await db.refresh(new_patient)
+        await idem.save(db, new_patient)
+        await db.commit()
     except Exception as e:
         await db.rollback()
         logger.error(f"create_patient commit failed: {e}")
@@ -48,49 +71,95 @@ async def create_patient(
 
 @router.get("", response_model=List[schemas.PatientOut])
 async def get_patients(
-    skip: int = 0,
-    limit: int = 100,
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    response: Response,
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    query = select(models.Patient)
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    elif current_user.role == models.UserRole.DOCTOR:
-        query = query.where(models.Patient.doctor_id == current_user.id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
-
-    query = query.offset(skip).limit(limit)
+    query = apply_scope(select(models.Patient), current_user, models.Patient)
+    query = paginate(query, page, models.Patient.id, models.Patient.id)
     try:
         result = await db.execute(query)
-        return result.scalars().all()
+        return finish_page(result.scalars().all(), page, response, "id")
     except Exception as e:
         logger.error(f"get_patients failed: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve patients.")
 
 
+# -------------------------------------------------------------------
+# GET /patients/search?q=   (declared before /{patient_id})
+# Partial / fuzzy name, email or phone-digit lookup over pg_trgm GIN
+# indexes. Ranked by text match, with a small boost for patients who
+# had an appointment recently.
+# -------------------------------------------------------------------
+
+SEARCH_MAX_RESULTS = 50
+RECENT_ACTIVITY_WEIGHT = 0.2
+RECENT_ACTIVITY_HALF_LIFE_DAYS = 30
+
+
+@router.get("/search", response_model=List[schemas.PatientSearchHit])
+async def search_patients(
+    q: str = Query(..., min_length=2, max_length=100),
+    limit: int = Query(20, ge=1),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    q = q.strip()
+    digits = re.sub(r"\D", "", q)
+
+    # Latest appointment per candidate — (patient_id, start_time) index, one probe per row
+    last_appointment = (
+        select(func.max(models.Appointment.start_time))
+        .where(models.Appointment.patient_id == models.Patient.id)
+        .correlate(models.Patient)
+        .scalar_subquery()
+    )
+    candidates = apply_scope(
+        select(
+            models.Patient,
+            patient_text_score(q, digits).label("text_score"),
+            last_appointment.label("last_appointment_at"),
+        ).where(models.Patient.is_active == True, patient_match(q, digits)),
+        current_user, models.Patient
+    ).subquery()
+    patient = aliased(models.Patient, candidates)
+
+    days_since = func.coalesce(func.extract("epoch", func.now() - candidates.c.last_appointment_at) / 86400, 36500)
+    score = (
+        candidates.c.text_score + RECENT_ACTIVITY_WEIGHT / (1 + days_since / RECENT_ACTIVITY_HALF_LIFE_DAYS)
+    ).label("score")
+    query = (
+        select(patient, score, candidates.c.last_appointment_at)
+        .order_by(score.desc(), candidates.c.id)
+        .limit(min(limit, SEARCH_MAX_RESULTS))
+    )
+
+    try:
+        result = await db.execute(query)
+        return [
+            schemas.PatientSearchHit(
+                **schemas.PatientOut.model_validate(hit).model_dump(),
+                score=round(float(row_score), 4),
+                last_appointment_at=last_at,
+            )
+            for hit, row_score, last_at in result.all()
+        ]
+    except Exception as e:
+        logger.error(f"search_patients failed: {e}")
+        raise HTTPException(status_code=500, detail="Patient search failed.")
+
+
 @router.get("/{patient_id}", response_model=schemas.PatientOut)
 async def get_patient(
     patient_id: int,
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    query = select(models.Patient).where(models.Patient.id == patient_id)
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    elif current_user.role == models.UserRole.DOCTOR:
-        query = query.where(models.Patient.doctor_id == current_user.id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    # Out-of-scope patients are reported as not found
+    query = apply_scope(
+        select(models.Patient).where(models.Patient.id == patient_id), current_user, models.Patient
+    )
 
     try:
         result = await db.execute(query)
@@ -109,18 +178,12 @@ async def get_patient(
 async def update_patient(
     patient_id: int,
     patient_update: schemas.PatientUpdate,
-    current_user: models.User = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
+    current_user: Principal = Depends(dependencies.require_role([models.UserRole.RECEPTIONIST, models.UserRole.HOSPITAL])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    query = select(models.Patient).where(models.Patient.id == patient_id)
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized to update patient data")
+    query = apply_scope(
+        select(models.Patient).where(models.Patient.id == patient_id), current_user, models.Patient
+    )
 
     try:
         result = await db.execute(query)
@@ -129,6 +192,8 @@ async def update_patient(
             raise HTTPException(status_code=404, detail="Patient not found")
 
         update_data = patient_update.model_dump(exclude_unset=True)
+        if "doctor_id" in update_data:
+            await counters.bump(db, counters.reassign_patient(counters.Deltas(), patient.doctor_id, update_data["doctor_id"]))
         for key, value in update_data.items():
             setattr(patient, key, value)
 
@@ -146,21 +211,16 @@ async def update_patient(
 @router.delete("/{patient_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_patient(
     patient_id: int,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.HOSPITAL,
         models.UserRole.RECEPTIONIST,
         models.UserRole.SUPER_ADMIN
     ])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    query = select(models.Patient).where(models.Patient.id == patient_id)
-
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.where(models.Patient.organization_id == current_user.organization_id)
+    query = apply_scope(
+        select(models.Patient).where(models.Patient.id == patient_id), current_user, models.Patient
+    )
 
     try:
         result = await db.execute(query)
@@ -168,6 +228,7 @@ async def delete_patient(
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
 
+        await counters.bump(db, await counters.patient_removed(db, patient, counters.Deltas()))
         await db.delete(patient)
         await db.commit()
         return None
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import func, literal, Text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import defer
 from typing import List, Optional
-from .. import models, schemas, dependencies, database
+from .. import models, schemas, dependencies, database, counters
+from ..principal import Principal
+from ..scopes import apply_scope, fetch_scoped, fetch_scoped_columns
+from ..pagination import PageParams, page_params, paginate, finish_page
+from ..streaming import stream_format, stream_response
+from ..search import refresh_session_search_vector, session_search_query, headline
 from ..services.fireflies import get_transcript
 import json
 from datetime import datetime, timezone
@@ -21,7 +29,7 @@ router = APIRouter(prefix="/sessions", tags=["Sessions"])
 @router.post("/", response_model=schemas.SessionOut)
 async def create_session(
     session_in: schemas.SessionCreate,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.DOCTOR,
         models.UserRole.HOSPITAL,
         models.UserRole.SUPER_ADMIN
@@ -64,6 +72,7 @@ async def create_session(
     )
 
     db.add(new_session)
+    await counters.bump(db, counters.Deltas().add(counters.USER, actual_doctor_id, "sessions"))
     await db.commit()
     await db.refresh(new_session)
     return new_session
@@ -80,7 +89,7 @@ async def create_session(
 @router.post("/{appointment_id}/fetch-transcript", response_model=schemas.SessionOut)
 async def fetch_and_save_transcript(
     appointment_id: int,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.DOCTOR,
         models.UserRole.HOSPITAL,
         models.UserRole.SUPER_ADMIN
@@ -118,6 +127,8 @@ async def fetch_and_save_transcript(
         existing_session.transcript = transcript_text
         existing_session.summary = summary_text
         existing_session.version += 1
+        await db.flush()
+        await refresh_session_search_vector(db, existing_session.id)
         await db.commit()
         await db.refresh(existing_session)
         logger.info(f"[FIREFLIES] Updated session {existing_session.id} for appointment {appointment_id}")
@@ -133,6 +144,9 @@ async def fetch_and_save_transcript(
             summary=summary_text,
         )
         db.add(new_session)
+        await db.flush()
+        await refresh_session_search_vector(db, new_session.id)
+        await counters.bump(db, counters.Deltas().add(counters.USER, appointment.doctor_id, "sessions"))
         await db.commit()
         await db.refresh(new_session)
         logger.info(f"[FIREFLIES] Created new session for appointment {appointment_id}")
@@ -143,41 +157,113 @@ async def fetch_and_save_transcript(
 # Get all sessions
 # -------------------------------------------------------------------
 
-@router.get("", response_model=List[schemas.SessionOut])
+# Rows come back as SessionSummaryOut unless ?include=transcript (or summary)
+# asks for the text columns; those are deferred otherwise, so a list of 500
+# sessions never pulls 500 transcripts off disk.
+TEXT_COLUMNS = ("summary", "transcript")
+
+
+def session_list_item(session: models.Session, with_text: bool) -> schemas.SessionOut:
+    data = schemas.SessionSummaryOut.model_validate(session).model_dump()
+    if with_text:
+        data.update({c: getattr(session, c) for c in TEXT_COLUMNS})
+    # Unset text fields are dropped by response_model_exclude_unset
+    return schemas.SessionOut(**data)
+
+
+@router.get("", response_model=List[schemas.SessionOut], response_model_exclude_unset=True)
 async def get_sessions(
+    request: Request,
+    response: Response,
     patient_id: Optional[int] = None,
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    format: Optional[str] = None,
+    include: Optional[str] = Query(None, description="'transcript' to also return summary and transcript"),
+    page: PageParams = Depends(page_params),
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    query = select(models.Session)
+    includes = {part.strip() for part in include.split(",")} if include else set()
+    with_text = bool(includes & set(TEXT_COLUMNS))
 
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        query = query.join(models.Patient).where(
-            models.Patient.organization_id == current_user.organization_id
-        )
-    elif current_user.role == models.UserRole.DOCTOR:
-        query = query.where(models.Session.doctor_id == current_user.id)
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        query = query.join(models.Patient).where(
-            models.Patient.created_by_id == current_user.id
-        )
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
+    query = apply_scope(select(models.Session), current_user, models.Session)
+    if not with_text:
+        query = query.options(*(defer(getattr(models.Session, c)) for c in TEXT_COLUMNS))
 
     if patient_id:
         query = query.where(models.Session.patient_id == patient_id)
 
+    # Streamed export (?format=ndjson|csv or Accept: application/x-ndjson) — every row, no paging
+    fmt = stream_format(request, format)
+    if fmt:
+        query = query.order_by(models.Session.session_date, models.Session.id)
+        schema = schemas.SessionOut if with_text else schemas.SessionSummaryOut
+        return stream_response(database.read_session_factory(request), query, schema, fmt, "sessions")
+
+    query = paginate(query, page, models.Session.session_date, models.Session.id)
+
     try:
         result = await db.execute(query)
-        return result.scalars().all()
+        rows = finish_page(result.scalars().all(), page, response, "session_date")
+        return [session_list_item(s, with_text) for s in rows]
     except Exception as e:
         logger.error(f"Error in get_sessions: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail="Failed to retrieve sessions. Please try again.")
 
 
+# -------------------------------------------------------------------
+# Full-text search over summary + transcript
+# GET /sessions/search?q=...   (declared before /{session_id})
+#
+# Ranking runs on the GIN-indexed search_vector; ts_headline — which
+# re-parses the document — only runs for the top `limit` hits.
+# -------------------------------------------------------------------
+
+SEARCH_MAX_RESULTS = 50
+
+
+@router.get("/search", response_model=List[schemas.SessionSearchHit])
+async def search_sessions(
+    q: str = Query(..., min_length=2, max_length=200),
+    patient_id: Optional[int] = None,
+    limit: int = Query(20, ge=1),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    tsquery = session_search_query(q)
+    rank = func.ts_rank_cd(models.Session.search_vector, tsquery)
+
+    top = apply_scope(
+        select(models.Session.id, rank.label("rank")).where(models.Session.search_vector.op("@@")(tsquery)),
+        current_user, models.Session
+    )
+    if patient_id:
+        top = top.where(models.Session.patient_id == patient_id)
+    top = top.order_by(rank.desc(), models.Session.session_date.desc()).limit(min(limit, SEARCH_MAX_RESULTS)).subquery()
+
+    query = (
+        select(
+            models.Session.id,
+            models.Session.patient_id,
+            models.Session.doctor_id,
+            models.Session.appointment_id,
+            models.Session.session_date.label("date"),
+            top.c.rank,
+            headline(models.Session.summary, tsquery).label("summary_snippet"),
+            headline(models.Session.transcript, tsquery).label("transcript_snippet"),
+        )
+        .join(top, top.c.id == models.Session.id)
+        .order_by(top.c.rank.desc(), models.Session.session_date.desc())
+    )
+
+    try:
+        result = await db.execute(query)
+        return [schemas.SessionSearchHit.model_validate(row) for row in result.mappings().all()]
+    except Exception as e:
+        logger.error(f"search_sessions failed: {e}")
+        raise HTTPException(status_code=500, detail="Search failed. Please try again.")
+
+
 # -------------------------------------------------------------------
 # Get single session
 # -------------------------------------------------------------------
@@ -185,39 +271,55 @@ async def get_sessions(
 @router.get("/{session_id}", response_model=schemas.SessionOut)
 async def get_session(
     session_id: int,
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    result = await db.execute(
-        select(models.Session).where(models.Session.id == session_id)
+    return await fetch_scoped(
+        db, current_user, models.Session, session_id, not_found="Session not found"
     )
-    session = result.scalars().first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        patient_res = await db.execute(
-            select(models.Patient).where(models.Patient.id == session.patient_id)
-        )
-        patient = patient_res.scalars().first()
-        if not patient or patient.organization_id != current_user.organization_id:
-            raise HTTPException(status_code=403, detail="Not authorized")
-    elif current_user.role == models.UserRole.DOCTOR:
-        if session.doctor_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized")
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        patient_res = await db.execute(
-            select(models.Patient).where(models.Patient.id == session.patient_id)
+
+
+# -------------------------------------------------------------------
+# Transcript window — a slice of the transcript, cut in SQL
+# GET /sessions/{session_id}/transcript?unit=lines&start=0&count=200
+# -------------------------------------------------------------------
+
+TRANSCRIPT_MAX_CHARS = 256 * 1024
+TRANSCRIPT_MAX_LINES = 2000
+
+
+@router.get("/{session_id}/transcript", response_model=schemas.TranscriptWindow)
+async def get_transcript_window(
+    session_id: int,
+    unit: str = Query("chars", pattern="^(chars|lines)$"),
+    start: int = Query(0, ge=0),
+    count: int = Query(64 * 1024, ge=1),
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    transcript = func.coalesce(models.Session.transcript, literal(""))
+    if unit == "chars":
+        count = min(count, TRANSCRIPT_MAX_CHARS)
+        columns = (
+            func.substr(transcript, start + 1, count).label("text"),
+            func.length(transcript).label("total"),
         )
-        patient = patient_res.scalars().first()
-        if not patient or patient.created_by_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized")
     else:
-        raise HTTPException(status_code=403, detail="Not authorized")
+        # Fireflies transcripts are one "[Speaker]: text" line per sentence
+        count = min(count, TRANSCRIPT_MAX_LINES)
+        lines = func.string_to_array(transcript, literal("\n"), type_=ARRAY(Text))
+        columns = (
+            func.array_to_string(lines[start + 1:start + count], literal("\n")).label("text"),
+            func.coalesce(func.array_length(lines, 1), 0).label("total"),
+        )
 
-    return session
+    row = await fetch_scoped_columns(
+        db, current_user, models.Session, session_id, columns, not_found="Session not found"
+    )
+    return schemas.TranscriptWindow(
+        session_id=session_id, unit=unit, start=start, count=count,
+        total=row.total, text=row.text or "",
+    )
 
 
 # -------------------------------------------------------------------
@@ -228,34 +330,16 @@ async def get_session(
 async def update_session(
     session_id: int,
     session_update: schemas.SessionUpdate,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.DOCTOR,
         models.UserRole.HOSPITAL,
         models.UserRole.SUPER_ADMIN
     ])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    result = await db.execute(
-        select(models.Session).where(models.Session.id == session_id)
+    session = await fetch_scoped(
+        db, current_user, models.Session, session_id, not_found="Session not found"
     )
-    session = result.scalars().first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    if current_user.role == models.UserRole.SUPER_ADMIN:
-        pass
-    elif current_user.role == models.UserRole.HOSPITAL:
-        patient_res = await db.execute(
-            select(models.Patient).where(models.Patient.id == session.patient_id)
-        )
-        patient = patient_res.scalars().first()
-        if not patient or patient.organization_id != current_user.organization_id:
-            raise HTTPException(status_code=403, detail="Not authorized")
-    elif current_user.role == models.UserRole.DOCTOR:
-        if session.doctor_id != current_user.id:
-            raise HTTPException(status_code=403, detail="Not authorized")
-    else:
-        raise HTTPException(status_code=403, detail="Not authorized")
 
     update_data = session_update.model_dump(exclude_unset=True)
     if "soap_notes" in update_data and update_data["soap_notes"] is not None:
@@ -264,6 +348,9 @@ async def update_session(
         setattr(session, key, value)
     session.version += 1
 
+    if {"summary", "transcript"} & update_data.keys():
+        await db.flush()
+        await refresh_session_search_vector(db, session.id)
     await db.commit()
     await db.refresh(session)
     return session
@@ -276,27 +363,17 @@ async def update_session(
 @router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_session(
     session_id: int,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.HOSPITAL,
         models.UserRole.SUPER_ADMIN
     ])),
     db: AsyncSession = Depends(database.get_db)
 ):
-    result = await db.execute(
-        select(models.Session).where(models.Session.id == session_id)
+    session = await fetch_scoped(
+        db, current_user, models.Session, session_id, not_found="Session not found"
     )
-    session = result.scalars().first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    if current_user.role != models.UserRole.SUPER_ADMIN:
-        patient_res = await db.execute(
-            select(models.Patient).where(models.Patient.id == session.patient_id)
-        )
-        patient = patient_res.scalars().first()
-        if not patient or patient.organization_id != current_user.organization_id:
-            raise HTTPException(status_code=403, detail="Not authorized")
 
+    await counters.bump(db, counters.Deltas().add(counters.USER, session.doctor_id, "sessions", -1))
     await db.delete(session)
     await db.commit()
     return None
\ No newline at end of file
@@ -1,100 +1,210 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func
-from .. import models, dependencies, database
-import asyncio
+from sqlalchemy import DateTime, cast, func, literal_column
+from datetime import date, datetime, timedelta
+from typing import Optional
+from collections import defaultdict
+from .. import models, schemas, dependencies, database, counters
+from ..principal import Principal
+from ..counters import GLOBAL, ORG, USER
+from ..parallel import ParallelReader, get_parallel_reader
+from ..rollups import BUCKETS, bucket_start
 
 router = APIRouter(prefix="/stats", tags=["Stats"])
 
+
+# -------------------------------------------------------------------
+# GET /stats
+# Dashboard cards per role. Every value comes from stats_counters
+# (see app/counters.py), fetched in one primary-key lookup — no
+# COUNT(*) over the live tables on page load.
+# -------------------------------------------------------------------
+
+def _cards(user):
+    """(label, counter key, type) for each numeric card on the user's dashboard."""
+    org, uid = user.organization_id, user.id
+    today = counters.day_metric(counters.today_ist())
+
+    if user.role == models.UserRole.SUPER_ADMIN:
+        return [
+            ("Total Organizations", (GLOBAL, 0, "organizations"), "orgs"),
+            ("Global Users", (GLOBAL, 0, "users"), "users"),
+            ("Total Patients", (GLOBAL, 0, "patients"), "patients"),
+        ]
+    if user.role == models.UserRole.HOSPITAL:
+        return [
+            ("Medical Staff", (ORG, org, "doctors"), "doctors"),
+            ("Org Patients", (ORG, org, "patients"), "patients"),
+            ("Total Appointments", (ORG, org, "appointments"), "appointments"),
+        ]
+    if user.role == models.UserRole.DOCTOR:
+        return [
+            ("My Patients", (USER, uid, "patients"), "patients"),
+            ("Appointments", (USER, uid, "appointments"), "appointments"),
+            ("Sessions Conducted", (USER, uid, "sessions"), "sessions"),
+        ]
+    if user.role == models.UserRole.RECEPTIONIST:
+        return [
+            ("Patients Registered", (USER, uid, "patients_created"), "patients"),
+            ("Org Appointments", (ORG, org, "appointments"), "appointments"),
+            ("Active Slots", (ORG, org, "active_slots"), "slots"),
+            ("Check-ins Today", (ORG, org, today), "checkins"),
+        ]
+    return []
+
+
+# Non-numeric cards, appended after the counters
+STATIC_CARDS = {
+    models.UserRole.SUPER_ADMIN: [{"label": "System Health", "value": "Optimal", "type": "health"}],
+    models.UserRole.HOSPITAL:    [{"label": "License Status", "value": "Active", "type": "license"}],
+    models.UserRole.DOCTOR:      [{"label": "Avg Rating", "value": "4.9", "type": "rating"}],
+}
+
+
 @router.get("/")
 async def get_stats(
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    stats = []
-    
+    cards = _cards(current_user)
+    if not cards:
+        return []
+
+    values = await counters.read(db, [key for _, key, _ in cards])
+    stats = [
+        {"label": label, "value": str(max(values[key], 0)), "type": card_type}
+        for label, key, card_type in cards
+    ]
+    return stats + STATIC_CARDS.get(current_user.role, [])
+
+
+# -------------------------------------------------------------------
+# GET /stats/appointments/timeseries
+# Appointments per day / week / month, optionally split by doctor,
+# status or booked_by_role. Closed buckets are summed from the
+# appointment_rollups table; the current, still-filling bucket is
+# counted live from appointments over idx_apt_date_status.
+# -------------------------------------------------------------------
+
+MAX_TIMESERIES_DAYS = 3 * 366
+
+_ROLLUP_GROUP_COLUMNS = {
+    "doctor":         models.AppointmentRollup.doctor_id,
+    "status":         models.AppointmentRollup.status,
+    "booked_by_role": models.AppointmentRollup.booked_by_role,
+}
+_LIVE_GROUP_COLUMNS = {
+    "doctor":         models.Appointment.doctor_id,
+    "status":         models.Appointment.status,
+    "booked_by_role": func.coalesce(models.Appointment.booked_by_role, literal_column("''")),
+}
+
+
+def _timeseries_scope(current_user, org_id: Optional[int]):
+    """(organization_id, doctor_id) filters for the caller; None means unrestricted."""
     if current_user.role == models.UserRole.SUPER_ADMIN:
-        # FIX: Run all COUNT queries concurrently instead of sequentially
-        org_count_res, user_count_res, patient_count_res = await asyncio.gather(
-            db.execute(select(func.count(models.Organization.id))),
-            db.execute(select(func.count(models.User.id))),
-            db.execute(select(func.count(models.Patient.id))),
-        )
-        
-        stats = [
-            {"label": "Total Organizations", "value": str(org_count_res.scalar()), "type": "orgs"},
-            {"label": "Global Users", "value": str(user_count_res.scalar()), "type": "users"},
-            {"label": "Total Patients", "value": str(patient_count_res.scalar()), "type": "patients"},
-            {"label": "System Health", "value": "Optimal", "type": "health"}
-        ]
-        
-    elif current_user.role == models.UserRole.HOSPITAL:
-        # FIX: Run all COUNT queries concurrently instead of sequentially
-        doc_count_res, patient_count_res, app_count_res = await asyncio.gather(
-            db.execute(
-                select(func.count(models.User.id))
-                .where(models.User.organization_id == current_user.organization_id, models.User.role == models.UserRole.DOCTOR)
-            ),
-            db.execute(
-                select(func.count(models.Patient.id))
-                .where(models.Patient.organization_id == current_user.organization_id)
-            ),
-            db.execute(
-                select(func.count(models.Appointment.id))
-                .where(models.Appointment.organization_id == current_user.organization_id)
-            ),
-        )
-        
-        stats = [
-            {"label": "Medical Staff", "value": str(doc_count_res.scalar()), "type": "doctors"},
-            {"label": "Org Patients", "value": str(patient_count_res.scalar()), "type": "patients"},
-            {"label": "Total Appointments", "value": str(app_count_res.scalar()), "type": "appointments"},
-            {"label": "License Status", "value": "Active", "type": "license"}
-        ]
-        
-    elif current_user.role == models.UserRole.DOCTOR:
-        # FIX: Run all COUNT queries concurrently instead of sequentially
-        patient_count_res, app_count_res, session_count_res = await asyncio.gather(
-            db.execute(
-                select(func.count(models.Patient.id))
-                .where(models.Patient.doctor_id == current_user.id)
-            ),
-            db.execute(
-                select(func.count(models.Appointment.id))
-                .where(models.Appointment.doctor_id == current_user.id)
-            ),
-            db.execute(
-                select(func.count(models.Session.id))
-                .where(models.Session.doctor_id == current_user.id)
-            ),
+        return org_id, None
+    if current_user.role == models.UserRole.DOCTOR:
+        return current_user.organization_id, current_user.id
+    return current_user.organization_id, None
+
+
+def _grouped(columns: list, group_column):
+    """Select list for a bucketed query — the group_by column is added only when grouping."""
+    return columns + [group_column.label("key")] if group_column is not None else columns
+
+
+def _key(value):
+    if value is None:
+        return None
+    return str(getattr(value, "value", value))
+
+
+@router.get("/appointments/timeseries", response_model=schemas.AppointmentTimeseries)
+async def get_appointment_timeseries(
+    bucket: str = Query("day", description="day, week or month"),
+    start: Optional[date] = Query(None, description="Defaults to 30 days ago; aligned down to its bucket"),
+    end: Optional[date] = Query(None, description="Inclusive; defaults to today (IST)"),
+    group_by: Optional[str] = Query(None, description="doctor, status or booked_by_role"),
+    doctor_id: Optional[int] = None,
+    status: Optional[models.AppointmentStatus] = None,
+    org_id: Optional[int] = Query(None, description="Super Admin only — defaults to all organizations"),
+    current_user: Principal = Depends(dependencies.get_current_claims),
+    parallel: ParallelReader = Depends(get_parallel_reader)
+):
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    if group_by is not None and group_by not in _ROLLUP_GROUP_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(_ROLLUP_GROUP_COLUMNS)}")
+
+    today = counters.today_ist()
+    end = end or today
+    start = bucket_start(start or today - timedelta(days=30), bucket)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days > MAX_TIMESERIES_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {MAX_TIMESERIES_DAYS} days")
+
+    scope_org, scope_doctor = _timeseries_scope(current_user, org_id)
+    if scope_doctor is not None:
+        doctor_id = scope_doctor
+    live_from = max(start, bucket_start(today, bucket))
+    # Inlined rather than bound, so SELECT and GROUP BY render the identical expression
+    unit = literal_column(f"'{bucket}'")
+
+    statements = []
+
+    # Closed buckets — rollup rows, keyed by (organization_id, day, …)
+    R = models.AppointmentRollup
+    if start < live_from:
+        # A bare date would be cast to timestamptz in the session TimeZone and come back
+        # shifted; truncate a plain timestamp, like the live bucket below
+        rollup_bucket = func.date_trunc(unit, cast(R.day, DateTime(timezone=False))).label("bucket")
+        rollup_key = _ROLLUP_GROUP_COLUMNS.get(group_by)
+        rollup = (
+            select(*_grouped([rollup_bucket, func.sum(R.count).label("count")], rollup_key))
+            .where(R.day >= start, R.day < min(live_from, end + timedelta(days=1)))
+            .group_by(*_grouped([rollup_bucket], rollup_key))
         )
-        
-        stats = [
-            {"label": "My Patients", "value": str(patient_count_res.scalar()), "type": "patients"},
-            {"label": "Appointments", "value": str(app_count_res.scalar()), "type": "appointments"},
-            {"label": "Sessions Conducted", "value": str(session_count_res.scalar()), "type": "sessions"},
-            {"label": "Avg Rating", "value": "4.9", "type": "rating"}
-        ]
-        
-    elif current_user.role == models.UserRole.RECEPTIONIST:
-        # FIX: Run all COUNT queries concurrently instead of sequentially
-        patient_count_res, app_count_res = await asyncio.gather(
-            db.execute(
-                select(func.count(models.Patient.id))
-                .where(models.Patient.created_by_id == current_user.id)
-            ),
-            db.execute(
-                select(func.count(models.Appointment.id))
-                .where(models.Appointment.organization_id == current_user.organization_id)
-            ),
+        if scope_org is not None:
+            rollup = rollup.where(R.organization_id == scope_org)
+        if doctor_id is not None:
+            rollup = rollup.where(R.doctor_id == doctor_id)
+        if status is not None:
+            rollup = rollup.where(R.status == status.value)
+        statements.append(rollup)
+
+    # Current bucket — live count over the appointments themselves
+    A = models.Appointment
+    if live_from <= end:
+        live_day = literal_column("(appointments.appointment_date AT TIME ZONE 'UTC')")
+        live_bucket = func.date_trunc(unit, live_day).label("bucket")
+        live_key = _LIVE_GROUP_COLUMNS.get(group_by)
+        live = (
+            select(*_grouped([live_bucket, func.count().label("count")], live_key))
+            .where(
+                A.appointment_date >= datetime.combine(live_from, datetime.min.time()),
+                A.appointment_date < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+            )
+            .group_by(*_grouped([live_bucket], live_key))
         )
-        
-        stats = [
-            {"label": "Patients Registered", "value": str(patient_count_res.scalar()), "type": "patients"},
-            {"label": "Org Appointments", "value": str(app_count_res.scalar()), "type": "appointments"},
-            {"label": "Active Slots", "value": "12", "type": "slots"},
-            {"label": "Check-ins Today", "value": "8", "type": "checkins"}
-        ]
+        if scope_org is not None:
+            live = live.where(A.organization_id == scope_org)
+        if doctor_id is not None:
+            live = live.where(A.doctor_id == doctor_id)
+        if status is not None:
+            live = live.where(A.status == status)
+        statements.append(live)
+
+    totals = defaultdict(int)
+    for result in await parallel(*statements):
+        for row in result:
+            bucket_day = row.bucket.date() if isinstance(row.bucket, datetime) else row.bucket
+            totals[(bucket_day, _key(getattr(row, "key", None)))] += int(row.count)
 
-    return stats
\ No newline at end of file
+    points = [
+        schemas.TimeseriesPoint(bucket=b, key=k, count=n)
+        for (b, k), n in sorted(totals.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+    ]
+    return schemas.AppointmentTimeseries(bucket=bucket, group_by=group_by, start=start, end=end, points=points)
@@ -4,6 +4,7 @@ from sqlalchemy.future import select
 from sqlalchemy import case
 from typing import List
 from .. import models, schemas, dependencies, database
+from ..principal import Principal
 
 router = APIRouter(prefix="/organizations", tags=["Working Hours"])
 
@@ -24,8 +25,8 @@ DAY_ORDER = case(
 @router.get("/{org_id}/working-hours", response_model=List[schemas.ScheduleOut])
 async def get_working_hours(
     org_id: int,
-    current_user: models.User = Depends(dependencies.get_current_user),
-    db: AsyncSession = Depends(database.get_db)
+    current_user: Principal = Depends(dependencies.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
     org_res = await db.execute(
         select(models.Organization).where(models.Organization.id == org_id)
@@ -51,7 +52,7 @@ async def get_working_hours(
 async def set_working_hours(
     org_id: int,
     schedule: schemas.WorkingHoursUpdate,
-    current_user: models.User = Depends(dependencies.require_role([
+    current_user: Principal = Depends(dependencies.require_role([
         models.UserRole.HOSPITAL,
         models.UserRole.SUPER_ADMIN
     ])),
@@ -177,6 +177,11 @@ class PatientOut(PatientBase):
         }
 
 
+class PatientSearchHit(PatientOut):
+    score: float
+    last_appointment_at: Optional[datetime] = None
+
+
 class SessionBase(BaseModel):
     patient_id: int
     doctor_id: int
@@ -197,12 +202,11 @@ class SessionCreate(BaseModel):
     soap_notes:     Optional[SOAPNote] = None
 
 
-class SessionOut(SessionBase):
+class SessionSummaryOut(SessionBase):
+    """Session metadata for list views — transcript and summary are left out."""
     id: int
     appointment_id: Optional[int] = None
     soap_notes:     Optional[SOAPNote] = None
-    summary:        Optional[str] = None
-    transcript:     Optional[str] = None
     version:        int
 
     @field_validator("soap_notes", mode="before")
@@ -223,6 +227,51 @@ class SessionOut(SessionBase):
         }
 
 
+class SessionOut(SessionSummaryOut):
+    summary:        Optional[str] = None
+    transcript:     Optional[str] = None
+
+
+class SessionSearchHit(BaseModel):
+    id:                 int
+    patient_id:         int
+    doctor_id:          int
+    appointment_id:     Optional[int] = None
+    date:               datetime
+    rank:               float
+    summary_snippet:    Optional[str] = None    # matches wrapped in <mark>…</mark>
+    transcript_snippet: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+        json_encoders = {
+            datetime: lambda v: v.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class TranscriptWindow(BaseModel):
+    session_id: int
+    unit:       str    # "chars" or "lines"
+    start:      int
+    count:      int
+    total:      int    # total chars / lines in the transcript
+    text:       str
+
+
+class TimeseriesPoint(BaseModel):
+    bucket: date                   # first day of the day / week / month
+    key:    Optional[str] = None   # group_by value (doctor id, status or role); None when ungrouped
+    count:  int
+
+
+class AppointmentTimeseries(BaseModel):
+    bucket:   str                  # "day", "week" or "month"
+    group_by: Optional[str] = None
+    start:    date
+    end:      date
+    points:   List[TimeseriesPoint]
+
+
 class UserUpdate(BaseModel):
     full_name: Optional[str] = None
     role: Optional[UserRole] = None
@@ -266,8 +315,77 @@ class AvailabilityBatchCreate(BaseModel):
     duration_minutes: int = 30
 
 
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+class SlotWindow(BaseModel):
+    start_time: str                    # "09:00"
+    end_time:   str                    # "13:00"
+    days:       Optional[List[str]] = None   # "monday" .. "sunday"; None = every day
+
+    @field_validator("start_time", "end_time", mode="before")
+    @classmethod
+    def validate_time_format(cls, v):
+        import re
+        if not isinstance(v, str) or not re.match(r"^\d{2}:\d{2}$", v):
+            raise ValueError("Time must be in HH:MM format e.g. 09:00")
+        try:
+            datetime.strptime(v, "%H:%M")
+        except ValueError:
+            raise ValueError(f"{v} is not a valid time of day")
+        return v
+
+    @field_validator("days", mode="before")
+    @classmethod
+    def validate_days(cls, v):
+        if v is None:
+            return v
+        days = [str(d).lower() for d in v]
+        unknown = [d for d in days if d not in WEEKDAYS]
+        if unknown:
+            raise ValueError(f"Unknown day(s): {', '.join(unknown)}")
+        return days
+
+    @model_validator(mode="after")
+    def check_order(self):
+        if self.end_time <= self.start_time:
+            raise ValueError("end_time must be after start_time")
+        return self
+
+
+class AvailabilityBulkCreate(BaseModel):
+    doctor_ids:       List[int]
+    organization_id:  Optional[int] = None
+    start_date:       date
+    end_date:         date               # inclusive
+    windows:          List[SlotWindow]
+    duration_minutes: int = 30
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "doctor_ids": [5, 6, 7],
+                "start_date": "2026-04-01",
+                "end_date": "2026-06-30",
+                "windows": [
+                    {"start_time": "09:00", "end_time": "12:00", "days": ["monday", "wednesday", "friday"]},
+                    {"start_time": "14:00", "end_time": "17:00"}
+                ],
+                "duration_minutes": 30
+            }
+        }
+
+
+class AvailabilityBulkResult(BaseModel):
+    requested: int                 # slots the windows describe
+    created:   int
+    skipped:   int                 # already existed (same doctor and start time)
+    first_id:  Optional[int] = None
+    last_id:   Optional[int] = None
+
+
 class AvailabilityOut(AvailabilityBase):
-    id: int
+    id: Optional[int] = None           # None for virtual slots — book those via /appointments/book/virtual
     doctor_id: int
     doctor_name: Optional[str] = None
     patient_name: Optional[str] = None
@@ -275,6 +393,7 @@ class AvailabilityOut(AvailabilityBase):
     booked_by_role: Optional[str] = None
     organization_id: int
     is_booked: bool
+    virtual: bool = False
 
     class Config:
         from_attributes = True
@@ -283,6 +402,48 @@ class AvailabilityOut(AvailabilityBase):
         }
 
 
+class TimeBlockCreate(BaseModel):
+    doctor_id: int
+    start_time: datetime
+    end_time: datetime
+    reason: Optional[str] = None
+
+
+class TimeBlockOut(TimeBlockCreate):
+    id: int
+    organization_id: int
+
+    class Config:
+        from_attributes = True
+        json_encoders = {
+            datetime: lambda v: v.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class FreeWindowOut(BaseModel):
+    doctor_id: int
+    start_time: datetime
+    end_time: datetime
+    availability_ids: List[int]        # open slots covering the window — book these
+
+    class Config:
+        from_attributes = True
+        json_encoders = {
+            datetime: lambda v: v.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class SlotDurationUpdate(BaseModel):
+    slot_duration_minutes: Optional[int] = None   # None restores the default
+
+
+class VirtualBookingCreate(BaseModel):
+    patient_id: int
+    doctor_id: int
+    start_time: datetime
+    notes: Optional[str] = None
+
+
 class AppointmentBase(BaseModel):
     patient_id: int
     doctor_id: int
@@ -297,6 +458,14 @@ class AppointmentCreate(AppointmentBase):
     
 
 
+class AnySlotBookingCreate(BaseModel):
+    patient_id: int
+    doctor_id: int
+    window_start: datetime
+    window_end: datetime
+    notes: Optional[str] = None
+
+
 class AppointmentOut(AppointmentBase):
     id: int
     status: str
@@ -313,6 +482,79 @@ class AppointmentOut(AppointmentBase):
         }
 
 
+BULK_BOOKING_MODES = ["all_or_nothing", "best_effort"]
+
+
+class BulkBookingItem(BaseModel):
+    patient_id: int
+    availability_id: int
+    notes: Optional[str] = None
+
+
+class BookingRecurrence(BaseModel):
+    patient_id: int
+    doctor_id: int
+    first_start: datetime          # start of the first slot; later ones every `every_days` days
+    every_days: int = 7
+    count: int
+    notes: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.every_days < 1:
+            raise ValueError("every_days must be at least 1")
+        if not 1 <= self.count <= 52:
+            raise ValueError("count must be between 1 and 52")
+        return self
+
+
+class BulkBookingCreate(BaseModel):
+    items:      Optional[List[BulkBookingItem]] = None
+    recurrence: Optional[BookingRecurrence] = None
+    mode:       str = "all_or_nothing"
+
+    @model_validator(mode="after")
+    def check_request(self):
+        if (self.items is None) == (self.recurrence is None):
+            raise ValueError("Send either items or recurrence")
+        if self.items is not None and not self.items:
+            raise ValueError("items must not be empty")
+        if self.mode not in BULK_BOOKING_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(BULK_BOOKING_MODES)}")
+        return self
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "recurrence": {
+                    "patient_id": 12,
+                    "doctor_id": 5,
+                    "first_start": "2026-04-06 10:00:00",
+                    "every_days": 7,
+                    "count": 8
+                },
+                "mode": "best_effort"
+            }
+        }
+
+
+class BulkBookingFailure(BaseModel):
+    patient_id:      int
+    availability_id: Optional[int] = None
+    start_time:      Optional[datetime] = None
+    reason:          str
+
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class BulkBookingResult(BaseModel):
+    booked: List[AppointmentOut]
+    failed: List[BulkBookingFailure]
+
+
 class AppointmentUpdate(BaseModel):
     status: Optional[str] = None
     notes: Optional[str] = None
@@ -0,0 +1,121 @@
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import true
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import UserRole, Patient, Session, Appointment, Availability, DoctorTimeBlock
+
+
+# -------------------------------------------------------------------
+# Access scopes — which rows of an entity a principal may see.
+#
+# Each rule is a join path plus a WHERE clause built from the principal.
+# Principal values go in as bound parameters, so SQLAlchemy's statement
+# cache compiles each (entity, role) shape once and reuses it.
+# -------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Scope:
+    joins: Tuple[tuple, ...]   # (target, onclause) pairs, applied in order
+    clause: object             # SQL boolean expression
+
+
+_SESSION_PATIENT = ((Patient, Session.patient_id == Patient.id),)
+
+_RULES: dict = {
+    Patient: {
+        UserRole.SUPER_ADMIN:  lambda p: Scope((), true()),
+        UserRole.HOSPITAL:     lambda p: Scope((), Patient.organization_id == p.organization_id),
+        UserRole.DOCTOR:       lambda p: Scope((), Patient.doctor_id == p.id),
+        UserRole.RECEPTIONIST: lambda p: Scope((), Patient.organization_id == p.organization_id),
+    },
+    Session: {
+        UserRole.SUPER_ADMIN:  lambda p: Scope((), true()),
+        UserRole.HOSPITAL:     lambda p: Scope(_SESSION_PATIENT, Patient.organization_id == p.organization_id),
+        UserRole.DOCTOR:       lambda p: Scope((), Session.doctor_id == p.id),
+        UserRole.RECEPTIONIST: lambda p: Scope(_SESSION_PATIENT, Patient.created_by_id == p.id),
+    },
+    Appointment: {
+        UserRole.SUPER_ADMIN:  lambda p: Scope((), true()),
+        UserRole.HOSPITAL:     lambda p: Scope((), Appointment.organization_id == p.organization_id),
+        UserRole.DOCTOR:       lambda p: Scope((), Appointment.doctor_id == p.id),
+        UserRole.RECEPTIONIST: lambda p: Scope((), Appointment.organization_id == p.organization_id),
+    },
+    Availability: {
+        UserRole.SUPER_ADMIN:  lambda p: Scope((), true()),
+        UserRole.HOSPITAL:     lambda p: Scope((), Availability.organization_id == p.organization_id),
+        UserRole.DOCTOR:       lambda p: Scope((), Availability.doctor_id == p.id),
+        UserRole.RECEPTIONIST: lambda p: Scope((), Availability.organization_id == p.organization_id),
+    },
+    DoctorTimeBlock: {
+        UserRole.SUPER_ADMIN:  lambda p: Scope((), true()),
+        UserRole.HOSPITAL:     lambda p: Scope((), DoctorTimeBlock.organization_id == p.organization_id),
+        UserRole.DOCTOR:       lambda p: Scope((), DoctorTimeBlock.doctor_id == p.id),
+        UserRole.RECEPTIONIST: lambda p: Scope((), DoctorTimeBlock.organization_id == p.organization_id),
+    },
+}
+
+
+def scope_for(principal, entity) -> Optional[Scope]:
+    """Returns the principal's scope on `entity`, or None if the role has no access at all."""
+    rule: Optional[Callable] = _RULES[entity].get(principal.role)
+    return rule(principal) if rule else None
+
+
+def apply_scope(query, principal, entity):
+    """Restricts a select() of `entity` to the principal's rows; 403 for roles without access."""
+    scope = scope_for(principal, entity)
+    if scope is None:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    for target, onclause in scope.joins:
+        query = query.join(target, onclause)
+    return query.where(scope.clause)
+
+
+async def _fetch_scoped_row(db: AsyncSession, principal, entity, entity_id: int, columns, options, not_found: str):
+    scope = scope_for(principal, entity)
+    if scope is None:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    query = select(*columns, scope.clause.label("in_scope"))
+    for target, onclause in scope.joins:
+        query = query.outerjoin(target, onclause)
+    query = query.select_from(entity).where(entity.id == entity_id).options(*options)
+
+    row = (await db.execute(query)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if not row.in_scope:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return row
+
+
+async def fetch_scoped(
+    db: AsyncSession,
+    principal,
+    entity,
+    entity_id: int,
+    options: tuple = (),
+    not_found: str = "Not found",
+):
+    """
+    Loads one row and checks access in a single query: the scope clause is
+    selected as a boolean next to the row, so "missing" (404) and
+    "not yours" (403) are both answered by the database.
+    """
+    row = await _fetch_scoped_row(db, principal, entity, entity_id, (entity,), options, not_found)
+    return row[0]
+
+
+async def fetch_scoped_columns(
+    db: AsyncSession,
+    principal,
+    entity,
+    entity_id: int,
+    columns: tuple,
+    not_found: str = "Not found",
+):
+    """Like fetch_scoped, but returns only the given column expressions (a Row) instead of the entity."""
+    return await _fetch_scoped_row(db, principal, entity, entity_id, columns, (), not_found)
@@ -0,0 +1,92 @@
+
+from sqlalchemy import func, literal, literal_column, update, or_, case
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Session, Patient
+
+# Postgres text search configuration used for both indexing and querying —
+# they must match or stemmed lexemes won't line up.
+SEARCH_CONFIG = "english"
+
+# ts_headline options: a few short fragments instead of the whole document
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=3, MaxWords=20, MinWords=5, FragmentDelimiter= … "
+
+
+# -------------------------------------------------------------------
+# Session full-text search
+# -------------------------------------------------------------------
+
+def session_search_vector():
+    """summary (weight A) + transcript (weight B), computed from the row's current columns."""
+    config = literal(SEARCH_CONFIG, type_=REGCONFIG)
+    return (
+        func.setweight(func.to_tsvector(config, func.coalesce(Session.summary, "")), "A")
+        .op("||")(func.setweight(func.to_tsvector(config, func.coalesce(Session.transcript, "")), "B"))
+    )
+
+
+async def refresh_session_search_vector(db: AsyncSession, session_id: int) -> None:
+    """
+    Recomputes one session's search_vector inside the caller's transaction.
+    Runs as UPDATE … SET search_vector = f(summary, transcript) so the text
+    isn't sent to the database a second time. Call after flush, before commit.
+    """
+    await db.execute(
+        update(Session)
+        .where(Session.id == session_id)
+        .values(search_vector=session_search_vector())
+        .execution_options(synchronize_session=False)
+    )
+
+
+def session_search_query(q: str):
+    return func.websearch_to_tsquery(literal(SEARCH_CONFIG, type_=REGCONFIG), q)
+
+
+def headline(column, tsquery):
+    return func.ts_headline(literal(SEARCH_CONFIG, type_=REGCONFIG), func.coalesce(column, ""), tsquery, literal(HEADLINE_OPTIONS))
+
+
+# -------------------------------------------------------------------
+# Patient lookup (pg_trgm)
+#
+# Every predicate below matches an index expression from the
+# idx_patient_*_trgm online migrations exactly, so Postgres can use the
+# GIN trigram indexes for both substring (ILIKE) and fuzzy (<%) matches.
+# -------------------------------------------------------------------
+
+def patient_phone_digits():
+    """Digits-only phone — same expression as idx_patient_phone_digits_trgm."""
+    # Inline constants, not bind params: the planner only matches an
+    # expression index when the arguments are literally the same.
+    return func.regexp_replace(Patient.phone, literal_column(r"'\D'"), literal_column("''"), literal_column("'g'"))
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def patient_match(q: str, digits: str):
+    """WHERE clause for /patients/search: substring or fuzzy name, substring email, phone digits."""
+    pattern = f"%{escape_like(q)}%"
+    clauses = [
+        Patient.full_name.ilike(pattern),
+        literal(q).op("<%")(Patient.full_name),     # word_similarity above threshold — typos
+        Patient.email.ilike(pattern),
+    ]
+    if len(digits) >= 3:
+        clauses.append(patient_phone_digits().like(f"%{digits}%"))
+    return or_(*clauses)
+
+
+def patient_text_score(q: str, digits: str):
+    """0..1 — prefix matches first, then trigram word similarity on name, then email/phone hits."""
+    score = func.greatest(
+        case((Patient.full_name.ilike(f"{escape_like(q)}%"), 1.0), else_=0.0),
+        func.word_similarity(q, Patient.full_name),
+        case((Patient.email.ilike(f"{escape_like(q)}%"), 0.9), else_=0.0),
+    )
+    if len(digits) >= 3:
+        score = func.greatest(score, case((patient_phone_digits().like(f"%{digits}%"), 0.95), else_=0.0))
+    return score
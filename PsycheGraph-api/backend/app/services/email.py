@@ -153,4 +153,33 @@ Please ensure you are available at the new time.
 Regards,
 PsycheGraph Team
 """
-    _send(to_email, subject, body)
\ No newline at end of file
+    _send(to_email, subject, body)
+
+
+def send_meet_links_email(to_email: str, recipient_name: str, meetings: list):
+    """One reminder for several appointments that start together (group and bulk bookings)."""
+    subject = f"PsycheGraph - Your {len(meetings)} Appointments Start in 30 Minutes"
+    details = "\n".join(
+        f"""Patient       : {m["patient_name"]}
+Doctor Name   : Dr. {m["doctor_name"]}
+Date          : {m["appointment_date"]}
+Start Time    : {m["start_time"]}
+End Time      : {m["end_time"]}
+Google Meet   : {m["meet_link"]}
+-----------------------------"""
+        for m in meetings
+    )
+    body = f"""Dear {recipient_name},
+
+The following appointments are starting in 30 minutes!
+
+Appointment Details:
+-----------------------------
+{details}
+
+Please join the meetings on time.
+
+Regards,
+PsycheGraph Team
+"""
+    _send(to_email, subject, body)
@@ -0,0 +1,84 @@
+from typing import Optional, Type
+import csv
+import io
+import json
+import logging
+import os
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+logger = logging.getLogger("streaming")
+
+# Rows fetched per round trip from the server-side cursor
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", 500))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+def stream_format(request: Request, format: Optional[str]) -> Optional[str]:
+    """'ndjson' / 'csv' when the caller asked for a streamed export, else None."""
+    if format:
+        if format not in ("ndjson", "csv", "json"):
+            raise HTTPException(status_code=400, detail="format must be one of: json, ndjson, csv")
+        return None if format == "json" else format
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return "ndjson"
+    return None
+
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return "" if value is None else value
+
+
+async def _rows(session_factory, query, schema: Type[BaseModel]):
+    # The request's own session is closed before the body streams, so the
+    # export opens a session of its own and keeps it for the whole cursor.
+    async with session_factory() as db:
+        result = await db.stream_scalars(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        async for batch in result.partitions(STREAM_BATCH_SIZE):
+            for obj in batch:
+                yield schema.model_validate(obj).model_dump(mode="json")
+            # Drop the batch from the identity map so memory stays flat
+            db.expunge_all()
+
+
+def stream_response(session_factory, query, schema: Type[BaseModel], fmt: str, filename: str) -> StreamingResponse:
+    """Streams `query` row by row as NDJSON or CSV, serialized through `schema`."""
+
+    async def ndjson():
+        try:
+            async for row in _rows(session_factory, query, schema):
+                yield json.dumps(row) + "\n"
+        except Exception as e:
+            logger.error(f"{filename} export failed mid-stream: {e}")
+            raise
+
+    async def csv_lines():
+        columns = list(schema.model_fields)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        try:
+            async for row in _rows(session_factory, query, schema):
+                writer.writerow([_csv_value(row.get(c)) for c in columns])
+                if buffer.tell() >= 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        except Exception as e:
+            logger.error(f"{filename} export failed mid-stream: {e}")
+            raise
+        yield buffer.getvalue()
+
+    if fmt == "csv":
+        return StreamingResponse(
+            csv_lines(),
+            media_type=CSV_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        )
+    return StreamingResponse(ndjson(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,195 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import Iterator, List, Optional, Tuple
+import os
+
+from sqlalchemy import text
+from sqlalchemy.future import select
+
+from . import models
+from .counters import now_ist_naive
+from .schemas import WEEKDAYS
+
+# Slot length for doctors without their own slot_duration_minutes
+DEFAULT_SLOT_MINUTES = int(os.getenv("DEFAULT_SLOT_MINUTES", 30))
+# Widest window one virtual listing may cover
+VIRTUAL_SLOT_MAX_DAYS = int(os.getenv("VIRTUAL_SLOT_MAX_DAYS", 31))
+# pg advisory lock namespace — (namespace, doctor_id) serializes one doctor's virtual bookings
+VIRTUAL_BOOKING_LOCK_NAMESPACE = 7_340_028
+
+
+# -------------------------------------------------------------------
+# Virtual slots
+#
+# Open time is derived on the fly from the organization's working
+# hours (OrganizationSchedule), each doctor's slot length, and what is
+# already taken: existing availability rows, live appointments and
+# doctor_time_blocks. Nothing is stored until a slot is booked — the
+# booking materializes exactly one Availability row.
+#
+# Times are naive IST wall-clock values, like every stored slot.
+# -------------------------------------------------------------------
+
+def _hhmm(value: Optional[str]) -> Optional[time]:
+    return datetime.strptime(value, "%H:%M").time() if value else None
+
+
+def working_windows(schedule) -> List[Tuple[time, time]]:
+    """(start, end) times a schedule day is open, with its break cut out."""
+    if schedule is None or not schedule.is_enabled:
+        return []
+    start, end = _hhmm(schedule.start_time), _hhmm(schedule.end_time)
+    if not start or not end or end <= start:
+        return []
+    break_start, break_end = _hhmm(schedule.break_start), _hhmm(schedule.break_end)
+    if not break_start or not break_end or break_end <= break_start:
+        return [(start, end)]
+    windows = [(start, min(end, break_start)), (max(start, break_end), end)]
+    return [(s, e) for s, e in windows if s < e]
+
+
+def _merge(intervals: list) -> list:
+    """Sorted, non-overlapping (start, end) pairs."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class SlotEngine:
+    """Everything needed to enumerate one organization's virtual slots over a window, loaded up front."""
+
+    def __init__(self, organization_id: int, schedules: dict, doctors: list, busy: dict):
+        self.organization_id = organization_id
+        self.schedules = schedules      # day name -> OrganizationSchedule
+        self.doctors = doctors          # [(user_id, full_name, slot minutes)] by user_id
+        self.busy = busy                # doctor_id -> merged [(start, end)]
+
+    def slots(self, start: datetime, end: datetime, after: Optional[tuple] = None) -> Iterator[dict]:
+        """Free slots starting in [start, end), ordered by (start_time, doctor_id), strictly after `after`."""
+        day = start.date()
+        while day <= end.date():
+            windows = working_windows(self.schedules.get(WEEKDAYS[day.weekday()]))
+            found = []
+            for doctor_id, doctor_name, minutes in self.doctors:
+                busy = self.busy.get(doctor_id, [])
+                step = timedelta(minutes=minutes)
+                i = 0
+                for window_start, window_end in windows:
+                    slot_start = datetime.combine(day, window_start)
+                    close = datetime.combine(day, window_end)
+                    while slot_start + step <= close:
+                        slot_end = slot_start + step
+                        while i < len(busy) and busy[i][1] <= slot_start:
+                            i += 1
+                        taken = i < len(busy) and busy[i][0] < slot_end
+                        if (
+                            not taken and start <= slot_start < end
+                            and (after is None or (slot_start, doctor_id) > after)
+                        ):
+                            found.append({
+                                "id": None,
+                                "doctor_id": doctor_id,
+                                "doctor_name": doctor_name,
+                                "organization_id": self.organization_id,
+                                "start_time": slot_start,
+                                "end_time": slot_end,
+                                "is_booked": False,
+                                "virtual": True,
+                            })
+                        slot_start = slot_end
+            found.sort(key=lambda s: (s["start_time"], s["doctor_id"]))
+            yield from found
+            day += timedelta(days=1)
+
+
+async def load_engine(db, organization_id: int, start: datetime, end: datetime,
+                      doctor_ids: Optional[List[int]] = None) -> SlotEngine:
+    """Four reads — schedule, doctors, taken time and blocks — then everything else is in memory."""
+    schedule_res = await db.execute(
+        select(models.OrganizationSchedule).where(models.OrganizationSchedule.organization_id == organization_id)
+    )
+    schedules = {row.day: row for row in schedule_res.scalars().all()}
+
+    doctor_query = (
+        select(models.User.id, models.User.full_name, models.Doctor.slot_duration_minutes)
+        .join(models.Doctor, models.Doctor.user_id == models.User.id)
+        .where(
+            models.User.organization_id == organization_id,
+            models.User.role == models.UserRole.DOCTOR,
+            models.User.is_active == True
+        )
+        .order_by(models.User.id)
+    )
+    if doctor_ids:
+        doctor_query = doctor_query.where(models.User.id.in_(doctor_ids))
+    doctors = [
+        (row.id, row.full_name, row.slot_duration_minutes or DEFAULT_SLOT_MINUTES)
+        for row in (await db.execute(doctor_query)).all()
+    ]
+    if not schedules or not doctors:
+        return SlotEngine(organization_id, schedules, [], {})
+
+    ids = [d[0] for d in doctors]
+    # Slots and appointments are short; a one-day lead catches any that start before the window and run into it
+    lead = start - timedelta(days=1)
+    taken = []
+    taken += (await db.execute(
+        select(models.Availability.doctor_id, models.Availability.start_time, models.Availability.end_time)
+        .where(
+            models.Availability.doctor_id.in_(ids),
+            models.Availability.start_time >= lead,
+            models.Availability.start_time < end
+        )
+    )).all()
+    taken += (await db.execute(
+        select(models.Appointment.doctor_id, models.Appointment.start_time, models.Appointment.end_time)
+        .where(
+            models.Appointment.doctor_id.in_(ids),
+            models.Appointment.start_time >= lead,
+            models.Appointment.start_time < end,
+            models.Appointment.status != models.AppointmentStatus.CANCELLED
+        )
+    )).all()
+    taken += (await db.execute(
+        select(models.DoctorTimeBlock.doctor_id, models.DoctorTimeBlock.start_time, models.DoctorTimeBlock.end_time)
+        .where(
+            models.DoctorTimeBlock.doctor_id.in_(ids),
+            models.DoctorTimeBlock.start_time < end,
+            models.DoctorTimeBlock.end_time > start
+        )
+    )).all()
+
+    busy = defaultdict(list)
+    for doctor_id, busy_start, busy_end in taken:
+        busy[doctor_id].append((busy_start.replace(tzinfo=None), busy_end.replace(tzinfo=None)))
+    return SlotEngine(organization_id, schedules, doctors, {d: _merge(v) for d, v in busy.items()})
+
+
+async def is_virtual_slot(db, organization_id: int, doctor_id: int, start_time: datetime) -> Optional[dict]:
+    """The virtual slot for this doctor starting exactly at start_time, if it is open right now."""
+    if start_time < now_ist_naive():
+        return None
+    day_start = datetime.combine(start_time.date(), time.min)
+    engine = await load_engine(db, organization_id, day_start, day_start + timedelta(days=1), [doctor_id])
+    for slot in engine.slots(start_time, start_time + timedelta(seconds=1)):
+        if slot["doctor_id"] == doctor_id:
+            return slot
+    return None
+
+
+async def lock_doctor_bookings(db, doctor_id: int) -> None:
+    """
+    Serializes virtual bookings of one doctor until the caller's transaction
+    ends. uq_doctor_start_time only stops two bookers of the same start
+    time; overlapping slots with different starts (after a slot-length
+    change, or next to a stored slot) need the free check and the insert
+    to run one booker at a time.
+    """
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(CAST(:namespace AS int), CAST(:doctor_id AS int));"),
+        {"namespace": VIRTUAL_BOOKING_LOCK_NAMESPACE, "doctor_id": doctor_id}
+    )
@@ -0,0 +1,137 @@
+"""
+Converts availabilities and appointments into tables range-partitioned by
+month (see app/partitions.py). Opt-in and offline: both tables are locked
+for the whole conversion, so run it in a maintenance window.
+
+    python partition_tables.py            # convert
+    python partition_tables.py --dry-run  # print the plan, change nothing
+
+Keys change as Postgres requires for partitioned tables:
+  availabilities  PRIMARY KEY (id, start_time); uq_doctor_start_time is unchanged
+  appointments    PRIMARY KEY (id, appointment_date);
+                  UNIQUE (availability_id, appointment_date) — the same rule as
+                  UNIQUE (availability_id), since an appointment's date is
+                  always its slot's start time;
+                  FOREIGN KEY (availability_id, appointment_date)
+                    REFERENCES availabilities (id, start_time)
+  sessions        the appointment_id foreign key is dropped (a partitioned
+                  table's id alone can't be referenced); the column and its
+                  unique index stay
+"""
+import asyncio
+import re
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.partitions import (
+    PARTITIONED_TABLES, PARTITION_MONTHS_AHEAD, add_months, month_start, partition_ddl, partitioned_tables
+)
+
+PRIMARY_KEYS = {
+    "availabilities": "(id, start_time)",
+    "appointments":   "(id, appointment_date)",
+}
+
+# Foreign keys re-added once both tables are converted
+FINAL_FOREIGN_KEYS = [
+    ("appointments", "appointments_availability_id_fkey",
+     "FOREIGN KEY (availability_id, appointment_date) REFERENCES availabilities (id, start_time) "
+     "DEFERRABLE INITIALLY IMMEDIATE"),
+]
+
+_COLUMNS = re.compile(r"\(([^()]*)\)\s*$")
+
+
+def with_range_key(definition: str, key: str, unique: bool) -> str:
+    """Unique constraints / indexes on a partitioned table must include the range key."""
+    if not unique or key in definition:
+        return definition
+    return _COLUMNS.sub(lambda m: f"({m.group(1)}, {key})", definition)
+
+
+async def _rows(conn, sql, **params):
+    return (await conn.execute(text(sql), params)).all()
+
+
+async def convert_table(conn, table: str, run):
+    key = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+
+    sequence = (await conn.execute(text(f"SELECT pg_get_serial_sequence('{table}', 'id');"))).scalar()
+    constraints = await _rows(
+        conn,
+        "SELECT conname, contype, pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+        "WHERE conrelid = CAST(:t AS regclass) AND contype IN ('u', 'f', 'c');",
+        t=table,
+    )
+    indexes = await _rows(
+        conn,
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = :t AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = CAST(:t AS regclass));",
+        t=table,
+    )
+    first, last = (await conn.execute(text(f"SELECT min({key}), max({key}) FROM {table};"))).one()
+
+    this_month = month_start(datetime.now(timezone(timedelta(hours=5, minutes=30))).date())
+    month = month_start(first.date()) if first else this_month
+    final = max(month_start(last.date()) if last else this_month, add_months(this_month, PARTITION_MONTHS_AHEAD))
+
+    await run(f"ALTER TABLE {table} RENAME TO {legacy};")
+    if sequence:
+        await run(f"ALTER SEQUENCE {sequence} OWNED BY NONE;")
+    await run(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING GENERATED) PARTITION BY RANGE ({key});")
+    while month <= final:
+        await run(partition_ddl(table, month))
+        month = add_months(month, 1)
+    await run(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+    await run(f"INSERT INTO {table} SELECT * FROM {legacy};")
+    # CASCADE drops foreign keys pointing at the old table (re-added below / at the end)
+    await run(f"DROP TABLE {legacy} CASCADE;")
+    if sequence:
+        await run(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id;")
+
+    await run(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY {PRIMARY_KEYS[table]};")
+    for name, contype, definition in constraints:
+        if contype == "f" and "REFERENCES availabilities(" in definition:
+            continue  # replaced by FINAL_FOREIGN_KEYS
+        await run(f"ALTER TABLE {table} ADD CONSTRAINT {name} {with_range_key(definition, key, contype == 'u')};")
+    for name, definition in indexes:
+        await run(with_range_key(definition, key, definition.startswith("CREATE UNIQUE")) + ";")
+
+
+async def main(dry_run: bool):
+    async with engine.begin() as conn:
+        already = await partitioned_tables(conn) & set(PARTITIONED_TABLES)
+        if already:
+            print(f"Already partitioned: {', '.join(sorted(already))} — nothing to do.")
+            return
+
+        async def run(sql):
+            print(sql)
+            if not dry_run:
+                await conn.execute(text(sql))
+
+        await run("SET LOCAL lock_timeout = '30s';")
+        await run("LOCK TABLE availabilities, appointments, sessions IN ACCESS EXCLUSIVE MODE;")
+        mismatched = (await conn.execute(text(
+            "SELECT count(*) FROM appointments a JOIN availabilities s ON s.id = a.availability_id "
+            "WHERE a.appointment_date <> s.start_time;"
+        ))).scalar()
+        if mismatched:
+            raise SystemExit(f"{mismatched} appointment(s) have appointment_date != slot start_time; fix them first.")
+
+        # sessions → appointments(id) can't survive the conversion
+        await run("ALTER TABLE sessions DROP CONSTRAINT IF EXISTS sessions_appointment_id_fkey;")
+        for table in PARTITIONED_TABLES:
+            await convert_table(conn, table, run)
+        for table, name, definition in FINAL_FOREIGN_KEYS:
+            await run(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition};")
+
+        print("Dry run — no changes made." if dry_run else "Conversion complete.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--dry-run" in sys.argv))
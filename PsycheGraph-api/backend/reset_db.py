@@ -7,6 +7,8 @@ async def reset_db():
         print("Dropping legacy/blocking tables...")
         from sqlalchemy import text
         await conn.execute(text("DROP TABLE IF EXISTS audit_logs CASCADE"))
+        # Forces the next app start to re-run create_all and migrations
+        await conn.execute(text("DROP TABLE IF EXISTS schema_state"))
         
         print("Dropping all tables...")
         await conn.run_sync(Base.metadata.drop_all)